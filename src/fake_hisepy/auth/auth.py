@@ -1,4 +1,8 @@
+import base64
+import json
 import os
+import threading
+import time
 
 import requests
 
@@ -17,30 +21,126 @@ default_metadata = {
     server_id_path: "dev.allenimmunology.org"
 }
 
+# seconds a metadata value stays cached. None means the value can't change
+# for the lifetime of the instance, so it is resolved once per kernel.
+# 0 means never cache (identity tokens are cached by expiry instead)
+metadata_ttl = {
+    instance_name_path: None,
+    server_id_path: None,
+    client_id_path: None,
+    account_guid_path: 300,
+    identity_path: 0
+}
+default_metadata_ttl = 300
+# once the metadata server is unreachable (i.e we're not on GCE), stop asking
+# for this many seconds and go straight to default_metadata
+metadata_unreachable_ttl = 60
+metadata_timeout = 2
+
+# path -> (value, expiry in time.monotonic() seconds or None)
+_metadata_cache = {}
+_metadata_unreachable_until = 0
+_metadata_lock = threading.Lock()
+
+# reuse a bearer token until this many seconds before it expires. Inside this
+# window the token is still handed out, but a new one is minted in the background.
+# Short-lived tokens use at most half their lifetime as the window
+token_refresh_margin = 300
+# tokens without a readable "exp" claim (e.g. from a TOKEN_GENERATOR) are reused this long
+default_token_ttl = 3600
+
 # dev primecollective
 defaultLocalAccountGuid = "10f58583-1cdf-4f18-8de4-dc1ca94783e2"
 
 
-def get_from_metadata_server(path):
+def _metadata_ttl_for(path):
+    """ Returns the cache ttl for a metadata path, ignoring any query string """
+    return metadata_ttl.get(path.split("?")[0], default_metadata_ttl)
+
+
+def _request_metadata(path):
+    """ 
+    Asks the metadata server for a path. Returns a tuple (value, from_server), 
+    where from_server is False if a default value had to be used
+    """
+    global _metadata_unreachable_until
     try:
-        resp = requests.request("GET",
-                                "%s/%s" % (metadata_server_root, path),
-                                headers={"Metadata-Flavor": "Google"})
+        if time.monotonic() < _metadata_unreachable_until:
+            raise SystemError("Metadata server was recently unreachable")
+        try:
+            resp = requests.request("GET",
+                                    "%s/%s" % (metadata_server_root, path),
+                                    headers={"Metadata-Flavor": "Google"},
+                                    timeout=metadata_timeout)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            with _metadata_lock:
+                _metadata_unreachable_until = time.monotonic(
+                ) + metadata_unreachable_ttl
+            raise
         if resp.status_code != 200:
             raise SystemError("Request to %s failed with status %d. %s" %
                               (path, resp.status_code, resp.text))
-        value = resp.text
+        return resp.text, True
     except:
         if path in default_metadata:
             print("Returning default value for %s" % path)
-            value = default_metadata[path]
+            return default_metadata[path], False
         else:
             raise SystemError(
                 "No default value found for %s. Cannot continue" % path)
+
+
+def get_from_metadata_server(path, refresh: bool = False):
+    """
+    Returns a value from the GCE metadata server, falling back on default_metadata 
+    when the server can't be reached. Values are cached for the ttl given in metadata_ttl.
+
+    Parameters:
+        path (str): path relative to the instance metadata root
+        refresh (bool): ignore any cached value and ask the metadata server again
+    Returns:
+        value as a string
+    """
+    if not refresh:
+        with _metadata_lock:
+            cached = _metadata_cache.get(path)
+        if cached is not None and (cached[1] is None
+                                   or time.monotonic() < cached[1]):
+            return cached[0]
+
+    value, from_server = _request_metadata(path)
+    ttl = _metadata_ttl_for(path)
+    if ttl != 0:
+        # don't pin a default value forever, just until we try the server again
+        if not from_server:
+            ttl = metadata_unreachable_ttl if ttl is None else min(
+                ttl, metadata_unreachable_ttl)
+        with _metadata_lock:
+            _metadata_cache[path] = (value, None if ttl is None else
+                                     time.monotonic() + ttl)
     return value
 
 
-def get_bearer_token_header():
+def invalidate_metadata_cache(path: str = None):
+    """
+    Drops cached metadata values so the next lookup goes back to the metadata server.
+
+    Parameters:
+        path (str): metadata path to drop. If None, the whole cache is cleared,
+            including the record of an unreachable metadata server
+    """
+    global _metadata_unreachable_until
+    with _metadata_lock:
+        if path is None:
+            _metadata_cache.clear()
+            _metadata_unreachable_until = 0
+        else:
+            _metadata_cache.pop(path, None)
+
+
+def _mint_bearer_token_header():
+    """ Fetches a new identity token and returns a tuple (headers, token) """
     client_id = get_from_metadata_server(client_id_path)
     token_gen = os.getenv(token_env)
     if token_gen is not None:
@@ -61,7 +161,110 @@ def get_bearer_token_header():
             "Authorization": "Bearer %s" % token,
             "InstanceAccountGuid": "%s" % account_guid
         }
-    return headers
+    return headers, token
+
+
+def _token_expiry(token):
+    """ Returns the epoch time a JWT expires, read from its "exp" claim """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return time.time() + default_token_ttl
+
+
+class _BearerTokenCache:
+    """ 
+    Thread-safe cache of the bearer token headers. Only one thread mints a token 
+    at a time, and tokens close to expiry are refreshed in the background so 
+    callers don't wait on the metadata server or the token generator.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mint_lock = threading.Lock()
+        self._headers = None
+        self._expiry = 0
+        self._margin = 0
+        self._token_gen = None
+        self._refreshing = False
+
+    def _usable(self, token_gen, refresh_window=False):
+        margin = self._margin if refresh_window else 0
+        return (self._headers is not None and self._token_gen == token_gen
+                and time.time() < self._expiry - margin)
+
+    def _mint(self, token_gen):
+        headers, token = _mint_bearer_token_header()
+        minted = time.time()
+        with self._lock:
+            self._headers = headers
+            self._expiry = _token_expiry(token)
+            self._margin = min(token_refresh_margin,
+                               max(self._expiry - minted, 0) / 2)
+            self._token_gen = token_gen
+        return dict(headers)
+
+    def _background_refresh(self, token_gen):
+        try:
+            with self._mint_lock:
+                if not self._usable(token_gen, refresh_window=True):
+                    self._mint(token_gen)
+        except Exception:
+            # the request threads will mint synchronously once the token expires
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self, refresh=False):
+        token_gen = os.getenv(token_env)
+        if not refresh:
+            with self._lock:
+                if self._usable(token_gen, refresh_window=True):
+                    return dict(self._headers)
+                if self._usable(token_gen):
+                    if not self._refreshing:
+                        self._refreshing = True
+                        threading.Thread(target=self._background_refresh,
+                                         args=(token_gen, ),
+                                         daemon=True).start()
+                    return dict(self._headers)
+
+        with self._mint_lock:
+            # another thread may have minted while we waited
+            if not refresh:
+                with self._lock:
+                    if self._usable(token_gen):
+                        return dict(self._headers)
+            return self._mint(token_gen)
+
+    def invalidate(self):
+        with self._lock:
+            self._headers = None
+            self._expiry = 0
+
+
+_bearer_token_cache = _BearerTokenCache()
+
+
+def get_bearer_token_header(refresh: bool = False):
+    """
+    Returns the authorization headers for a HISE request. The token is reused 
+    until shortly before it expires, so this is cheap to call for every request.
+
+    Parameters:
+        refresh (bool): mint a new token even if the cached one is still valid
+    Returns:
+        dictionary of request headers
+    """
+    return _bearer_token_cache.get(refresh)
+
+
+def invalidate_bearer_token():
+    """ Drops the cached bearer token, e.g. after a request was rejected with a 401 """
+    _bearer_token_cache.invalidate()
 
 
 # use the presence of the token gen env as a proxy for debug env
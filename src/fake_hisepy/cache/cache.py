@@ -0,0 +1,453 @@
+""" cache.py
+
+Description: manifest of the files downloaded into a user's IDE, keyed by file UUID
+    and path, kept in a local sqlite database. Each entry records where the file
+    lives, its size, checksum and when it was downloaded and last used, so files
+    already on disk aren't downloaded again and the least recently used files can be
+    evicted when the cache outgrows its quota.
+    Downloads of the same file are coalesced within a process, and serialized across
+    processes with advisory lock files.
+"""
+
+import atexit
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import fake_hisepy.auth.auth as auth
+from fake_hisepy.format.format import sidecar_suffix
+
+from fake_hisepy.config.config import config as CONFIG
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (e.g. windows). downloads still land atomically via .part files
+    fcntl = None
+
+IDE_HOME_DIR = CONFIG['IDE']['HOME_DIR'] if not auth.debug() else os.getcwd()
+
+lock_suffix = ".lock"
+
+# manifest entry keys, in the order _entries() selects their columns
+_entry_keys = [
+    'id', 'path', 'size', 'mtime', 'checksum', 'verified', 'downloadTime',
+    'lastAccess', 'version', 'descriptors'
+]
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """
+    Holds an exclusive advisory lock on path + ".lock" for the duration of the block,
+    so other processes using the same cache wait for us. The lock file is deleted
+    on release. Not reentrant.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = path + lock_suffix
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    while True:
+        f = open(lock_path, 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            current = os.path.samestat(os.fstat(f.fileno()),
+                                       os.stat(lock_path))
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        # the last holder deleted the lock file while we waited on it
+        f.close()
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """ A class coalescing concurrent calls with the same key into a single call """
+
+    def __init__(self):
+        """ Inits SingleFlight object """
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Runs func, unless a call with the same key is already running, in which case
+        waits for that call and returns its result (or raises its exception).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = func()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_downloads = SingleFlight()
+
+
+def single_flight(key, func):
+    """ Runs func once for all threads of this process asking for the same key at once """
+    return _downloads.do(key, func)
+
+
+def file_checksum(file_path: str, chunk_size: int = None):
+    """ Returns the md5 hex digest of a file, read in chunks """
+    if chunk_size is None:
+        chunk_size = CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE']
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class CacheManifest:
+    """ A class representing the manifest of locally cached HISE files, kept in a
+    sqlite database. A file can be cached at several paths (e.g. by cache_files and
+    by a fileset), and each copy is tracked and counted towards the quota on its own.
+
+    Attributes:
+        path (str): Path of the sqlite database.
+        quota_mb (float): Max total size of cached files in megabytes. 0 or None means no quota.
+        entries (dict): file_id -> list of entry dicts with keys
+            ['id', 'path', 'size', 'mtime', 'checksum', 'verified', 'downloadTime',
+             'lastAccess', 'descriptors', 'version']
+    """
+
+    def __init__(self, path: str, quota_mb: float = None):
+        """ Inits CacheManifest object, creating the database if needed """
+        self.path = path
+        self.quota_mb = quota_mb
+        self._lock = threading.Lock()
+        # (file_id, path) -> lastAccess not yet written by flush()
+        self._accessed = {}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                         "file_id TEXT, path TEXT, size INTEGER, "
+                         "mtime INTEGER, checksum TEXT, verified INTEGER, "
+                         "download_time TEXT, last_access REAL, version TEXT, "
+                         "PRIMARY KEY (file_id, path))")
+            # descriptors are kept apart so recording a file stays a one row write
+            conn.execute("CREATE TABLE IF NOT EXISTS descriptors ("
+                         "file_id TEXT PRIMARY KEY, descriptors TEXT)")
+
+    def _connect(self):
+        # a connection per call keeps the manifest usable from download threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _entries(self, conn, file_id=None, descriptors=True):
+        # quota checks skip the descriptors, which are the bulk of the data
+        columns = (
+            "f.file_id, f.path, f.size, f.mtime, f.checksum, "
+            "f.verified, f.download_time, f.last_access, f.version, %s" %
+            ("d.descriptors" if descriptors else "NULL"))
+        query = "SELECT %s FROM files f" % columns
+        if descriptors:
+            query += " LEFT JOIN descriptors d ON f.file_id = d.file_id"
+        if file_id is None:
+            rows = conn.execute(query).fetchall()
+        else:
+            rows = conn.execute(query + " WHERE f.file_id = ?",
+                                (file_id, )).fetchall()
+        entries = []
+        with self._lock:
+            for row in rows:
+                entry = dict(zip(_entry_keys, row))
+                entry['verified'] = bool(entry['verified'])
+                entry['lastAccess'] = self._accessed.get(
+                    (entry['id'], entry['path']), entry['lastAccess'])
+                if entry['descriptors'] is not None:
+                    entry['descriptors'] = json.loads(entry['descriptors'])
+                entries.append(entry)
+        return entries
+
+    @property
+    def entries(self):
+        """ Every cached copy, grouped by file id """
+        entries = {}
+        with self._connect() as conn:
+            for entry in self._entries(conn):
+                entries.setdefault(entry['id'], []).append(entry)
+        return entries
+
+    def flush(self):
+        """ Saves the last access times of files looked up since the last flush """
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        if len(accessed) == 0:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE files SET last_access = ? "
+                "WHERE file_id = ? AND path = ? AND last_access < ?",
+                [(t, f_id, f_path, t)
+                 for (f_id, f_path), t in accessed.items()])
+
+    def _is_valid(self, entry, verify=False):
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            return False
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime']:
+            return False
+        if entry['verified']:
+            # checked against the server's hash when downloaded, and untouched since
+            return True
+        if verify and entry.get('checksum') is not None:
+            return file_checksum(entry['path']) == entry['checksum']
+        return True
+
+    def lookup(self,
+               file_id,
+               path: str = None,
+               verify: bool = False,
+               version: str = None,
+               file_dir: str = None):
+        """
+        Returns the manifest entry for a file if a cached copy is still on disk and
+        unchanged. If several copies qualify, the most recently used one is returned.
+
+        Parameters:
+            file_id (str): UUID of the file
+            path (str): only accept a cached copy at this path
+            verify (bool): also recompute the checksum of the cached copy, unless it
+                was verified against the server's hash when downloaded
+            version (str): only accept a cached copy recorded with this server version
+            file_dir (str): only accept a cached copy saved directly in this directory
+        Returns:
+            entry dictionary, or None if the file has to be downloaded
+        """
+        file_id = str(file_id)
+        with self._connect() as conn:
+            candidates = self._entries(conn, file_id)
+        if path is not None:
+            candidates = [
+                e for e in candidates if e['path'] == os.path.abspath(path)
+            ]
+        if file_dir is not None:
+            candidates = [
+                e for e in candidates
+                if os.path.dirname(e['path']) == os.path.abspath(file_dir)
+            ]
+        if version is not None:
+            candidates = [e for e in candidates if e['version'] == version]
+        for entry in sorted(candidates,
+                            key=lambda e: e['lastAccess'],
+                            reverse=True):
+            if not self._is_valid(entry, verify):
+                self.remove(file_id, path=entry['path'])
+                continue
+            entry['lastAccess'] = time.time()
+            with self._lock:
+                self._accessed[(file_id, entry['path'])] = entry['lastAccess']
+            return entry
+        return None
+
+    def record(self,
+               file_id,
+               path: str,
+               descriptors=None,
+               checksum: str = None,
+               version: str = None,
+               verified: bool = False):
+        """
+        Adds a freshly downloaded file to the manifest, then evicts least recently
+        used files if the cache is over quota.
+
+        Parameters:
+            file_id (str): UUID of the file
+            path (str): where the file was saved
+            descriptors: descriptors returned by hydration for the file, if any
+            checksum (str): md5 hex digest of the file, computed while downloading.
+                Computed from the file if not given, unless the file was verified
+            version (str): server side version of the file, e.g. from a fileset
+            verified (bool): whether checksum was checked against the server's hash
+        Returns:
+            the new entry dictionary
+        """
+        file_id = str(file_id)
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if checksum is None and not verified:
+            checksum = file_checksum(path)
+        entry = {
+            'id': file_id,
+            'path': path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'checksum': checksum,
+            'verified': verified,
+            'downloadTime': str(datetime.datetime.now()),
+            'lastAccess': time.time(),
+            'version': version,
+            'descriptors': descriptors
+        }
+        with self._lock:
+            self._accessed.pop((file_id, path), None)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_id, path, entry['size'], entry['mtime'],
+                 entry['checksum'], int(verified), entry['downloadTime'],
+                 entry['lastAccess'], version))
+            if descriptors is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO descriptors VALUES (?, ?)",
+                    (file_id, json.dumps(descriptors, default=str)))
+        self.enforce_quota(keep=[file_id])
+        return entry
+
+    def remove(self, file_id, path: str = None, delete_file: bool = False):
+        """
+        Drops a file from the manifest, optionally deleting the cached copies.
+
+        Parameters:
+            file_id (str): UUID of the file
+            path (str): only drop the copy at this path. Defaults to every copy
+            delete_file (bool): also delete the cached files and their .arrow sidecars
+        Returns:
+            list of the dropped entry dictionaries
+        """
+        file_id = str(file_id)
+        with self._connect() as conn:
+            removed = [
+                e for e in self._entries(conn, file_id)
+                if path is None or e['path'] == os.path.abspath(path)
+            ]
+            for entry in removed:
+                conn.execute(
+                    "DELETE FROM files WHERE file_id = ? AND path = ?",
+                    (file_id, entry['path']))
+            conn.execute(
+                "DELETE FROM descriptors WHERE file_id = ? AND NOT EXISTS "
+                "(SELECT 1 FROM files WHERE file_id = ?)", (file_id, file_id))
+        with self._lock:
+            for entry in removed:
+                self._accessed.pop((file_id, entry['path']), None)
+        if delete_file:
+            for entry in removed:
+                for f_path in [entry['path'], entry['path'] + sidecar_suffix]:
+                    if os.path.exists(f_path):
+                        os.remove(f_path)
+        return removed
+
+    def _disk_size(self, entry):
+        """ Size of a cached copy plus its .arrow sidecar, if one was written """
+        try:
+            return entry['size'] + os.path.getsize(entry['path'] +
+                                                   sidecar_suffix)
+        except OSError:
+            return entry['size']
+
+    def total_size(self):
+        """ Returns the size of every cached file and its .arrow sidecar, in bytes """
+        with self._connect() as conn:
+            return sum(
+                self._disk_size(e)
+                for e in self._entries(conn, descriptors=False))
+
+    def enforce_quota(self, quota_mb: float = None, keep: list = None):
+        """
+        Deletes least recently used files until the cache fits within its quota.
+
+        Parameters:
+            quota_mb (float): quota to enforce. Defaults to this manifest's quota_mb
+            keep (list): file ids that must not be evicted
+        Returns:
+            list of evicted file ids
+        """
+        quota_mb = self.quota_mb if quota_mb is None else quota_mb
+        if not quota_mb:
+            return []
+        quota_bytes = quota_mb * 1024 * 1024
+        keep = set(str(f_id) for f_id in (keep or []))
+        # eviction order depends on the access times buffered in memory
+        self.flush()
+        with self._connect() as conn:
+            entries = self._entries(conn, descriptors=False)
+        total = sum(self._disk_size(e) for e in entries)
+        evicted = []
+        for entry in sorted(entries, key=lambda e: e['lastAccess']):
+            if total <= quota_bytes:
+                break
+            if entry['id'] in keep:
+                continue
+            total -= self._disk_size(entry)
+            self.remove(entry['id'], path=entry['path'], delete_file=True)
+            if entry['id'] not in evicted:
+                evicted.append(entry['id'])
+        return evicted
+
+
+def get_manifest():
+    """ Returns the manifest of this IDE's file cache, loading it on first use """
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = CacheManifest(os.path.join(
+                    IDE_HOME_DIR, CONFIG['IDE']['CACHE_DIR'],
+                    CONFIG['CACHE']['MANIFEST_NAME']),
+                                          quota_mb=CONFIG['CACHE']['QUOTA_MB'])
+                atexit.register(_manifest.flush)
+    return _manifest
+
+
+def set_cache_quota(quota_mb: float):
+    """
+    Sets the max disk space used by cached HISE files. If the cache is already
+    bigger, least recently used files are deleted right away.
+
+    Parameters:
+        quota_mb (float): quota in megabytes. 0 or None removes the quota
+    Returns:
+        list of evicted file ids
+    Example:
+        hp.set_cache_quota(50 * 1024)  # 50 GB
+    """
+    if quota_mb is not None and quota_mb < 0:
+        raise ValueError("quota_mb must be a positive number")
+    manifest = get_manifest()
+    manifest.quota_mb = quota_mb
+    evicted = manifest.enforce_quota()
+    manifest.flush()
+    return evicted
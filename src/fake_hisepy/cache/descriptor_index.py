@@ -0,0 +1,264 @@
+""" descriptor_index.py
+
+Description: persistent local index of file descriptors, kept in a sqlite database.
+    Every field of a descriptor (file, sample, subject, lab, specimens, ...) is indexed
+    so the {field: [values]} dictionaries used by get_file_descriptors can be answered
+    offline. Each synced query remembers the newest lastUpdated/labLastModified it has
+    seen, so later syncs only ask the ledger for descriptors that changed since, and
+    which files it returned, so a periodic full sync can drop the ones HISE no
+    longer returns.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import fake_hisepy.auth.auth as auth
+
+from fake_hisepy.config.config import config as CONFIG
+
+IDE_HOME_DIR = CONFIG['IDE']['HOME_DIR'] if not auth.debug() else os.getcwd()
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _to_text(value):
+    """ Values are compared as text. Strings are kept as is, everything else is json """
+    return value if type(value) is str else json.dumps(value, sort_keys=True)
+
+
+def flatten_descriptor(this_desc: dict):
+    """
+    Returns (path, value) pairs for every scalar in a descriptor, e.g.
+    ('subject.cohortGuid', 'FH1'). Lists contribute one pair per item.
+    """
+    pairs = []
+
+    def _walk(prefix, obj):
+        if type(obj) is dict:
+            for k, v in obj.items():
+                _walk("%s.%s" % (prefix, k) if prefix else k, v)
+        elif type(obj) is list:
+            for v in obj:
+                _walk(prefix, v)
+        elif obj is not None:
+            pairs.append((prefix, _to_text(obj)))
+
+    _walk("", this_desc)
+    return pairs
+
+
+def _file_id(this_desc: dict):
+    if type(this_desc) is not dict or type(this_desc.get('file')) is not dict:
+        raise ValueError("descriptor has no file section: %s" % this_desc)
+    return str(this_desc['file']['id'])
+
+
+class DescriptorIndex:
+    """ A class representing a sqlite index of file descriptors.
+
+    Attributes:
+        path (str): Path of the sqlite database.
+    """
+
+    def __init__(self, path: str):
+        """ Inits DescriptorIndex object, creating the database if needed """
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS descriptors ("
+                         "file_id TEXT PRIMARY KEY, descriptor TEXT, "
+                         "last_updated TEXT, lab_last_modified TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS fields ("
+                         "file_id TEXT, path TEXT, field TEXT, value TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS fields_by_field "
+                         "ON fields (field, value)")
+            conn.execute("CREATE INDEX IF NOT EXISTS fields_by_path "
+                         "ON fields (path, value)")
+            conn.execute("CREATE INDEX IF NOT EXISTS fields_by_file "
+                         "ON fields (file_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS watermarks ("
+                         "scope TEXT PRIMARY KEY, last_updated TEXT, "
+                         "lab_last_modified TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS field_paths ("
+                         "field TEXT PRIMARY KEY, path TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS scope_files ("
+                         "scope TEXT, file_id TEXT, "
+                         "PRIMARY KEY (scope, file_id))")
+            conn.execute("CREATE TABLE IF NOT EXISTS full_syncs ("
+                         "scope TEXT PRIMARY KEY, synced REAL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, descriptors: list):
+        """
+        Adds or replaces descriptors in the index.
+
+        Parameters:
+            descriptors (list): descriptor dictionaries, as returned by query_files
+        Returns:
+            number of descriptors indexed
+        """
+        rows = []
+        field_rows = []
+        for this_desc in descriptors:
+            file_id = _file_id(this_desc)
+            rows.append(
+                (file_id, json.dumps(this_desc), this_desc.get('lastUpdated'),
+                 this_desc.get('labLastModified')))
+            field_rows += [(file_id, path, path.split(".")[-1], value)
+                           for path, value in flatten_descriptor(this_desc)]
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM fields WHERE file_id = ?",
+                             [(r[0], ) for r in rows])
+            conn.executemany(
+                "INSERT OR REPLACE INTO descriptors VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO fields VALUES (?, ?, ?, ?)",
+                             field_rows)
+        return len(rows)
+
+    def sync(self, scope: str, descriptors: list, full: bool = False):
+        """
+        Adds the descriptors a sync of scope returned and moves its watermark. The
+        descriptors of a full sync replace the scope's: files it no longer returns
+        are dropped from the scope, and from the index unless another scope has them.
+
+        Parameters:
+            scope (str): normalized query the descriptors were synced for
+            descriptors (list): descriptor dictionaries returned by the ledger
+            full (bool): whether descriptors are every file matching scope
+        Returns:
+            list of file ids dropped from the index
+        """
+        self.add(descriptors)
+        file_ids = set(_file_id(d) for d in descriptors)
+        dropped = []
+        with self._connect() as conn:
+            if full:
+                gone = set(r[0] for r in conn.execute(
+                    "SELECT file_id FROM scope_files WHERE scope = ?",
+                    (scope, )).fetchall()) - file_ids
+                conn.execute("DELETE FROM scope_files WHERE scope = ?",
+                             (scope, ))
+                conn.execute("INSERT OR REPLACE INTO full_syncs VALUES (?, ?)",
+                             (scope, time.time()))
+            conn.executemany("INSERT OR IGNORE INTO scope_files VALUES (?, ?)",
+                             [(scope, f_id) for f_id in file_ids])
+            if full:
+                kept = set(r[0] for r in conn.execute(
+                    "SELECT DISTINCT file_id FROM scope_files").fetchall())
+                dropped = sorted(gone - kept)
+                for table in ['descriptors', 'fields']:
+                    conn.executemany(
+                        "DELETE FROM %s WHERE file_id = ?" % table,
+                        [(f_id, ) for f_id in dropped])
+        self.set_watermark(scope, descriptors)
+        return dropped
+
+    def last_full_sync(self, scope: str):
+        """ Returns the epoch time scope was last fully synced, or None """
+        with self._connect() as conn:
+            row = conn.execute("SELECT synced FROM full_syncs WHERE scope = ?",
+                               (scope, )).fetchone()
+        return None if row is None else row[0]
+
+    def set_field_paths(self, field_paths: dict):
+        """
+        Saves the dotted path each plain field name is searched at, e.g.
+        {'cohortGuid': 'cohort.cohortGuid'}, replacing the paths saved before
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM field_paths")
+            conn.executemany("INSERT INTO field_paths VALUES (?, ?)",
+                             list(field_paths.items()))
+
+    def search(self, query_dict: dict):
+        """
+        Evaluates a {field: [values]} query against the index. A descriptor matches
+        when, for every field, one of its values is in the list. Fields can be plain
+        names (cohortGuid) or dotted paths (subject.cohortGuid). Plain names are
+        searched at the path set_field_paths saved for them, like the online query
+        does, and in any section if no path was saved.
+
+        Parameters:
+            query_dict (dict): same dictionary get_file_descriptors takes
+        Returns:
+            list of matching descriptor dictionaries
+        """
+        if type(query_dict) is not dict or len(query_dict) == 0:
+            raise TypeError("query_dict must be a non-empty dictionary")
+        with self._connect() as conn:
+            field_paths = dict(
+                conn.execute("SELECT field, path FROM field_paths").fetchall())
+        clauses = []
+        params = []
+        for field, values in query_dict.items():
+            if type(values) is not list:
+                raise TypeError(
+                    "key {} has values not in a list".format(field))
+            if len(values) == 0:
+                return []
+            field = field_paths.get(field, field)
+            column = "path" if "." in field else "field"
+            clauses.append(
+                "file_id IN (SELECT file_id FROM fields WHERE %s = ? "
+                "AND value IN (%s))" % (column, ",".join("?" * len(values))))
+            params += [field] + [_to_text(v) for v in values]
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT descriptor FROM descriptors WHERE %s ORDER BY file_id"
+                % " AND ".join(clauses), params).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def get_watermark(self, scope: str):
+        """ Returns (lastUpdated, labLastModified) last synced for scope, or (None, None) """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT last_updated, lab_last_modified FROM watermarks "
+                "WHERE scope = ?", (scope, )).fetchone()
+        return (None, None) if row is None else row
+
+    def set_watermark(self, scope: str, descriptors: list):
+        """ Moves scope's watermark up to the newest timestamps in descriptors """
+        last_updated, lab_last_modified = self.get_watermark(scope)
+        for this_desc in descriptors:
+            if this_desc.get('lastUpdated') is not None:
+                last_updated = max(
+                    filter(None, [last_updated, this_desc['lastUpdated']]))
+            if this_desc.get('labLastModified') is not None:
+                lab_last_modified = max(
+                    filter(None,
+                           [lab_last_modified, this_desc['labLastModified']]))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                         (scope, last_updated, lab_last_modified))
+        return last_updated, lab_last_modified
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM descriptors").fetchone()[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            for table in [
+                    'descriptors', 'fields', 'watermarks', 'field_paths',
+                    'scope_files', 'full_syncs'
+            ]:
+                conn.execute("DELETE FROM %s" % table)
+
+
+def get_descriptor_index():
+    """ Returns this IDE's descriptor index, creating it on first use """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DescriptorIndex(
+                    os.path.join(IDE_HOME_DIR, CONFIG['IDE']['CACHE_DIR'],
+                                 CONFIG['DESCRIPTOR_INDEX']['DB_NAME']))
+    return _index
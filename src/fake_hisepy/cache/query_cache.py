@@ -0,0 +1,163 @@
+""" query_cache.py
+
+Description: opt-in, disk-backed cache of ledger and hydration query results, kept in
+    a local sqlite database. Results are keyed by the endpoint and the normalized
+    query, so the same query_dict re-run in a notebook cell isn't sent to HISE again
+    until its entry is older than the cache's ttl.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import fake_hisepy.auth.auth as auth
+
+from fake_hisepy.config.config import config as CONFIG
+
+IDE_HOME_DIR = CONFIG['IDE']['HOME_DIR'] if not auth.debug() else os.getcwd()
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """
+    Returns a canonical json string for a query, with dict keys and list values sorted,
+    so equivalent queries written in a different order share a cache entry.
+    """
+
+    def _normalize(obj):
+        if type(obj) is dict:
+            return {str(k): _normalize(v) for k, v in obj.items()}
+        elif type(obj) in (list, tuple, set):
+            return sorted((_normalize(v) for v in obj),
+                          key=lambda v: json.dumps(v, sort_keys=True))
+        return obj
+
+    return json.dumps(_normalize(query), sort_keys=True, default=str)
+
+
+def query_key(endpoint: str, query=None):
+    """ Returns the cache key of a query sent to endpoint """
+    return hashlib.sha256(
+        ("%s\n%s" % (endpoint, normalize_query(query))).encode()).hexdigest()
+
+
+class QueryCache:
+    """ A class representing a sqlite store of query results.
+
+    Attributes:
+        path (str): Path of the sqlite database.
+        ttl (float): Seconds a result is reused for before the query is sent again.
+    """
+
+    def __init__(self, path: str, ttl: float = None):
+        """ Inits QueryCache object, creating the database if needed """
+        self.path = path
+        self.ttl = ttl if ttl is not None else CONFIG['QUERY_CACHE'][
+            'TTL_SECONDS']
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS queries ("
+                         "key TEXT PRIMARY KEY, endpoint TEXT, query TEXT, "
+                         "result TEXT, created REAL)")
+
+    def _connect(self):
+        # a connection per call keeps the cache usable from download threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, endpoint: str, query=None):
+        """ Returns the cached result of a query, or None if missing or expired """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result, created FROM queries WHERE key = ?",
+                (query_key(endpoint, query), )).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, endpoint: str, query, result):
+        """ Saves the result of a query """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                (query_key(endpoint, query), endpoint.split("?")[0],
+                 normalize_query(query), json.dumps(result), time.time()))
+
+    def clear(self, expired_only: bool = False):
+        """ Deletes cached results, either all of them or just the expired ones """
+        with self._connect() as conn:
+            if expired_only:
+                conn.execute("DELETE FROM queries WHERE created < ?",
+                             (time.time() - self.ttl, ))
+            else:
+                conn.execute("DELETE FROM queries")
+
+
+def get_query_cache():
+    """ Returns this IDE's query cache if it's enabled, otherwise None """
+    return _query_cache
+
+
+def enable_query_cache(ttl: float = None, path: str = None):
+    """
+    Turns on caching of query_files, read_samples, read_subjects and query_id
+    results. Cached results are reused until they're older than ttl, or a call
+    is made with refresh=True.
+
+    Parameters:
+        ttl (float): seconds to reuse results for. Defaults to [QUERY_CACHE] TTL_SECONDS
+        path (str): sqlite database to use. Defaults to ~/cache/[QUERY_CACHE] DB_NAME
+    Returns:
+        the QueryCache
+    Example:
+        hp.enable_query_cache(ttl=24 * 3600)
+    """
+    global _query_cache
+    if ttl is not None and ttl < 0:
+        raise ValueError("ttl must be a positive number")
+    if path is None:
+        path = os.path.join(IDE_HOME_DIR, CONFIG['IDE']['CACHE_DIR'],
+                            CONFIG['QUERY_CACHE']['DB_NAME'])
+    with _query_cache_lock:
+        _query_cache = QueryCache(path, ttl=ttl)
+    return _query_cache
+
+
+def disable_query_cache():
+    """ Turns off the query cache. Results already cached are kept on disk """
+    global _query_cache
+    with _query_cache_lock:
+        _query_cache = None
+
+
+def cached_query(endpoint: str, query, fetch, refresh: bool = False):
+    """
+    Returns fetch(), reusing a cached result for the same endpoint and query when
+    the query cache is enabled.
+
+    Parameters:
+        endpoint (str): url the query is sent to
+        query: json-like query sent to the endpoint
+        fetch (callable): makes the request and returns a json-like result
+        refresh (bool): ignore any cached result and send the query again
+    Returns:
+        the query's result
+    """
+    query_cache = get_query_cache()
+    if query_cache is None:
+        return fetch()
+    if not refresh:
+        result = query_cache.get(endpoint, query)
+        if result is not None:
+            return result
+    result = fetch()
+    query_cache.put(endpoint, query, result)
+    return result
+
+
+if CONFIG['QUERY_CACHE']['ENABLED']:
+    enable_query_cache()
@@ -1,15 +1,15 @@
 import json
 import os
-import requests
 import tempfile
 import tarfile
 import shutil
 import pathlib as pl
 import fake_hisepy.utils.utils as cu
 import fake_hisepy.upload.upload as cup
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, instance_name_path
+from fake_hisepy.auth.auth import get_from_metadata_server, instance_name_path
 from fake_hisepy.read.read import parse_hise_response, hise_url
 from fake_hisepy.schedule.schedule import current_notebook
+from fake_hisepy.session.session import get_session
 import pandas as pd
 import fake_hisepy.auth.auth as auth
 from fake_hisepy.config.config import config as CONFIG
@@ -26,16 +26,13 @@ def get_projects(to_df: bool = True):
         to_df (bool): reshape to tabular, if True
     """
     keep_cols = ['guid', 'short_name', 'name']
-    resp = parse_hise_response(
-        requests.get(hise_url("amds", "project_path"),
-                     headers=get_bearer_token_header()))
+    resp = parse_hise_response(get_session().get(
+        hise_url("amds", "project_path")))
 
-    # reshape to tabular format and concatenate each entry
+    # reshape every entry to tabular format at once
     if to_df:
-        proj_df = pd.DataFrame()
-        for p in resp:
-            proj_df = pd.concat([proj_df, pd.json_normalize(p)[keep_cols]])
-    return proj_df
+        return pd.json_normalize(resp).reindex(columns=keep_cols)
+    return resp
 
 
 def project_shortname_to_guid(proj_name):
@@ -80,9 +77,8 @@ def get_result_files(to_df=True):
     keep_cols = [
         'id', 'fileType', 'description', 'projectGuid', 'isSearchable'
     ]
-    resp = parse_hise_response(
-        requests.get(hise_url("ledger", "result_file_search_path"),
-                     headers=get_bearer_token_header()))
+    resp = parse_hise_response(get_session().get(
+        hise_url("ledger", "result_file_search_path")))
     if to_df:
         result_df = result_json_to_df(resp)
         return result_df[keep_cols]
@@ -94,10 +90,7 @@ def result_json_to_df(json_obj):
     '''
     flatten nested structure of a JSON object and creates a data.frame 
     '''
-    agg_df = pd.DataFrame()
-    for o in json_obj:
-        agg_df = pd.concat([agg_df, pd.json_normalize(o)])
-    return agg_df
+    return pd.json_normalize(list(json_obj))
 
 
 def user_prompt_select_result(rf_df: pd.DataFrame, filetype):
@@ -143,7 +136,8 @@ def result_filetype_to_guid(filetype: str, proj_guid):
     else:
         # now filter on ResultFile.fileType
         desired_result = results_in_proj_df.loc[
-            results_in_proj_df['fileType'].eq(filetype), ]
+            results_in_proj_df['fileType'].eq(filetype),
+        ].reset_index(drop=True)
 
     # handle potential name collisions
     if len(desired_result) > 1:
@@ -224,9 +218,7 @@ class AbstractionAppImg:
         return hise_url("hydration", "hise_wide_static_img_path")
 
     def send_static_image_post(self, url, img_dict):
-        resp = requests.post(url,
-                             headers=get_bearer_token_header(),
-                             files=img_dict)
+        resp = get_session().post(url, files=img_dict)
         return resp
 
     def create_image_dict(self):
@@ -307,9 +299,7 @@ class AbstractionAppImg:
         return hise_url("toolchain", "abstraction_path", args=args)
 
     def send_post(self, url, file):
-        resp = requests.post(url,
-                             headers=get_bearer_token_header(),
-                             files=file)
+        resp = get_session().post(url, files=file)
         return resp
 
 
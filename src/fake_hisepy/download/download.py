@@ -0,0 +1,703 @@
+""" download.py
+
+Description: bounded thread-pool engine used to download many hydration urls at once.
+    Every task's outcome is captured separately, so one bad file doesn't abort the rest.
+    Files are streamed to a .part file in fixed size chunks, resumed with http Range
+    requests after an interruption, and renamed into place once complete. Files larger
+    than [DOWNLOAD] SEGMENT_THRESHOLD_MB are split into byte ranges fetched over
+    several connections at once. Files are hashed as they're written and checked
+    against the hashes the server reports in x-goog-hash. A small pool of background
+    workers prefetches files into the cache at low priority.
+"""
+
+import base64
+import hashlib
+import itertools
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import requests
+
+from fake_hisepy.session.session import get_session
+
+from fake_hisepy.config.config import config as CONFIG
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+part_suffix = ".part"
+# reflected Castagnoli polynomial of crc32c
+crc32c_poly = 0x82F63B78
+# segmented downloads write out of order, so they can't be resumed like a .part file
+segment_suffix = ".segments"
+# lower numbers run first. prefetched files wait behind anything submitted as urgent
+urgent_priority = 0
+prefetch_priority = 10
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+class DownloadResult:
+    """ A class representing the outcome of a single download task.
+
+    Attributes:
+        index (int): position of the task in the input list.
+        item: the input the task was run on.
+        value: whatever the task returned, None if it failed.
+        error (Exception): exception raised by the task, None if it succeeded.
+    """
+
+    def __init__(self, index, item, value=None, error=None):
+        """ Inits DownloadResult object """
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def resolve_max_workers(max_workers: int = None):
+    """ Returns a sane worker count, defaulting to [DOWNLOAD] MAX_WORKERS """
+    if max_workers is None:
+        max_workers = CONFIG['DOWNLOAD']['MAX_WORKERS']
+    if type(max_workers) is not int or max_workers < 1:
+        raise ValueError("max_workers must be a positive integer")
+    return max_workers
+
+
+def _run_task(func, index, item):
+    try:
+        return DownloadResult(index, item, value=func(item))
+    except Exception as e:
+        return DownloadResult(index, item, error=e)
+
+
+def run_parallel(func, items: list, max_workers: int = None):
+    """
+    Runs func on every item using a bounded thread pool.
+
+    Parameters:
+        func (callable): function taking a single item, e.g. a download task
+        items (list): inputs to func
+        max_workers (int): max number of concurrent tasks. Defaults to [DOWNLOAD] MAX_WORKERS
+    Returns:
+        list of DownloadResult objects, in the same order as items
+    """
+    items = list(items)
+    max_workers = resolve_max_workers(max_workers)
+    if len(items) == 0:
+        return []
+    if len(items) == 1 or max_workers == 1:
+        return [_run_task(func, i, item) for i, item in enumerate(items)]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)),
+                            thread_name_prefix="hise-download") as pool:
+        futures = [
+            pool.submit(_run_task, func, i, item)
+            for i, item in enumerate(items)
+        ]
+        return [f.result() for f in futures]
+
+
+def iter_parallel(func, items, max_workers: int = None):
+    """
+    Like run_parallel, but yields each result as soon as its task finishes. No more
+    than 2 * max_workers tasks are submitted but not yet consumed, so a slow consumer
+    holds back new tasks rather than piling up finished results.
+
+    Parameters:
+        func (callable): function taking a single item, e.g. a download task
+        items (iterable): inputs to func. Consumed lazily
+        max_workers (int): max number of concurrent tasks. Defaults to [DOWNLOAD] MAX_WORKERS
+    Returns:
+        generator of DownloadResult objects, in completion order
+    """
+    max_workers = resolve_max_workers(max_workers)
+    items = iter(enumerate(items))
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix="hise-download") as pool:
+        pending = set()
+        try:
+            while True:
+                for i, item in items:
+                    pending.add(pool.submit(_run_task, func, i, item))
+                    if len(pending) >= 2 * max_workers:
+                        break
+                if len(pending) == 0:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    yield f.result()
+        finally:
+            # consumer stopped early. don't start anything else
+            for f in pending:
+                f.cancel()
+
+
+class Prefetcher:
+    """ A class representing a pool of background workers fed from a priority queue.
+
+    Workers are daemon threads started on first use, so a prefetch never keeps the
+    interpreter alive. Tasks with the same priority run in the order they were submitted.
+
+    Attributes:
+        workers (int): number of background workers.
+    """
+
+    def __init__(self, workers: int = None):
+        """ Inits Prefetcher object, defaulting to [DOWNLOAD] PREFETCH_WORKERS workers """
+        self.workers = resolve_max_workers(
+            workers
+            if workers is not None else CONFIG['DOWNLOAD']['PREFETCH_WORKERS'])
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._work,
+                                     name="hise-prefetch-%d" %
+                                     len(self._threads),
+                                     daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self):
+        while True:
+            _, _, func, future = self._queue.get()
+            try:
+                # cancelled while still queued
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(func())
+                except Exception as e:
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, priority: int = prefetch_priority):
+        """
+        Queues func to run on a background worker.
+
+        Parameters:
+            func (callable): function taking no arguments
+            priority (int): lower runs first. Defaults to prefetch_priority
+        Returns:
+            a concurrent.futures.Future for func's result
+        """
+        future = Future()
+        self._queue.put((priority, next(self._order), func, future))
+        self._start()
+        return future
+
+    def pending(self):
+        """ Returns the number of tasks queued or running """
+        return self._queue.unfinished_tasks
+
+
+class PrefetchJob:
+    """ A class representing a batch of prefetch tasks, which may queue more tasks.
+
+    Attributes:
+        futures (list): futures of every task queued for this job so far.
+    """
+
+    def __init__(self):
+        """ Inits PrefetchJob object """
+        self.futures = []
+        self._lock = threading.Lock()
+
+    def add(self, future: Future):
+        with self._lock:
+            self.futures.append(future)
+        return future
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self.futures)
+
+    def done(self):
+        """ True once every task, including ones queued by other tasks, has finished """
+        return all(f.done() for f in self._snapshot())
+
+    def wait(self, timeout: float = None):
+        """
+        Blocks until the job is done or timeout seconds have passed.
+
+        Returns:
+            True if the job is done
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            futures = self._snapshot()
+            remaining = None if deadline is None else max(
+                0, deadline - time.monotonic())
+            wait(futures, timeout=remaining)
+            # tasks may have queued more tasks while we waited
+            if len(self._snapshot()) == len(futures) and self.done():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def cancel(self):
+        """ Drops every task that hasn't started yet. Running downloads are left to finish """
+        for f in self._snapshot():
+            f.cancel()
+
+    def errors(self):
+        """ Returns exceptions raised by the tasks that have failed so far """
+        return [
+            f.exception() for f in self._snapshot()
+            if f.done() and not f.cancelled() and f.exception() is not None
+        ]
+
+
+def get_prefetcher():
+    """ Returns the process-wide Prefetcher, creating it on first use """
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher()
+    return _prefetcher
+
+
+def _gf2_times(mat: list, vec: int):
+    total = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[i]
+        vec >>= 1
+        i += 1
+    return total
+
+
+def _gf2_square(mat: list):
+    return [_gf2_times(mat, mat[n]) for n in range(32)]
+
+
+def crc_combine(crc1: int, crc2: int, len2: int, poly: int = crc32c_poly):
+    """
+    Returns the crc of two byte strings joined together from crc1 of the first, crc2
+    of the second and the length of the second, as zlib's crc32_combine does.
+    poly is the reflected polynomial of the crc, crc32c by default
+    """
+    if len2 == 0:
+        return crc1
+    # operator that appends one zero bit, then two and four
+    odd = [poly] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    # append len2 zero bytes to crc1, squaring the operator for each bit of len2
+    while True:
+        even = _gf2_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+        odd = _gf2_square(even)
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+    return crc1 ^ crc2
+
+
+class StreamHasher:
+    """ A class representing the running hashes of a file written front to back.
+
+    Attributes:
+        size (int): number of bytes hashed so far.
+    """
+
+    def __init__(self):
+        """ Inits StreamHasher object """
+        self.reset()
+
+    def reset(self):
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._crc32c = google_crc32c.Checksum(
+        ) if google_crc32c is not None else None
+        # crc32c combined from the ranges of a segmented download
+        self._segments_crc32c = None
+
+    def update(self, chunk: bytes):
+        self.size += len(chunk)
+        self._md5.update(chunk)
+        if self._crc32c is not None:
+            self._crc32c.update(chunk)
+
+    def set_segments(self, segments: list):
+        """
+        Takes the hashes of a file written as byte ranges from the (crc32c, length)
+        of each range, in file order. The crc32c values are combined without reading
+        the file. md5 can't be combined, so it's unknown until update_from_file
+        """
+        self.reset()
+        self._md5 = None
+        self._crc32c = None
+        crc = 0
+        for seg_crc, length in segments:
+            if crc is not None and seg_crc is not None:
+                crc = crc_combine(crc, seg_crc, length)
+            else:
+                crc = None
+            self.size += length
+        self._segments_crc32c = crc
+
+    def update_from_file(self, path: str, chunk_size: int = None):
+        """ Hashes bytes already on disk, e.g. the start of a resumed download """
+        if chunk_size is None:
+            chunk_size = CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE']
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                self.update(chunk)
+
+    def digests(self):
+        """ Returns {'md5': hex digest, 'crc32c': base64 digest}. crc32c needs google_crc32c """
+        digests = {}
+        if self._md5 is not None:
+            digests['md5'] = self._md5.hexdigest()
+        if self._segments_crc32c is not None:
+            digests['crc32c'] = base64.b64encode(
+                self._segments_crc32c.to_bytes(4, 'big')).decode()
+        elif self._crc32c is not None:
+            digests['crc32c'] = base64.b64encode(
+                self._crc32c.digest()).decode()
+        return digests
+
+
+def expected_hashes(resp):
+    """ Returns the hashes a server reported for the whole file, in StreamHasher's format """
+    hashes = {}
+    for item in resp.headers.get("x-goog-hash", "").split(","):
+        algo, _, value = item.strip().partition("=")
+        if algo == "md5" and value:
+            hashes["md5"] = base64.b64decode(value).hex()
+        elif algo == "crc32c" and value:
+            hashes["crc32c"] = value
+    return hashes
+
+
+def _mismatched_hashes(digests: dict, expected: dict):
+    return [a for a in expected if a in digests and digests[a] != expected[a]]
+
+
+def write_response(resp, dest: str, chunk_size: int = None):
+    """
+    Streams a response body into dest, hashing it on the way. If the server reported
+    hashes that don't match, dest is deleted and a SystemError raised.
+
+    Returns:
+        dictionary of hex md5 (and crc32c) digests, with a 'verified' list of the
+        hashes that were checked against the server's
+    """
+    if chunk_size is None:
+        chunk_size = CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE']
+    hasher = StreamHasher()
+    with open(dest, 'wb') as f:
+        for chunk in resp.iter_content(chunk_size):
+            if chunk:
+                f.write(chunk)
+                hasher.update(chunk)
+    digests = hasher.digests()
+    expected = expected_hashes(resp)
+    bad = _mismatched_hashes(digests, expected)
+    if len(bad) > 0:
+        os.remove(dest)
+        raise SystemError("%s of %s didn't match the server's" %
+                          (", ".join(bad), dest))
+    digests['verified'] = sorted(a for a in expected if a in digests)
+    return digests
+
+
+def _content_range(resp):
+    """ Returns (first byte, total size) from a Content-Range header. Either may be None """
+    m = re.match(r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)",
+                 resp.headers.get("Content-Range", ""))
+    if m is None:
+        return None, None
+    start, total = m.groups()
+    return (int(start) if start is not None else None,
+            int(total) if total != "*" else None)
+
+
+def _should_segment(resp, segments: int):
+    """ True if a full-file response is big enough, and rangeable, to fetch in segments """
+    if segments < 2 or not hasattr(os, "pwrite"):
+        return False
+    if resp.headers.get("Accept-Ranges") != "bytes":
+        return False
+    size = resp.headers.get("Content-Length")
+    return size is not None and int(
+        size) >= CONFIG['DOWNLOAD']['SEGMENT_THRESHOLD_MB'] * 1024 * 1024
+
+
+def _split_ranges(size: int, segments: int):
+    """ Splits [0, size) into at most segments contiguous (first, last) byte ranges """
+    step = -(-size // segments)
+    return [(start, min(start + step, size) - 1)
+            for start in range(0, size, step)]
+
+
+def _fetch_segment(url, fd, first, last, chunk_size, max_resumes):
+    """
+    Writes bytes first..last of url into fd at the same offsets. Returns the
+    (crc32c, length) of the range, crc32c is None without google_crc32c
+    """
+    checksum = google_crc32c.Checksum() if google_crc32c is not None else None
+    pos = first
+    for attempt in range(max_resumes + 1):
+        resp = None
+        try:
+            resp = get_session().get(
+                url,
+                headers={"Range": "bytes=%d-%d" % (pos, last)},
+                stream=True)
+            if resp.status_code != 206 or _content_range(resp)[0] != pos:
+                raise SystemError("Range request to %s failed with status %d" %
+                                  (url.split("?")[0], resp.status_code))
+            for chunk in resp.iter_content(chunk_size):
+                if chunk:
+                    chunk = chunk[:last + 1 - pos]
+                    os.pwrite(fd, chunk, pos)
+                    if checksum is not None:
+                        checksum.update(chunk)
+                    pos += len(chunk)
+            if pos == last + 1:
+                crc = int.from_bytes(checksum.digest(),
+                                     'big') if checksum is not None else None
+                return crc, last + 1 - first
+            raise requests.exceptions.ChunkedEncodingError(
+                "Connection closed after %d of %d bytes" %
+                (pos - first, last + 1 - first))
+        except (requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            # pick the segment up where it stopped
+            if attempt == max_resumes:
+                raise
+        finally:
+            if resp is not None:
+                resp.close()
+
+
+def download_segments(url: str,
+                      dest: str,
+                      size: int,
+                      segments: int = None,
+                      chunk_size: int = None,
+                      max_resumes: int = None):
+    """
+    Downloads url into dest as byte ranges fetched over parallel connections. dest is
+    preallocated to size and every range is written at its own offset.
+
+    Parameters:
+        url (str): url of the file. The server must support Range requests
+        dest (str): path to save the file to
+        size (int): size of the file, in bytes
+        segments (int): number of ranges fetched at once. Defaults to [DOWNLOAD] SEGMENTS
+        chunk_size (int): bytes read per chunk. Defaults to [IDE] DOWNLOAD_CHUNK_SIZE
+        max_resumes (int): times to resume a range after a dropped connection. Defaults to [SESSION] MAX_RETRIES
+    Returns:
+        list of the (crc32c, length) of each range, in file order. crc32c is None
+        without google_crc32c
+    """
+    if segments is None:
+        segments = CONFIG['DOWNLOAD']['SEGMENTS']
+    if chunk_size is None:
+        chunk_size = CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE']
+    if max_resumes is None:
+        max_resumes = CONFIG['SESSION']['MAX_RETRIES']
+
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+        results = run_parallel(lambda r: _fetch_segment(
+            url, fd, r[0], r[1], chunk_size, max_resumes),
+                               _split_ranges(size, segments),
+                               max_workers=segments)
+    finally:
+        os.close(fd)
+
+    for result in results:
+        if not result.ok:
+            os.remove(dest)
+            raise result.error
+    written = sum(r.value[1] for r in results)
+    if written != size or os.path.getsize(dest) != size:
+        os.remove(dest)
+        raise requests.exceptions.ChunkedEncodingError(
+            "Segmented download wrote %d of %d bytes" % (written, size))
+    return [r.value for r in results]
+
+
+def _stream_once(url,
+                 part_path,
+                 chunk_size,
+                 segments=1,
+                 hasher=None,
+                 expected=None):
+    """ 
+    Makes a single GET request, appending to part_path if the server honors a Range
+    request for the bytes we already have. Large files are handed off to
+    download_segments instead. Written bytes are fed to hasher, and hashes the
+    server reports are added to expected. Returns True once part_path is complete.
+    """
+    hasher = hasher if hasher is not None else StreamHasher()
+    expected = expected if expected is not None else {}
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": "bytes=%d-" % offset} if offset > 0 else None
+    resp = get_session().get(url, headers=headers, stream=True)
+    try:
+        for algo, value in expected_hashes(resp).items():
+            expected.setdefault(algo, value)
+        if hasher.size != offset and resp.status_code != 200:
+            # part file is from an earlier process. only its bytes get a second pass
+            hasher.reset()
+            hasher.update_from_file(part_path, chunk_size)
+
+        if resp.status_code == 416 and offset > 0:
+            # we already have every byte, or the partial file is bogus
+            if _content_range(resp)[1] == offset:
+                return True
+            os.remove(part_path)
+            hasher.reset()
+            return False
+        if resp.status_code == 206:
+            if _content_range(resp)[0] != offset:
+                os.remove(part_path)
+                hasher.reset()
+                return False
+            mode = "ab"
+        elif resp.status_code == 200 and offset == 0 and _should_segment(
+                resp, segments):
+            size = int(resp.headers["Content-Length"])
+            resp.close()
+            seg_path = part_path + segment_suffix
+            hasher.set_segments(
+                download_segments(url, seg_path, size, segments, chunk_size))
+            os.replace(seg_path, part_path)
+            if len(expected) > 0 and not any(a in hasher.digests()
+                                             for a in expected):
+                # the server only gave an md5 (or google_crc32c is missing). md5
+                # can't be combined from the segments, so this takes a second pass
+                hasher.reset()
+                hasher.update_from_file(part_path, chunk_size)
+            return True
+        elif resp.status_code == 200:
+            # server ignored the Range header, start over
+            mode = "wb"
+            offset = 0
+            hasher.reset()
+        else:
+            raise SystemError("Request to %s failed with status %d. %s" %
+                              (url.split("?")[0], resp.status_code, resp.text))
+
+        expected_size = None
+        if resp.headers.get("Content-Length") is not None:
+            expected_size = offset + int(resp.headers["Content-Length"])
+        with open(part_path, mode) as f:
+            for chunk in resp.iter_content(chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    hasher.update(chunk)
+    finally:
+        resp.close()
+
+    if expected_size is not None and os.path.getsize(
+            part_path) != expected_size:
+        raise requests.exceptions.ChunkedEncodingError(
+            "Connection closed after %d of %d bytes" %
+            (os.path.getsize(part_path), expected_size))
+    return True
+
+
+def download_file(url: str,
+                  dest: str,
+                  expected: dict = None,
+                  chunk_size: int = None,
+                  max_resumes: int = None,
+                  segments: int = None):
+    """
+    Downloads url to dest without holding the file in memory. Bytes are written to
+    dest + ".part" and the file is renamed to dest only once it is complete, so dest
+    is never a half-written file. A .part file left behind by an interrupted
+    download is resumed with a Range request rather than downloaded again.
+
+    The file is hashed as it's written. If the hashes don't match the ones passed in
+    expected, or reported by the server in x-goog-hash, the file is fetched again.
+
+    Parameters:
+        url (str): url of the file
+        dest (str): path to save the file to
+        expected (dict): known hashes of the file, e.g. {'md5': hex digest}
+        chunk_size (int): bytes read per chunk. Defaults to [IDE] DOWNLOAD_CHUNK_SIZE
+        max_resumes (int): times to resume after a dropped connection or re-fetch after
+            a bad hash. Defaults to [SESSION] MAX_RETRIES
+        segments (int): connections used for files over [DOWNLOAD] SEGMENT_THRESHOLD_MB. Defaults to [DOWNLOAD] SEGMENTS
+    Returns:
+        dictionary of hex md5 (and crc32c) digests of the file, with a 'verified' list
+        of the hashes that were checked. Segmented downloads are hashed per range, so
+        their md5 is only known if the server reported one
+    """
+    if segments is None:
+        segments = CONFIG['DOWNLOAD']['SEGMENTS']
+    if chunk_size is None:
+        chunk_size = CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE']
+    if max_resumes is None:
+        max_resumes = CONFIG['SESSION']['MAX_RETRIES']
+    part_path = dest + part_suffix
+    expected = dict(expected or {})
+    hasher = StreamHasher()
+
+    for attempt in range(max_resumes + 1):
+        try:
+            if not _stream_once(url, part_path, chunk_size, segments, hasher,
+                                expected):
+                continue
+            digests = hasher.digests()
+            bad = _mismatched_hashes(digests, expected)
+            if len(bad) > 0:
+                # corrupt or truncated. start over
+                os.remove(part_path)
+                hasher.reset()
+                if attempt == max_resumes:
+                    raise SystemError("%s of %s didn't match the server's" %
+                                      (", ".join(bad), url.split("?")[0]))
+                continue
+            os.replace(part_path, dest)
+            digests['verified'] = sorted(a for a in expected if a in digests)
+            if ('md5' not in digests and 'md5' in expected
+                    and len(digests['verified']) > 0):
+                # a segmented download matched the server's crc32c, so it has
+                # the md5 the server reported too
+                digests['md5'] = expected['md5']
+            return digests
+        except (requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            # keep the .part file so the next attempt picks up where we left off
+            if attempt == max_resumes:
+                raise
+    raise SystemError("Unable to download %s" % url.split("?")[0])
@@ -7,20 +7,175 @@ Contributors: James Harvey
 
 # libraries
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import h5py
 import pandas as pd
 import json
+import warnings
 
 import fake_hisepy.utils.utils as cu
+from fake_hisepy.h5pool.h5pool import H5Handle
 from fake_hisepy.config.config import config as CONFIG
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# parsed csv results are saved next to the csv in arrow ipc format
+sidecar_suffix = ".arrow"
+# table types the *_to_df functions can build
+backends = ['pandas', 'arrow', 'polars']
+
+
+def _source_stamp(filepath: str):
+    stat = os.stat(filepath)
+    return {
+        b'source_size': b'%d' % stat.st_size,
+        b'source_mtime': b'%d' % stat.st_mtime_ns
+    }
+
+
+def read_csv_sidecar(filepath: str):
+    """ 
+    Returns the data.frame saved in filepath's arrow sidecar, or None if there is no 
+    sidecar or the csv has changed since it was written. The sidecar is memory-mapped,
+    which skips parsing, but its columns are still copied into the data.frame once.
+    """
+    sidecar = filepath + sidecar_suffix
+    if pa is None or not os.path.exists(sidecar):
+        return None
+    try:
+        with pa.memory_map(sidecar, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        metadata = table.schema.metadata or {}
+        for k, v in _source_stamp(filepath).items():
+            if metadata.get(k) != v:
+                return None
+        # zero-copy columns would be read-only views of the map, so in-place edits
+        # (df.loc[...] = ...) would fail. pd.ArrowDtype columns would avoid that,
+        # but then dtypes would differ from the pd.read_csv result of the first read
+        return table.to_pandas()
+    except (pa.ArrowException, OSError):
+        return None
+
+
+def write_csv_sidecar(filepath: str, df: pd.DataFrame):
+    """ 
+    Saves an already parsed csv next to it in arrow ipc format. Frames arrow can't 
+    represent, or directories that aren't writable, are skipped.
+    """
+    if pa is None:
+        return False
+    sidecar = filepath + sidecar_suffix
+    tmp_path = '%s.%d.tmp' % (sidecar, os.getpid())
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            **_source_stamp(filepath)
+        })
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, sidecar)
+        return True
+    except (pa.ArrowException, OSError, TypeError, ValueError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def read_csv_cached(filepath: str):
+    """ pd.read_csv, reusing the arrow sidecar of an earlier parse while the csv is unchanged """
+    if not CONFIG['CACHE']['CSV_SIDECAR']:
+        return pd.read_csv(filepath)
+    df = read_csv_sidecar(filepath)
+    if df is None:
+        df = pd.read_csv(filepath)
+        write_csv_sidecar(filepath, df)
+    return df
+
+
+def check_backend(backend: str):
+    """ Makes sure backend is one of backends and that its library is installed """
+    if backend not in backends:
+        raise ValueError("backend must be one of %s" % backends)
+    if backend in ['arrow', 'polars'] and pa is None:
+        raise ImportError("backend='%s' requires pyarrow" % backend)
+    if backend == 'polars' and pl is None:
+        raise ImportError("backend='polars' requires polars")
+    return backend
+
+
+def _arrow_column(values: list):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # values that don't share a type are kept as json text
+        return pa.array([
+            v if v is None or type(v) is str else json.dumps(v, default=str)
+            for v in values
+        ],
+                        type=pa.string())
+
+
+def records_to_table(records: list, backend: str, columns: list = None):
+    """
+    Builds a pyarrow or polars table straight from row dictionaries, without going
+    through pandas. Columns appear in the order they're first seen, and values a row
+    doesn't have are null. Column names are strings.
+
+        Parameters:
+            records : list
+                row dictionaries
+            backend : str
+                'arrow' or 'polars'
+            columns : list
+                columns the table has even if no row has them
+
+        Returns:
+            a pyarrow.Table or polars.DataFrame
+    """
+    names = {}
+    for record in records:
+        names.update(dict.fromkeys(record))
+    names.update(dict.fromkeys(columns or []))
+    table = pa.table({
+        str(col): _arrow_column([r.get(col) for r in records])
+        for col in names
+    })
+    return pl.from_arrow(table) if backend == 'polars' else table
+
+
+def _csv_table(hfile, backend: str):
+    """ Reads a csv result into a table of the backend, with a filename column """
+    filename = hfile.descriptors['file']['name']
+    if backend == 'polars':
+        return pl.read_csv(hfile.path).with_columns(
+            pl.lit(filename).alias('filename'))
+    table = pyarrow.csv.read_csv(hfile.path)
+    return table.append_column('filename',
+                               pa.array([filename] * table.num_rows))
+
+
 def convert_data_values(filepath: str, filetype: str):
     try:
         if filetype == 'csv':
-            return pd.read_csv(filepath)
+            return read_csv_cached(filepath)
         elif filetype == 'h5':
-            return h5py.File(filepath, mode='r')
+            if not h5py.is_hdf5(filepath):
+                raise OSError("%s is not an h5 file" % filepath)
+            # opened lazily through the shared handle pool
+            return H5Handle(filepath)
         else:
             return None
     except:
@@ -30,6 +185,28 @@ def convert_data_values(filepath: str, filetype: str):
 
 # there's another layer/dict under emr.patientData. is leaving a dict under this column okay?
 # Do we want to expand this and create a df? maybe have a parameter asking what users want?
+def _subject_record(subject_out: dict):
+    """
+    Flattens a single readSubjects entry into one row: string fields first, then each
+    section's fields as <section>.<field>. Dicts nested under a section are kept as is.
+    subject_out isn't modified.
+    """
+    single = {}
+    meta = {}
+    for dk, this_entry in subject_out.items():
+        if type(this_entry) == dict:
+            meta.update(
+                ('{}.{}'.format(dk, k), v) for k, v in this_entry.items())
+        elif type(this_entry) == str:
+            single[dk] = this_entry
+        else:
+            raise ValueError(
+                "There's an unexpected entry for collection... {}. please contact dev support!"
+                .format(dk))
+    single.update(meta)
+    return single
+
+
 def subject_to_df_worker(subject_out):
     """
     Takes output from readSubjects, and reformats to a data.frame
@@ -40,36 +217,19 @@ def subject_to_df_worker(subject_out):
             final_df : data.frame
                 data.frame containing data from subject materialized view
     """
-    dict_keys = subject_out.keys()
-    meta_df = pd.DataFrame()
-    single_df = pd.DataFrame()
-    for dk in dict_keys:
-        this_entry = subject_out[dk]
-        if type(this_entry) == dict:
-            this_entry.update(
-                (k, [v]) for k, v in
-                this_entry.items())  # convert values to lists inplace
-            metadata_df_tmp = pd.DataFrame.from_dict(this_entry)
-            metadata_df_tmp = metadata_df_tmp.add_prefix('{}.'.format(dk))
-            meta_df = pd.concat([meta_df, metadata_df_tmp], axis=1)
-        elif type(this_entry) == str:
-            single_tmp = pd.DataFrame([this_entry], columns=[dk])
-            single_df = pd.concat([single_df, single_tmp], axis=1)
-        else:
-            raise ValueError(
-                "There's an unexpected entry for collection... {}. please contact dev support!"
-                .format(dk))
-    final_df = pd.concat([single_df, meta_df], axis=1)
-    return final_df
+    return subject_to_df([subject_out])
 
 
-def subject_to_df(list_subject_out):
-    subject_df = subject_to_df_worker(list_subject_out[0])
-    if len(list_subject_out) > 1:
-        for i in range(1, len(list_subject_out)):
-            tmp_df = subject_to_df_worker(list_subject_out[i])
-            subject_df = pd.concat([subject_df, tmp_df], ignore_index=True)
-    return subject_df
+def subject_to_df(list_subject_out, backend: str = 'pandas'):
+    """
+    Reformats every readSubjects entry to a row of a single data.frame, built in one go.
+    Columns appear in the order they're first seen. Fields a subject doesn't have are NaN.
+    backend='arrow' or 'polars' builds a pyarrow or polars table instead.
+    """
+    records = [_subject_record(s) for s in list_subject_out]
+    if check_backend(backend) != 'pandas':
+        return records_to_table(records, backend)
+    return pd.DataFrame(records)
 
 
 def _dict_to_df(input_df, col_name):
@@ -108,88 +268,141 @@ def sample_to_df_worker(sample_out):
     Returns: 
         a dictionary of 4 data.frame objects with the following keys: ['metadata','labResults', 'specimens','survey']
     """
+    return sample_to_df([sample_out])
+
+
+def _is_json_date_column(col):
+    """ Column names read_json parses as dates by default """
+    if not isinstance(col, str):
+        return False
+    col = col.lower()
+    return col.endswith(
+        ('_at', '_time')) or col.startswith('timestamp') or col in [
+            'modified', 'date', 'datetime'
+        ]
 
-    # initialize all data.frame objects in case there is nothing to reformat
-    metadata_df = pd.DataFrame(data=[''])
-    specimen_df = pd.DataFrame(data=[''])
-    surv_df = pd.DataFrame(data=[''])
-    lab_df = pd.DataFrame(data=[''])
-    for dv in sample_out.keys():
+
+def _coerce_json_dtypes(df: pd.DataFrame, columns: list):
+    """
+    Infers dtypes of columns the way pd.read_json does: date-like column names are
+    parsed as dates, and strings that all parse as numbers become floats or ints.
+    """
+    for col in columns:
+        if col not in df or len(df) == 0:
+            continue
+        data = df[col]
+        if _is_json_date_column(col) and pd.api.types.is_string_dtype(
+                data.dtype):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                for fmt in [None, "iso8601", "mixed"]:
+                    try:
+                        df[col] = pd.to_datetime(data,
+                                                 errors="raise",
+                                                 format=fmt)
+                        break
+                    except Exception:
+                        pass
+            if df[col].dtype.kind == 'M':
+                continue
+        converted = data
+        # True/False left in an object column by rows without the key stay as is
+        is_bool = pd.api.types.infer_dtype(data, skipna=True) == 'boolean'
+        if pd.api.types.is_string_dtype(data.dtype) and not is_bool:
+            try:
+                converted = data.astype("float64")
+            except (TypeError, ValueError):
+                pass
+        if converted.dtype in ("float64", "object"):
+            try:
+                as_int = data.astype("int64")
+                if (as_int == converted).all():
+                    converted = as_int
+            except (TypeError, ValueError, OverflowError):
+                pass
+        df[col] = converted
+    return df
+
+
+def _sample_records(sample_out: dict):
+    """
+    Flattens a single read_samples() entry into metadata, specimens, survey and labResults
+    rows. Tables the sample has nothing for get a placeholder row, with '' in column 0.
+    Also returns, per table, the columns the sample's own data.frame would have had, and
+    the columns whose dtypes should be inferred like read_json's.
+    """
+    metadata = {0: ''}
+    specimens = [{0: ''}]
+    survey = [{0: ''}]
+    lab = [{0: ''}]
+    json_cols = {'specimens': [], 'survey': []}
+    for dv, this_entry in sample_out.items():
         if dv == 'specimens':
-            specimen_df = pd.read_json(json.dumps(sample_out[dv]))
+            specimens = [dict(s) for s in this_entry]
+            json_cols['specimens'] += [k for s in specimens for k in s]
         elif dv == 'survey':
-            surv_df = pd.read_json(json.dumps(sample_out[dv]))
-            if len(surv_df) == 0:
-                continue
-            # expand answers column where possible
-            answers_df = pd.DataFrame()
-            for i in list(range(0, len(surv_df))):
-                these_answers = pd.DataFrame([surv_df['answers'][i]])
-
-                # assign id for later merge
-                these_answers['id'] = surv_df.loc[i, 'id']
-
-                # concat answers together
-                answers_df = pd.concat([answers_df, these_answers])
-
-            # rename columns by adding prefix "answers"
-            answers_df = answers_df.add_prefix('answers.').reset_index(
-                drop=True)
-            surv_df = surv_df.merge(answers_df,
-                                    left_on='id',
-                                    right_on='answers.id')
-
-            # clean up
-            surv_df.drop(columns=['answers', 'answers.id'], inplace=True)
+            survey = []
+            for this_survey in this_entry:
+                record = {
+                    k: v
+                    for k, v in this_survey.items() if k != 'answers'
+                }
+                json_cols['survey'] += list(record)
+                # expand answers into answers.<question> columns
+                answers = this_survey.get('answers') or {}
+                record.update(('answers.{}'.format(k), v)
+                              for k, v in answers.items() if k != 'id')
+                survey.append(record)
         elif dv == 'lab':
-            lab_df = pd.DataFrame([sample_out[dv]])
+            if this_entry is None:
+                continue
             # expand on lab results
-            lab_results = pd.DataFrame([lab_df['labResults'][0]])
-            lab_df = pd.concat([lab_df, lab_results], axis=1)
-
-            lab_df.drop(columns='labResults', inplace=True)
+            record = {k: v for k, v in this_entry.items() if k != 'labResults'}
+            for k, v in (this_entry.get('labResults') or {}).items():
+                record.setdefault(k, v)
+            lab = [record]
 
         # everything else goes under metadata
-        else:
-            this_entry = sample_out[dv]
-
-            if type(this_entry) == str:
-                metadata_df[dv] = this_entry
-            # only want to do this for samples/subject
-            elif type(this_entry) == dict:
-                if dv in ['sample', 'subject']:
-                    tmp_df = pd.DataFrame([sample_out[dv]
-                                           ]).add_prefix('{}.'.format(dv))
-                    metadata_df = pd.concat([metadata_df, tmp_df], axis=1)
-                else:
-                    metadata_df[dv] = [sample_out[dv]]
-
-    # add idenftifier columns to each data.frame object (subjectGuid & sampleKitGuid)
-    this_subject_id = metadata_df.loc[:, 'subject.subjectGuid'].item()
-    this_samplekit_id = metadata_df.loc[:, 'sample.sampleKitGuid'].item()
-    this_project_id = metadata_df.loc[:, 'projectGuid'].item()
-    for this_obj in [lab_df, surv_df, specimen_df]:
-        this_obj['subjectGuid'] = str(this_subject_id)
-        this_obj['sampleKitGuid'] = str(this_samplekit_id)
-        this_obj['projectGuid'] = str(this_project_id)
-
-    dict_df = {
-        'metadata': metadata_df,
-        'specimens': specimen_df,
-        'survey': surv_df,
-        'labResults': lab_df
+        elif type(this_entry) == str:
+            metadata[dv] = this_entry
+        # only want to do this for samples/subject
+        elif type(this_entry) == dict:
+            if dv in ['sample', 'subject']:
+                metadata.update(
+                    ('{}.{}'.format(dv, k), v) for k, v in this_entry.items())
+            else:
+                metadata[dv] = this_entry
+
+    # add idenftifier columns to each table (subjectGuid & sampleKitGuid)
+    ids = {
+        'subjectGuid': str(metadata['subject.subjectGuid']),
+        'sampleKitGuid': str(metadata['sample.sampleKitGuid']),
+        'projectGuid': str(metadata['projectGuid'])
     }
-
-    return dict_df
+    records = {
+        'metadata': [metadata],
+        'specimens': [dict(r, **ids) for r in specimens],
+        'survey': [dict(r, **ids) for r in survey],
+        'labResults': [dict(r, **ids) for r in lab]
+    }
+    # a sample with an empty list only has the identifier columns
+    columns = {
+        k: list(dict.fromkeys(col for r in rows for col in r)) or list(ids)
+        for k, rows in records.items()
+    }
+    return records, columns, json_cols
 
 
-def sample_to_df(list_of_sample_obj):
+def sample_to_df(list_of_sample_obj, backend: str = 'pandas'):
     """
     Given a list of outputs from readSamples(), returns the same data but in a dictionary of data.frames format
 
         Parameters:
             list_of_sample_obj : list
                 list of dictionaries for each sampleID
+            backend : str
+                'pandas', or 'arrow'/'polars' to build pyarrow/polars tables straight from the
+                records. Those keep the json types of specimens and survey fields as is
         Returns:
             sample_df_dict : dictionary
                 dictionary with keys ['metadata','specimens'] where each key is mapped to a data.frame
@@ -198,81 +411,226 @@ def sample_to_df(list_of_sample_obj):
     if len(list_of_sample_obj) == 0:
         return {}
 
-    sample_df_dict = sample_to_df_worker(list_of_sample_obj[0])
-    if len(list_of_sample_obj) > 1:
-        # loop and append
-        for i in range(1, len(list_of_sample_obj)):
-            tmp_df_dict = sample_to_df_worker(list_of_sample_obj[i])
-            sample_df_dict['metadata'] = pd.concat(
-                [sample_df_dict['metadata'], tmp_df_dict['metadata']],
-                ignore_index=True)
-            sample_df_dict['specimens'] = pd.concat(
-                [sample_df_dict['specimens'], tmp_df_dict['specimens']],
-                ignore_index=True)
-            sample_df_dict['survey'] = pd.concat(
-                [sample_df_dict['survey'], tmp_df_dict['survey']],
-                ignore_index=True)
-            sample_df_dict['labResults'] = pd.concat(
-                [sample_df_dict['labResults'], tmp_df_dict['labResults']],
-                ignore_index=True)
+    # flatten every sample first, then build each table once
+    records = {'metadata': [], 'specimens': [], 'survey': [], 'labResults': []}
+    columns = {k: [] for k in records}
+    json_cols = {'specimens': {}, 'survey': {}}
+    for sample_out in list_of_sample_obj:
+        sample_records, sample_columns, sample_json_cols = _sample_records(
+            sample_out)
+        for k in records:
+            records[k] += sample_records[k]
+            columns[k].append(sample_columns[k])
+        for k in json_cols:
+            json_cols[k].update(dict.fromkeys(sample_json_cols[k]))
+
+    id_cols = ['subjectGuid', 'sampleKitGuid', 'projectGuid']
+    if check_backend(backend) != 'pandas':
+        return {
+            k:
+            records_to_table(rows, backend,
+                             id_cols if k != 'metadata' else None)
+            for k, rows in records.items()
+        }
+
+    sample_df_dict = {}
+    for k, rows in records.items():
+        # columns come in the order concatenating one data.frame per sample gives
+        all_cols = list(dict.fromkeys(c for cols in columns[k] for c in cols))
+        this_df = pd.DataFrame(rows, columns=all_cols)
+        if k in json_cols:
+            this_df = _coerce_json_dtypes(this_df, list(json_cols[k]))
+        # columns some samples don't have were filled with NaN by the concat
+        for col in set(all_cols).difference(
+                set.intersection(*map(set, columns[k]))):
+            if this_df[col].dtype.kind in 'iu':
+                this_df[col] = this_df[col].astype('float64')
+            elif this_df[col].dtype.kind == 'b':
+                this_df[col] = this_df[col].astype(object)
+        sample_df_dict[k] = this_df
     return sample_df_dict
 
 
-def _desc_lab_to_df(this_desc):
+# descriptor sections that get their own table, or are left out of the descriptors table
+_non_descriptor_keys = [
+    'specimens', 'lab', 'emr', 'lastUpdated', 'labLastModified',
+    'surveyLastModified', 'survey'
+]
+_update_keys = ['lastUpdated', 'labLastModified', 'surveyLastModified']
+
+
+def _desc_lab_record(lab: dict):
+    """
+    Takes the lab section of a file descriptor and flattens it into a single labResults
+    row: the lab results, then the rest of the lab section, then the most recent
+    revision's data history and details. Earlier columns win when names repeat.
+
+        Parameters:
+            lab : dict
+                lab section of a descriptor, which contains labResults
+
+        Returns:
+            record : dict of labResults columns, empty if there's nothing to report
+    """
+    record = {}
+
+    def _add(section):
+        for k, v in (section or {}).items():
+            record.setdefault(k, v)
+
+    _add(lab.get('labResults'))
+    _add({k: v for k, v in lab.items() if k != 'labResults'})
+    revisions = lab.get('revisionHistory')
+    if revisions and revisions[0] is not None:
+        _add(revisions[0].get('dataHistory'))
+        _add({k: v for k, v in revisions[0].items() if k != 'dataHistory'})
+    return record
+
+
+def _desc_specimen_records(specimens: list, sample_kit_guid):
+    return [
+        dict(specimen, sampleKitGuid=sample_kit_guid) for specimen in specimens
+    ]
+
+
+def _descriptor_records(this_desc: dict):
+    """
+    Flattens a single file descriptor into a descriptors row (<section>.<field> columns
+    and the last modified timestamps), a labResults row and a list of specimens rows.
+    this_desc isn't modified.
+    """
+    assert type(
+        this_desc
+    ) is dict, "expected descriptors to be a dictionary. Received type %s" % type(
+        this_desc)
+    desc_record = {}
+    for dk, section in this_desc.items():
+        if (dk in _non_descriptor_keys) or (section is None) or (section
+                                                                 == []):
+            continue
+        # prefix each field with its section (i.e lab.<col>, file.<col>, etc)
+        desc_record.update(
+            ('{}.{}'.format(dk, k), v) for k, v in section.items())
+    for update_col in _update_keys:
+        desc_record[update_col] = this_desc.get(update_col)
+
+    lab_record = _desc_lab_record(this_desc['lab'])
+    spec_records = _desc_specimen_records(this_desc['specimens'],
+                                          this_desc['sample']['sampleKitGuid'])
+    return desc_record, lab_record, spec_records
+
+
+def flatten_descriptors(list_of_desc: list):
+    """
+    Flattens file descriptors into rows of the descriptors, labResults and specimens
+    tables. Olink files have a list of descriptors, each of which gets its own rows.
+
+        Parameters:
+            list_of_desc : list
+                descriptor dictionaries, or lists of them
+
+        Returns:
+            dictionary with keys {'descriptors', 'labResults', 'specimens'}, each a list of
+            row dictionaries in the same order as list_of_desc
+    """
+    records = {'descriptors': [], 'labResults': [], 'specimens': []}
+    for this_desc in list_of_desc:
+        for desc in this_desc if type(this_desc) is list else [this_desc]:
+            try:
+                desc_record, lab_record, spec_records = _descriptor_records(
+                    desc)
+            except Exception as e:
+                raise ValueError(
+                    "reshaping descriptor failed. descriptor: {}".format(
+                        desc)) from e
+            records['descriptors'].append(desc_record)
+            if len(lab_record) > 0:
+                records['labResults'].append(lab_record)
+            records['specimens'] += spec_records
+    return records
+
+
+def records_to_df(records: dict):
+    """ Builds each table of flatten_descriptors() output in one go """
+    dict_df = {k: pd.DataFrame(v) for k, v in records.items()}
+    if len(records['descriptors']
+           ) > 0 and 'sampleKitGuid' not in dict_df['specimens']:
+        # descriptors without specimens still get an empty specimens table with its key
+        dict_df['specimens']['sampleKitGuid'] = []
+    return dict_df
+
+
+def _partition_to_df(partition: list):
+    # runs in a worker process, so it has to be a module level function
+    return records_to_df(flatten_descriptors(partition))
+
+
+def resolve_n_jobs(n_jobs: int = None):
+    """ Returns a process count, defaulting to [FORMAT] N_JOBS. -1 means every core """
+    if n_jobs is None:
+        n_jobs = CONFIG['FORMAT']['N_JOBS']
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if type(n_jobs) is not int or n_jobs < 1:
+        raise ValueError("n_jobs must be a positive integer or -1")
+    return n_jobs
+
+
+def descriptors_to_df(list_of_desc: list,
+                      n_jobs: int = None,
+                      partition_size: int = None,
+                      backend: str = 'pandas'):
     """
-    Takes a file descriptor and reshapes lab results into a data.frame
+    Reshapes many file descriptors at once into a dictionary of data.frames, building
+    each table a single time. With n_jobs > 1, lists longer than partition_size are
+    split into partitions that are reshaped in a process pool, then merged in order.
 
         Parameters:
-            this_desc : dict
-                dictionary that contains labResults
+            list_of_desc : list
+                descriptor dictionaries, or lists of them for Olink files
+            n_jobs : int
+                number of processes, -1 for every core. Defaults to [FORMAT] N_JOBS
+            partition_size : int
+                descriptors per partition. Defaults to [FORMAT] PARTITION_SIZE
+            backend : str
+                'pandas', or 'arrow'/'polars' to build pyarrow/polars tables straight from
+                the records. Those are always built in this process
 
         Returns:
-            lab_df : data.frame of labResults
-    """
-
-    lab_df = pd.DataFrame()
-
-    # copy results, and convert entries to list
-    if this_desc['labResults'] is None:
-        labr = pd.DataFrame()
-    else:
-        labr = this_desc['labResults'].copy()
-        labr.update((k, [v]) for k, v in labr.items())
-
-    # handle revision history
-    if (this_desc['revisionHistory'] is None) or (this_desc['revisionHistory']
-                                                  == list()):
-        revision_df = pd.DataFrame()
-    else:
-        revh = this_desc['revisionHistory'][0]
-        revision_df = pd.DataFrame()
-        if revh is not None:
-            datah = revh['dataHistory'].copy()
-            datah.update((k, [v]) for k, v in datah.items())
-            datah_df = pd.DataFrame(datah)
-            revh.pop('dataHistory')
-            revh.update((k, [v]) for k, v in revh.items())
-            revision_df = pd.concat([datah_df, pd.DataFrame(revh)], axis=1)
-
-    # remove labResult from this entry and convert the rest into a data.frame
-    this_desc.pop('labResults')
-    this_desc.update((k, [v]) for k, v in this_desc.items())
-
-    lab_df = pd.concat(
-        [pd.DataFrame(labr),
-         pd.DataFrame(this_desc), revision_df], axis=1)
-    #de-dupe
-    return lab_df.loc[:, ~lab_df.columns.duplicated()]
-
-
-def _desc_specimen_to_df(this_desc, sample_kit_guid):
-    spec_df = pd.DataFrame()
-    for i in range(0, len(this_desc)):
-        this_desc[i].update((k, [v]) for k, v in this_desc[i].items())
-        specimen_tmp = pd.DataFrame.from_dict(this_desc[i])
-        spec_df = pd.concat([spec_df, specimen_tmp], axis=0)
-    spec_df['sampleKitGuid'] = sample_kit_guid
-    return spec_df
+            dictionary with keys {'descriptors', 'labResults', 'specimens'}. Rows are in the
+            same order as list_of_desc, with a RangeIndex
+    """
+    n_jobs = resolve_n_jobs(n_jobs)
+    if partition_size is None:
+        partition_size = CONFIG['FORMAT']['PARTITION_SIZE']
+    if type(partition_size) is not int or partition_size < 1:
+        raise ValueError("partition_size must be a positive integer")
+    list_of_desc = list(list_of_desc)
+    if check_backend(backend) != 'pandas':
+        records = flatten_descriptors(list_of_desc)
+        return {
+            k:
+            records_to_table(v, backend, ['sampleKitGuid'] if k == 'specimens'
+                             and len(records['descriptors']) > 0 else None)
+            for k, v in records.items()
+        }
+    if n_jobs == 1 or len(list_of_desc) <= partition_size:
+        return records_to_df(flatten_descriptors(list_of_desc))
+
+    partitions = [
+        list_of_desc[i:i + partition_size]
+        for i in range(0, len(list_of_desc), partition_size)
+    ]
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(partitions))) as pool:
+        partition_dfs = list(pool.map(_partition_to_df, partitions))
+    dict_df = {}
+    for k in partition_dfs[0]:
+        # empty tables carry no dtypes, so they'd turn every column they share to object
+        frames = [p[k] for p in partition_dfs if len(p[k]) > 0]
+        dict_df[k] = pd.concat(
+            frames,
+            ignore_index=True) if len(frames) > 0 else partition_dfs[0][k]
+    return dict_df
 
 
 def reshape_descriptors(this_desc):
@@ -282,114 +640,202 @@ def reshape_descriptors(this_desc):
         this_desc
     ) is dict, "expected descriptors to be a dictionary. Received type %s" % type(
         this_desc)
-    dict_df = {
-        'descriptors': pd.DataFrame(),
-        'labResults': pd.DataFrame(),
-        'specimens': pd.DataFrame()
-    }
-    this_df_desc = pd.DataFrame()
-    for dk in this_desc.keys():
-        if (dk in [
-                'specimens', 'lab', 'emr', 'lastUpdated', 'labLastModified',
-                'surveyLastModified', 'survey'
-        ]) | (this_desc[dk] is None) | (this_desc[dk] == []):
+    return descriptors_to_df([this_desc])
+
+
+def compact_df(df: pd.DataFrame, max_ratio: float = None):
+    """
+    Shrinks a data.frame in place: the lastUpdated, labLastModified and surveyLastModified
+    timestamps become datetime64, and string columns with few distinct values (ids,
+    cohorts, file types) become categoricals. Columns holding dicts or lists are left as is.
+
+        Parameters:
+            df : data.frame
+                table returned by one of the *_to_df functions
+            max_ratio : float
+                max distinct values per row for a column to become categorical.
+                Defaults to [FORMAT] CATEGORY_MAX_RATIO
+
+        Returns:
+            df
+    """
+    if max_ratio is None:
+        max_ratio = CONFIG['FORMAT']['CATEGORY_MAX_RATIO']
+    for col in df.columns:
+        data = df[col]
+        if not pd.api.types.is_string_dtype(data.dtype):
             continue
-        # convert dictionary to dataframe
-        copy_tmp = this_desc[dk].copy()
-        copy_tmp.update((k, [v]) for k, v in copy_tmp.items())
-        tmp_df = pd.DataFrame(copy_tmp)
-
-        # rename columns by adding a prefix (i.e lab.<col>, file.<col>, etc)
-        tmp_df_cols = tmp_df.columns.tolist()
-        new_cols = ['{}.{}'.format(dk, i) for i in tmp_df_cols]
-        tmp_df.columns = new_cols
-
-        this_df_desc = pd.concat([this_df_desc, tmp_df], axis=1)
-
-    # handle lastUpdated, labLastModified, and surveyLastModified - create df then rename column
-    update_df = pd.DataFrame()
-    for update_col in ['lastUpdated', 'labLastModified', 'surveyLastModified']:
-        this_desc[update_col] = [this_desc[update_col]]
-        update_df = pd.DataFrame.from_dict(
-            this_desc[update_col]).rename(columns={0: update_col})
-        this_df_desc = pd.concat([this_df_desc, update_df],
-                                 axis=1)  #column bind
-
-    # now take care of lab results
-    lab_df = _desc_lab_to_df(this_desc['lab'].copy())
-
-    # and now handle specimens
-    spec_df = _desc_specimen_to_df(this_desc['specimens'],
-                                   this_desc['sample']['sampleKitGuid'])
-
-    # do some final cleaning and return a dictionary of data.frames
-    dict_df['descriptors'] = this_df_desc
-    dict_df['labResults'] = lab_df
-    dict_df['specimens'] = spec_df
-    return dict_df
+        if col in _update_keys:
+            try:
+                df[col] = pd.to_datetime(data, format="ISO8601", utc=True)
+                continue
+            except (TypeError, ValueError):
+                pass
+        try:
+            n_unique = data.nunique()
+        except TypeError:
+            # dicts and lists aren't hashable
+            continue
+        if n_unique <= max_ratio * len(data):
+            df[col] = data.astype('category')
+    return df
 
 
-def hise_file_to_df(list_of_hise_files):
+def compact_frames(frames, compact=None):
+    """
+    Applies compact_df to a data.frame, or to every data.frame in a dictionary.
+
+        Parameters:
+            frames : data.frame or dict
+                output of one of the *_to_df functions
+            compact : bool
+                True or False to force it on or off. None compacts results with at least
+                [FORMAT] COMPACT_MIN_ROWS rows
+
+        Returns:
+            frames
+    """
+    dfs = list(frames.values()) if type(frames) is dict else [frames]
+    if compact is None:
+        compact = max([len(df) for df in dfs] +
+                      [0]) >= CONFIG['FORMAT']['COMPACT_MIN_ROWS']
+    if compact:
+        for df in dfs:
+            compact_df(df)
+    return frames
+
+
+def _filter_rows(df: pd.DataFrame, row_filter):
+    if row_filter is None:
+        return df
+    if callable(row_filter):
+        return df.loc[row_filter(df)]
+    mask = pd.Series(True, index=df.index)
+    for col, values in row_filter.items():
+        mask &= df[col].isin(values)
+    return df.loc[mask]
+
+
+def iter_csv_values(list_of_hise_files,
+                    chunksize: int = None,
+                    usecols: list = None,
+                    row_filter=None):
+    """
+    Reads the csv results of hise_file objects piece by piece, parsing only the columns
+    that are needed.
+
+        Parameters:
+            list_of_hise_files : list
+                a list of hise_file objects for csv files
+            chunksize : int
+                rows per chunk. None reads each file as a single chunk
+            usecols : list
+                columns to keep. Other columns are never parsed
+            row_filter : dict or callable
+                either {column: [values]} keeping rows whose column is in values, or a
+                function taking a data.frame chunk and returning a boolean mask
+
+        Returns:
+            generator of data.frames, each with a 'filename' column naming its source file
+    """
+    if row_filter is not None and not callable(row_filter) and type(
+            row_filter) is not dict:
+        raise TypeError("row_filter must be a dict or a function")
+    read_cols = None
+    if usecols is not None:
+        usecols = [c for c in usecols if c != 'filename']
+        read_cols = list(usecols)
+        if type(row_filter) is dict:
+            read_cols += [c for c in row_filter if c not in read_cols]
+
+    for hfile in list_of_hise_files:
+        filename = hfile.descriptors['file']['name']
+        if chunksize is None:
+            chunks = [pd.read_csv(hfile.path, usecols=read_cols)]
+        else:
+            chunks = pd.read_csv(hfile.path,
+                                 usecols=read_cols,
+                                 chunksize=chunksize)
+        for chunk in chunks:
+            chunk = _filter_rows(chunk, row_filter)
+            if usecols is not None:
+                chunk = chunk[usecols]
+            yield chunk.assign(filename=filename)
+
+
+def hise_file_to_df(list_of_hise_files,
+                    chunksize: int = None,
+                    usecols: list = None,
+                    row_filter=None,
+                    n_jobs: int = None,
+                    backend: str = 'pandas'):
     """
     Given a list of hise_file objects, return a dictionary containing a data.frame of descriptors, and a data.frame of lab results
 
         Parameters:
             list_of_hise_files : list
                 a list of hise_file objects
+            chunksize : int
+                csv only. 'values' becomes a generator of data.frames of at most chunksize
+                rows, tagged with filename, instead of a single data.frame
+            usecols : list
+                csv only. columns of the values to parse
+            row_filter : dict or callable
+                csv only. rows of the values to keep. See iter_csv_values()
+            n_jobs : int
+                processes used to reshape the descriptors. See descriptors_to_df()
+            backend : str
+                'pandas', or 'arrow'/'polars' for pyarrow/polars tables. csv values are then
+                read straight into one table. chunksize, usecols and row_filter need pandas
 
         Returns:
             final_dict : dictionary with keys {'descriptors',labResults', 'specimens', 'values'} which are all data.frame objects.
             except for values, which depends on the filetype the user passes in.
     """
     filetype = list_of_hise_files[0].filetype
-    list_dict = []
-    values_df = pd.DataFrame()
+    # chunked or column/row subsets are read straight from disk rather than data_values
+    partial_read = chunksize is not None or usecols is not None or row_filter is not None
+    if check_backend(backend) != 'pandas' and partial_read:
+        raise ValueError(
+            "chunksize, usecols and row_filter are only supported with backend='pandas'"
+        )
     values_list = []
     for i in range(0, len(list_of_hise_files)):
-        this_desc = list_of_hise_files[i].descriptors
-        if type(this_desc) is list:
-            for olink_desc in this_desc:
-                tmp_df = reshape_descriptors(olink_desc)
-                list_dict += [tmp_df]
-
-        elif type(this_desc) is dict:
-            tmp_df = reshape_descriptors(this_desc)
-            list_dict += [tmp_df]
-
         # create an object of data values for a given data type
-        if filetype == 'csv':
+        if filetype == 'csv' and backend != 'pandas':
+            values_list.append(_csv_table(list_of_hise_files[i], backend))
+        elif filetype == 'csv' and not partial_read:
             # attach file_name
             list_of_hise_files[i].data_values['filename'] = list_of_hise_files[
                 i].descriptors['file']['name']
-            values_df = pd.concat(
-                [values_df, list_of_hise_files[i].data_values],
-                ignore_index=True)
+            values_list.append(list_of_hise_files[i].data_values)
         elif filetype == 'h5':
             values_list.append(list_of_hise_files[i].data_values)
 
-    # go through all results from read_files() output, and create a master dictionary
-    # then parse through and append appropriately
-    desc_df = pd.DataFrame()
-    lab_df = pd.DataFrame()
-    spec_df = pd.DataFrame()
-    for i in range(0, len(list_dict)):
-        desc_df = pd.concat([desc_df, list_dict[i]['descriptors']],
-                            ignore_index=True)
-        lab_df = pd.concat([lab_df, list_dict[i]['labResults']],
-                           ignore_index=True)
-        spec_df = pd.concat([spec_df, list_dict[i]['specimens']],
-                            ignore_index=True)
-
-    if filetype == 'csv':
-        data_values = values_df
+    # build the descriptors, labResults and specimens tables of every file at once
+    list_of_desc = [
+        f.descriptors for f in list_of_hise_files
+        if type(f.descriptors) in (list, dict)
+    ]
+    dict_df = descriptors_to_df(list_of_desc, n_jobs=n_jobs, backend=backend)
+
+    if filetype == 'csv' and chunksize is not None:
+        data_values = iter_csv_values(list_of_hise_files, chunksize, usecols,
+                                      row_filter)
+    elif filetype == 'csv' and partial_read:
+        data_values = pd.concat(list(
+            iter_csv_values(list_of_hise_files, None, usecols, row_filter)),
+                                ignore_index=True)
+    elif filetype == 'csv' and backend == 'polars':
+        data_values = pl.concat(values_list, how='diagonal_relaxed')
+    elif filetype == 'csv' and backend == 'arrow':
+        data_values = pa.concat_tables(values_list,
+                                       promote_options='permissive')
+    elif filetype == 'csv':
+        data_values = pd.concat(values_list, ignore_index=True)
     elif filetype == 'h5':
         data_values = values_list
     else:  # don't return anything useful under values
         data_values = []
-    final_dict = {
-        'descriptors': desc_df,
-        'labResults': lab_df,
-        'specimens': spec_df,
-        'values': data_values
-    }
+    final_dict = dict(dict_df, values=data_values)
     return final_dict
@@ -0,0 +1,204 @@
+""" h5pool.py
+
+Description: bounded pool of read-only h5py file handles for h5 results. Files are
+    opened on first use, and the least recently used handles are closed once more than
+    [H5] MAX_OPEN_HANDLES are open, so scanning many results doesn't leak file
+    descriptors or chunk caches.
+"""
+
+import collections
+import threading
+
+import h5py
+
+from fake_hisepy.config.config import config as CONFIG
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class H5HandlePool:
+    """ A class representing a bounded, least recently used pool of open h5 files.
+
+    Attributes:
+        max_open (int): max number of files left open while nobody is using them.
+        rdcc_nbytes (int): size, in bytes, of each open file's raw data chunk cache.
+        rdcc_nslots (int): number of slots in each file's chunk cache hash table.
+        rdcc_w0 (float): chunk cache eviction preference for fully read chunks, 0 to 1.
+    """
+
+    def __init__(self,
+                 max_open: int = None,
+                 rdcc_nbytes: int = None,
+                 rdcc_nslots: int = None,
+                 rdcc_w0: float = None):
+        """ Inits H5HandlePool object """
+        self.max_open = max_open if max_open is not None else CONFIG['H5'][
+            'MAX_OPEN_HANDLES']
+        if type(self.max_open) is not int or self.max_open < 1:
+            raise ValueError("max_open must be a positive integer")
+        self.rdcc_nbytes = rdcc_nbytes if rdcc_nbytes is not None else CONFIG[
+            'H5']['RDCC_NBYTES']
+        self.rdcc_nslots = rdcc_nslots if rdcc_nslots is not None else CONFIG[
+            'H5']['RDCC_NSLOTS']
+        self.rdcc_w0 = rdcc_w0 if rdcc_w0 is not None else CONFIG['H5'][
+            'RDCC_W0']
+        self._files = collections.OrderedDict()
+        self._in_use = collections.Counter()
+        self._lock = threading.RLock()
+
+    def _evict(self, keep: str = None):
+        """ Closes idle handles, least recently used first, until within max_open """
+        for path in list(self._files):
+            if len(self._files) <= self.max_open:
+                break
+            if self._in_use[path] == 0 and path != keep:
+                self._files.pop(path).close()
+
+    def get(self, path: str):
+        """ Returns an open h5py.File for path, opening it if needed """
+        with self._lock:
+            f = self._files.get(path)
+            if f is None or not f.id.valid:
+                f = h5py.File(path,
+                              mode='r',
+                              rdcc_nbytes=self.rdcc_nbytes,
+                              rdcc_nslots=self.rdcc_nslots,
+                              rdcc_w0=self.rdcc_w0)
+                self._files[path] = f
+            self._files.move_to_end(path)
+            self._evict(keep=path)
+            return f
+
+    def acquire(self, path: str):
+        """ Like get(), but the handle won't be closed until release() is called """
+        with self._lock:
+            self._in_use[path] += 1
+            try:
+                return self.get(path)
+            except Exception:
+                self.release(path)
+                raise
+
+    def release(self, path: str):
+        with self._lock:
+            self._in_use[path] -= 1
+            if self._in_use[path] <= 0:
+                del self._in_use[path]
+            self._evict()
+
+    def close(self, path: str):
+        """ Closes the handle for path, if open and not in use """
+        with self._lock:
+            if path in self._files and self._in_use[path] == 0:
+                self._files.pop(path).close()
+
+    def close_all(self):
+        """ Closes every handle that isn't in use """
+        with self._lock:
+            for path in list(self._files):
+                self.close(path)
+
+    def open_count(self):
+        with self._lock:
+            return len(self._files)
+
+
+class H5Handle:
+    """ A class representing a lazily opened h5 result, backed by an H5HandlePool.
+
+    Indexing and attribute access are passed through to the h5py.File, which may be
+    closed again by the pool once other files are opened. Use it as a context manager
+    to keep the file open while holding on to its datasets:
+
+        with hise_file_obj.data_values as f:
+            counts = f['X'][:100]
+
+    Attributes:
+        path (str): path of the h5 file.
+        pool (H5HandlePool): pool the file is opened through. Defaults to get_h5_pool().
+    """
+
+    def __init__(self, path: str, pool: H5HandlePool = None):
+        """ Inits H5Handle object. The file isn't opened until it's used """
+        self.path = path
+        self._pool = pool
+
+    @property
+    def pool(self):
+        # resolved on every use so configure_h5_pool() applies to existing handles
+        return self._pool if self._pool is not None else get_h5_pool()
+
+    @property
+    def file(self):
+        return self.pool.get(self.path)
+
+    def __enter__(self):
+        return self.pool.acquire(self.path)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.path)
+
+    def __getitem__(self, key):
+        return self.file[key]
+
+    def __contains__(self, key):
+        return key in self.file
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __len__(self):
+        return len(self.file)
+
+    def __getattr__(self, name):
+        if name in ('path', '_pool'):
+            raise AttributeError(name)
+        return getattr(self.file, name)
+
+    def close(self):
+        self.pool.close(self.path)
+
+    def __repr__(self):
+        return "<H5Handle %s>" % self.path
+
+
+def get_h5_pool():
+    """ Returns the process-wide H5HandlePool, creating it on first use """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = H5HandlePool()
+    return _pool
+
+
+def configure_h5_pool(max_open: int = None,
+                      rdcc_nbytes: int = None,
+                      rdcc_nslots: int = None,
+                      rdcc_w0: float = None):
+    """
+    Replaces the process-wide H5HandlePool with one using the given settings.
+    Unspecified settings fall back on the [H5] section of config.toml. Files that
+    are already open keep their chunk cache settings until they're reopened.
+
+    Parameters:
+        max_open (int): max number of h5 files left open
+        rdcc_nbytes (int): size, in bytes, of each file's raw data chunk cache
+        rdcc_nslots (int): number of slots in each file's chunk cache hash table
+        rdcc_w0 (float): chunk cache eviction preference for fully read chunks, 0 to 1
+    Returns:
+        the new H5HandlePool
+    Example:
+        configure_h5_pool(max_open=64, rdcc_nbytes=64 * 1024**2)
+    """
+    global _pool
+    with _pool_lock:
+        old_pool = _pool
+        _pool = H5HandlePool(max_open=max_open,
+                             rdcc_nbytes=rdcc_nbytes,
+                             rdcc_nslots=rdcc_nslots,
+                             rdcc_w0=rdcc_w0)
+    if old_pool is not None:
+        old_pool.close_all()
+    return _pool
@@ -1,8 +1,8 @@
-import requests
 import os
 
 import fake_hisepy.utils.utils as cu
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header
+from fake_hisepy.auth.auth import get_from_metadata_server
+from fake_hisepy.session.session import get_session, hise_url
 from fake_hisepy.config.config import config as CONFIG
 
 def stop_ide():
@@ -10,14 +10,9 @@ def stop_ide():
     # get IDE name
     this_ide_name = get_from_metadata_server(
         CONFIG['AUTHORIZE']['INSTANCE_NAME_PATH'])
-    obj = cu.parse_hise_response(
-        requests.request("POST",
-                         "https://{s}/{tool}/{ide}/stop".format(
-                             s=get_from_metadata_server(
-                                 CONFIG['AUTHORIZE']['SERVER_ID_PATH']),
-                             tool=CONFIG['TOOLCHAIN']['TOOLCHAIN_IDE'],
-                             ide=this_ide_name),
-                         headers=get_bearer_token_header()))
+    obj = cu.parse_hise_response(get_session().post(
+        hise_url('toolchain', 'toolchain_ide',
+                 '{ide}/stop'.format(ide=this_ide_name))))
     if obj is None:
         raise SystemError('unable to find IDE: {}'.format(this_ide_name))
     else:
@@ -29,14 +24,9 @@ def suspend_ide():
     # get IDE name
     this_ide_name = get_from_metadata_server(
         CONFIG['AUTHORIZE']['INSTANCE_NAME_PATH'])
-    obj = cu.parse_hise_response(
-        requests.request("POST",
-                         "https://{s}/{tool}/{ide}/suspend".format(
-                             s=get_from_metadata_server(
-                                 CONFIG['AUTHORIZE']['SERVER_ID_PATH']),
-                             tool=CONFIG['TOOLCHAIN']['TOOLCHAIN_IDE'],
-                             ide=this_ide_name),
-                         headers=get_bearer_token_header()))
+    obj = cu.parse_hise_response(get_session().post(
+        hise_url('toolchain', 'toolchain_ide',
+                 '{ide}/suspend'.format(ide=this_ide_name))))
     if obj is None:
         raise SystemError('unable to find IDE: {}'.format(this_ide_name))
     else:
@@ -10,10 +10,9 @@ import os
 
 import numpy as np
 import pandas as pd
-import requests
 
 import fake_hisepy.utils.utils as cu
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, server_id_path
+from fake_hisepy.session.session import get_session, hise_url
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -38,10 +37,10 @@ def lookup_queryable_fields(field_type='all'):
     for cf in collection_fields:
 
         # get a list of searchable fields
-        url = 'https://{ser}/{led}?field_names=true'.format(
-            ser=get_from_metadata_server(server_id_path),
-            led=CONFIG['LEDGER']['{}_SEARCH_PATH'.format(cf.upper())])
-        resp = requests.post(url, headers=get_bearer_token_header())
+        url = hise_url('ledger',
+                       '{}_search_path'.format(cf),
+                       args={'field_names': 'true'})
+        resp = get_session().post(url)
         fields = json.loads(resp.text)
 
         # filter to just the collection type user requested
@@ -112,14 +111,13 @@ def lookup_unique_entries(field):
     if field in ['pool', 'panel']:
         # suffix ID needs to be added for pool and panel when making a request
         field = '{}ID'.format(field)
-    url = 'https://{ser}/{led}/{ft}?distinct_field={fi}'.format(
-        ser=get_from_metadata_server(server_id_path),
-        led=CONFIG['LEDGER']['LEDGER_NAME'],
-        ft=field_type,
-        fi=field)
+    url = hise_url('ledger',
+                   'ledger_name',
+                   resource=field_type,
+                   args={'distinct_field': field})
 
     #  make request and parse through result
-    resp = requests.request('GET', url, headers=get_bearer_token_header())
+    resp = get_session().get(url)
     unique_fields = json.loads(resp.text)
 
     # remove empty entry if it exists
@@ -1,18 +1,20 @@
 import json
 import os
 import pathlib
-import urllib
+import time
 import uuid
 import pandas as pd
 import copy
 from termcolor import colored
 
-import requests
-
 import fake_hisepy.utils.utils as cu
+import fake_hisepy.cache.cache as hc
+import fake_hisepy.cache.query_cache as hqc
+import fake_hisepy.cache.descriptor_index as hdi
+import fake_hisepy.download.download as dl
 import fake_hisepy.format.format as hf
 import fake_hisepy.lookup.lookup as hl
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, server_id_path
+from fake_hisepy.session.session import get_session, get_server, hise_url
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -57,30 +59,70 @@ class hise_file:
             self.filetype = None
             self.data_values = None
 
+    @property
+    def data_values(self):
+        """ Contents of the file, read from disk the first time they're accessed """
+        if (self._data_values is None and self.status is True
+                and self.path is not None):
+            self._data_values = hf.convert_data_values(self.path,
+                                                       self.filetype)
+        return self._data_values
+
+    @data_values.setter
+    def data_values(self, value):
+        self._data_values = value
+
+    def release(self):
+        """ Frees the file contents held in memory. They are re-read on next access """
+        if hasattr(self._data_values, 'close'):
+            # H5Handle of an h5 result
+            self._data_values.close()
+        self._data_values = None
+
     def load(self):
         """ Loads hise_file and downloads onto user's workspace. """
         if self.path is not None and os.path.exists(self.path):
             #already loaded
             return True
 
-        obj = read_files([str(self.id)])
-        if len(obj) == 0:
+        # already downloaded by an earlier read_files/cache_files call
+        entry = hc.get_manifest().lookup(self.id)
+        if entry is not None and entry['descriptors'] is not None:
+            self.descriptors = entry['descriptors']
+            self.path = entry['path']
+            self.filetype = cu.get_filetype(self.path)
+            self.status = True
+            self.message = "OK"
+            return True
+
+        obj = read_files([str(self.id)], to_df=False)
+        if len(obj) == 0 or obj[0].status is False:
             raise TypeError("Failed to load file %s" % self.id)
 
         self.descriptors = obj[0].descriptors
         self.path = obj[0].path
+        self.filetype = obj[0].filetype
         self.status = True
         self.message = "OK"
 
 
 # TODO: refactor and expand logic to some mongo-human query translator class
-def _add_prefix_to_query(user_query: dict):
-    """ Takes user's query and adds the appropriate prefix to the field_names """
+def _query_field_paths():
+    """ Returns {field: '<field_type>.<field>'}, the one section each queryable field is searched in """
     # create data.frame of all queryable fields
-    new_query_dict = user_query.copy()
     q_df = hl.lookup_queryable_fields()
     q_df = q_df.loc[~q_df[['field_type', 'field']].duplicated(),
                     ]  # drop duplicates
+    field_paths = {}
+    for field, field_type in zip(q_df['field'], q_df['field_type']):
+        field_paths.setdefault(field, '{}.{}'.format(field_type, field))
+    return field_paths
+
+
+def _add_prefix_to_query(user_query: dict):
+    """ Takes user's query and adds the appropriate prefix to the field_names """
+    new_query_dict = user_query.copy()
+    field_paths = _query_field_paths()
     # go through each key of user's dict and append the field_type as a prefix
     id_fields = [
         '{}.id'.format(i)
@@ -89,8 +131,7 @@ def _add_prefix_to_query(user_query: dict):
     for k in list(new_query_dict):
         if k in id_fields:
             continue
-        prefix = q_df.loc[q_df['field'].eq(k), 'field_type'].unique()[0]
-        new_query_dict.update({'{}.{}'.format(prefix, k): new_query_dict[k]})
+        new_query_dict.update({field_paths[k]: new_query_dict[k]})
 
     # remove old keys
     for ok in list(user_query):
@@ -116,18 +157,30 @@ def _create_mongo_query_in(user_query: dict):
     return user_query
 
 
-def query_files(user_query: dict):
+def query_files(user_query: dict, refresh: bool = False):
     """ 
     POST request to ledger by submitting user's query parameters
     
     Parameters:
         user_query (dict): dictionary where for each key:value pair, the value must be of type list.
+        refresh (bool): if the query cache is enabled, ignore any cached result
     Returns:
         response payload
     Example: 
         query_files(user_query={'cohortGuid' : ['FH1']})
     """
 
+    query_dict = _file_search_filter(user_query)
+    endpoint = hise_url('ledger', 'file_search_path')
+    return hqc.cached_query(
+        endpoint, {"filter": query_dict},
+        lambda: parse_hise_response(get_session().post(
+            endpoint, data=json.dumps({"filter": query_dict})))['payload'],
+        refresh)
+
+
+def _file_search_filter(user_query: dict):
+    """ Converts a user's {field: [values]} file query to a ledger mongo filter """
     assert 'fileType' in user_query.keys(
     ), "fileType must be in your query dictionary"
     query_dict = user_query.copy()
@@ -138,15 +191,54 @@ def query_files(user_query: dict):
 
     # take the user's query and reformat it using mongo  query language
     query_dict.update((k, {'$in': v}) for k, v in query_dict.items())
+    return query_dict
 
-    endpoint = "https://{s}/{de}".format(
-        s=get_from_metadata_server(server_id_path),
-        de=CONFIG['LEDGER']['FILE_SEARCH_PATH'])
-    obj = parse_hise_response(
-        requests.post(endpoint,
-                      data=json.dumps({"filter": query_dict}),
-                      headers=get_bearer_token_header()))
-    return obj['payload']
+
+def sync_descriptor_index(query_dict: dict, full: bool = False):
+    """
+    Copies the file descriptors matching a query into the local descriptor index, so
+    get_file_descriptors(query_dict, offline=True) can answer it and narrower queries
+    without HISE. After the first sync only descriptors whose lastUpdated or
+    labLastModified is at least as new as the last sync are requested. Every
+    [DESCRIPTOR_INDEX] FULL_SYNC_SECONDS the whole query is requested again, and files
+    HISE no longer returns for it are dropped from the index.
+
+    Parameters:
+        query_dict (dict): dictionary that contains query parameters. Must include fileType
+        full (bool): request every matching descriptor, not just the changed ones
+    Returns:
+        number of descriptors added or updated
+    Example:
+        hp.sync_descriptor_index({'fileType': ['scRNA-seq-labeled'], 'cohortGuid': ['FH1']})
+    """
+    validate_user_query_fields(query_dict)
+    index = hdi.get_descriptor_index()
+    scope = hqc.normalize_query(query_dict)
+    query = _file_search_filter(query_dict)
+    last_full = index.last_full_sync(scope)
+    full_sync_seconds = CONFIG['DESCRIPTOR_INDEX']['FULL_SYNC_SECONDS']
+    if last_full is None or time.time() - last_full > full_sync_seconds:
+        full = True
+    last_updated, lab_last_modified = index.get_watermark(scope)
+    # $gte also picks up descriptors written after the last sync with the same
+    # timestamp. Those seen already are just upserted again
+    changed = []
+    if last_updated is not None and not full:
+        changed.append({'lastUpdated': {'$gte': last_updated}})
+    if lab_last_modified is not None and not full:
+        changed.append({'labLastModified': {'$gte': lab_last_modified}})
+    if len(changed) > 0:
+        query['$or'] = changed
+
+    endpoint = hise_url('ledger', 'file_search_path')
+    obj = parse_hise_response(get_session().post(endpoint,
+                                                 data=json.dumps(
+                                                     {"filter": query})))
+    payload = obj.get('payload') or []
+    index.sync(scope, payload, full=full)
+    # offline searches tie plain field names to the same sections HISE does
+    index.set_field_paths(_query_field_paths())
+    return len(payload)
 
 
 def validate_user_query_fields(query):
@@ -162,12 +254,27 @@ def validate_user_query_fields(query):
     return
 
 
-def get_file_descriptors(query_dict: dict = None):
+def get_file_descriptors(query_dict: dict = None,
+                         offline: bool = False,
+                         n_jobs: int = None,
+                         compact: bool = None,
+                         backend: str = 'pandas',
+                         refresh: bool = False):
     """ 
     Retrieves file descriptors based on user's query.
 
     Parameters:
         query_dict (dict): dictionary that contains query parameters
+        offline (bool): answer the query from the local descriptor index instead of HISE.
+            See sync_descriptor_index()
+        n_jobs (int): processes used to reshape the descriptors, -1 for every core.
+            Defaults to [FORMAT] N_JOBS
+        compact (bool): store repetitive string columns as categoricals and parse the
+            last modified timestamps. None does so for results of [FORMAT] COMPACT_MIN_ROWS
+            rows or more. pandas only
+        backend (str): 'pandas', or 'arrow'/'polars' for pyarrow/polars tables built
+            straight from the descriptors
+        refresh (bool): if the query cache is enabled, ignore any cached result
     Returns:
         dictionary of data.frame objects
     Examples:
@@ -178,55 +285,33 @@ def get_file_descriptors(query_dict: dict = None):
         df_dict['specimens'] # specimen df
     """
 
-    def _append_descriptors(dict_df, new_dict_desc):
-        dict_df['descriptors'] = pd.concat(
-            [new_dict_desc['descriptors'], dict_df['descriptors']], axis=0)
-        dict_df['labResults'] = pd.concat(
-            [new_dict_desc['labResults'], dict_df['labResults']], axis=0)
-        dict_df['specimens'] = pd.concat(
-            [new_dict_desc['specimens'], dict_df['specimens']], axis=0)
-        return dict_df
-
     assert 'fileType' in query_dict.keys(
     ), 'fileType field must be in the your query dictionary.'
+    hf.check_backend(backend)
     # get a list of descriptor objects
-    if query_dict is not None:
+    if offline:
+        obj = hdi.get_descriptor_index().search(query_dict)
+    else:
         validate_user_query_fields(query_dict)
-    obj = query_files(query_dict)
-
-    dict_df = {
-        'descriptors': pd.DataFrame(),
-        'labResults': pd.DataFrame(),
-        'specimens': pd.DataFrame()
-    }
-    for this_desc in obj:
-        try:
-            dict_df = _append_descriptors(dict_df,
-                                          hf.reshape_descriptors(this_desc))
-        except:
-            raise Exception(
-                "appending descriptor failed. descriptor: {}".format(
-                    this_desc))
-    return dict_df
+        obj = query_files(query_dict, refresh=refresh)
+        if CONFIG['DESCRIPTOR_INDEX']['ENABLED']:
+            # keep the index warm for follow-up offline queries. obj is every
+            # file matching the query, so it counts as a full sync of it
+            hdi.get_descriptor_index().sync(hqc.normalize_query(query_dict),
+                                            obj,
+                                            full=True)
+
+    # each table is built once, with rows in the order the query returned them
+    dict_df = hf.descriptors_to_df(obj, n_jobs=n_jobs, backend=backend)
+    if backend != 'pandas':
+        return dict_df
+    return hf.compact_frames(dict_df, compact)
 
 
-def post_query(file_list: list = None,
-               query_id: str = None,
-               query_dict: dict = None):
-    """ 
-    creates a response object from POST request to a Hydration endpoint
-    Parameters:
-        file_list : list
-            - list of file_ids
-        query_id : str
-            - query_id obtained from HISE's Advanced Search
-        query_dict : dict
-            - dictionary that contains query parameters
-    Output:
-        obj : dict
-            - JSON output from POST request
-    """
-    # make sure users only use 1 parameter
+def _check_query_args(file_list: list = None,
+                      query_id: list = None,
+                      query_dict: dict = None):
+    """ Makes sure users only use 1 of file_list, query_id and query_dict """
     if file_list is not None:
         assert type(file_list) is list
         assert (query_id is None) & (query_dict is None)
@@ -240,36 +325,97 @@ def post_query(file_list: list = None,
     if (file_list != None) & (type(file_list) is not list):
         raise TypeError("You must pass a list of file ids to read_files")
 
+
+def _expand_file_ids(file_list: list = None,
+                     query_id: list = None,
+                     query_dict: dict = None,
+                     refresh: bool = False):
+    """ Returns the deduped list of file ids a file_list, query_id or query_dict refers to """
+    _check_query_args(file_list, query_id, query_dict)
+
     # if user submits query, do the query and grab fileIds
     if query_dict is not None:
-        payload = query_files(query_dict)
+        payload = query_files(query_dict, refresh=refresh)
         file_list = []
         if payload is None:
             raise Exception("Query had no matching results")
         for i in range(0, len(payload)):
             file_list += [payload[i]['file']['id']]
-        file_list = set(file_list)
 
     # if user submits a query_id, grab all fileIds associated with that query
     if query_id is not None:
-        q_endpoint = 'https://{s}/{q}/{qid}'.format(
-            s=get_from_metadata_server(server_id_path),
-            q=CONFIG['HYDRATION']['QUERY_SEARCH_PATH'],
-            qid=query_id[0])
-        resp_obj = parse_hise_response(
-            requests.request('POST',
-                             q_endpoint,
-                             headers=get_bearer_token_header()))
+        q_endpoint = hise_url('hydration', 'query_search_path', query_id[0])
+        resp_obj = hqc.cached_query(
+            q_endpoint, None,
+            lambda: parse_hise_response(get_session().post(q_endpoint)),
+            refresh)
         file_list = []
         for o in resp_obj:
             file_list += [o['file']['id']]
-        file_list = list(set(file_list))
 
-    qstr = "&".join(map(lambda x: "id=%s" % x, file_list))
-    endpoint = "https://%s/%s?%s" % (get_from_metadata_server(server_id_path),
-                                     CONFIG['HYDRATION']['FILE_SEARCH_PATH'],
-                                     qstr)
-    resp = requests.request("GET", endpoint, headers=get_bearer_token_header())
+    # dedupe, keeping the order ids were given in
+    return list(dict.fromkeys(str(f) for f in file_list))
+
+
+def _requested_file_ids(file_list: list, obj: list):
+    """
+    Returns the id each hydrated file was requested with, in the order of obj, or
+    Nones if the files came from a query. Hydration answers the deduped file_list
+    in order, and may answer with a replica's id when the user is a guest.
+    """
+    if file_list is None:
+        return [None] * len(obj)
+    return list(dict.fromkeys(str(f) for f in file_list))
+
+
+def _file_id_batches(file_list: list):
+    """ Splits file ids into batches of [HYDRATION] FILE_SEARCH_BATCH_SIZE """
+    batch_size = CONFIG['HYDRATION']['FILE_SEARCH_BATCH_SIZE']
+    return [
+        file_list[i:i + batch_size]
+        for i in range(0, len(file_list), batch_size)
+    ]
+
+
+def post_query(file_list: list = None,
+               query_id: str = None,
+               query_dict: dict = None,
+               max_workers: int = None,
+               refresh: bool = False):
+    """ 
+    creates a response object from POST request to a Hydration endpoint
+    Parameters:
+        file_list : list
+            - list of file_ids
+        query_id : str
+            - query_id obtained from HISE's Advanced Search
+        query_dict : dict
+            - dictionary that contains query parameters
+        max_workers : int
+            - max number of batches of [HYDRATION] FILE_SEARCH_BATCH_SIZE ids requested at once
+        refresh : bool
+            - if the query cache is enabled, ignore cached query_dict or query_id results
+    Output:
+        obj : dict
+            - JSON output from POST request
+    """
+    file_list = _expand_file_ids(file_list, query_id, query_dict, refresh)
+
+    # long query strings get cut off by proxies, so ask for the files in batches
+    batches = _file_id_batches(file_list)
+    results = dl.run_parallel(_search_files, batches, max_workers=max_workers)
+    obj = []
+    for result in results:
+        if not result.ok:
+            raise result.error
+        obj += result.value
+    return obj
+
+
+def _search_files(file_ids: list):
+    """ Asks hydration for the descriptors and download urls of a batch of file ids """
+    endpoint = hise_url('hydration', 'file_search_path', args={'id': file_ids})
+    resp = get_session().get(endpoint)
     if resp.status_code != 200:
         raise SystemError("Request to %s failed with status %d. %s" %
                           (endpoint, resp.status_code, resp.text))
@@ -283,7 +429,13 @@ def post_query(file_list: list = None,
 def read_files(file_list: list = None,
                query_id: list = None,
                query_dict: dict = None,
-               to_df: bool = True):
+               to_df: bool = True,
+               max_workers: int = None,
+               chunksize: int = None,
+               usecols: list = None,
+               row_filter=None,
+               backend: str = 'pandas',
+               refresh: bool = False):
     """
     Read the contents of a list of file ids into a hise_file object
     Note: users should only use 1 parameter per function call
@@ -294,35 +446,59 @@ def read_files(file_list: list = None,
         query_dict (dict): dictionary that allows users to submit a query.
             Note: for each key:value pair, the value must be of type list
         to_df (bool):  boolean determining whether result should be returned as a data.frame. 
+        max_workers (int): max number of files downloaded at once. Defaults to [DOWNLOAD] MAX_WORKERS
+        chunksize (int): csv only, with to_df. return 'values' as a generator of data.frames of
+            at most chunksize rows, tagged with filename
+        usecols (list): csv only, with to_df. columns of 'values' to parse
+        row_filter (dict or function): csv only, with to_df. either {column: [values]} or a
+            function taking a data.frame and returning a boolean mask of rows to keep
+        backend (str): with to_df, 'pandas', or 'arrow'/'polars' for pyarrow/polars tables.
+            csv values are read straight into a single table
+        refresh (bool): if the query cache is enabled, ignore any cached query_id or
+            query_dict expansion
 
     Returns:
-        a list of hise_file objects
+        a list of hise_file objects, in the same order hydration returned them
 
     Example: hp.read_files(file_list=['6cb2f536-2d20-4e66-b04d-327dce6870f4'])
     """
-    obj = post_query(file_list, query_id, query_dict)
+    hf.check_backend(backend)
+    obj = post_query(file_list,
+                     query_id,
+                     query_dict,
+                     max_workers=max_workers,
+                     refresh=refresh)
     #each object should be a set of descriptors and a url to download a file
-    response = []
-    idx = 0
     for f in obj:
         if "id" not in f:
             f["id"] = uuid.UUID(int=0)
 
+    # download and convert everything that didn't error out, in parallel
+    to_download = [f for f in obj if "error" not in f]
+    results = iter(
+        dl.run_parallel(cache_and_convert_file_data,
+                        to_download,
+                        max_workers=max_workers))
+
+    response = []
+    for f, requested_id in zip(obj, _requested_file_ids(file_list, obj)):
         if "error" in f:
             fobj = hise_file(f['error']['File'])
             fobj.message = f["error"]["Message"]
             response.append(fobj)
             continue
-        else:
-            response.append(cache_and_convert_file_data(f))
+
+        result = next(results)
+        if result.ok:
+            response.append(result.value)
             cu.log_downloaded_files(f)
 
             # if the response's fileId is different than the ID we original made the request with, then toolchain
             # noticed the request came from a guest account. if that's the case, we just log both files
-            if file_list is not None:
-                this_file_id = file_list[idx]
-                cu.log_replica_file_download(f, this_file_id)
-        idx += 1
+            if requested_id is not None:
+                cu.log_replica_file_download(f, requested_id)
+        else:
+            response.append(_failed_hise_file(f, result.error))
 
     # check if we have successfully read at least 1 file
     all_files_not_found = all(item.status is False for item in response)
@@ -338,11 +514,154 @@ def read_files(file_list: list = None,
                 colored(
                     "The following files failed to download: {}".format(
                         files_not_found), "red"))
-        return hf.hise_file_to_df(response)
+        return hf.hise_file_to_df(
+            [f for f in response if f.status is not False],
+            chunksize=chunksize,
+            usecols=usecols,
+            row_filter=row_filter,
+            backend=backend)
     else:
         return response
 
 
+def iter_files(file_list: list = None,
+               query_id: list = None,
+               query_dict: dict = None,
+               max_workers: int = None,
+               refresh: bool = False):
+    """
+    Yields a hise_file object for each file as soon as it has been downloaded and read,
+    so the first files can be worked on while the rest are still downloading.
+    Note: users should only use 1 parameter per function call
+
+    Parameters:
+        file_list (list): a list of UUIDS to retrieve
+        query_id (str): string value of queryID from Advanced Search
+        query_dict (dict): dictionary that allows users to submit a query.
+            Note: for each key:value pair, the value must be of type list
+        max_workers (int): max number of files downloaded at once. Defaults to [DOWNLOAD] MAX_WORKERS
+        refresh (bool): if the query cache is enabled, ignore any cached query_id or
+            query_dict expansion
+
+    Returns:
+        a generator of hise_file objects, in the order they finish downloading. Files that
+        failed have status False and the reason in their message
+
+    Example:
+        for f in hp.iter_files(query_id=['d9bfd8ea-1d0a-4e06-9a0f-4e8ec4f5ac3b']):
+            print(f.path)
+    """
+    obj = post_query(file_list,
+                     query_id,
+                     query_dict,
+                     max_workers=max_workers,
+                     refresh=refresh)
+    for f in obj:
+        if "error" in f:
+            fobj = hise_file(f['error']['File'])
+            fobj.message = f["error"]["Message"]
+            yield fobj
+
+    # carry the requested id with each file, results come back in any order
+    to_download = [
+        (f, requested_id)
+        for f, requested_id in zip(obj, _requested_file_ids(file_list, obj))
+        if "error" not in f
+    ]
+    for result in dl.iter_parallel(
+            lambda task: cache_and_convert_file_data(task[0]),
+            to_download,
+            max_workers=max_workers):
+        f, requested_id = result.item
+        if not result.ok:
+            yield _failed_hise_file(f, result.error)
+            continue
+        cu.log_downloaded_files(f)
+        if requested_id is not None:
+            cu.log_replica_file_download(f, requested_id)
+        yield result.value
+
+
+def prefetch_files(file_list: list = None,
+                   query_id: list = None,
+                   query_dict: dict = None,
+                   refresh: bool = False):
+    """
+    Starts downloading files into the cache in the background and returns right away.
+    Files are hydrated a batch at a time, just before they're downloaded, by a few
+    low priority workers ([DOWNLOAD] PREFETCH_WORKERS). read_files, iter_files and
+    hise_file.load calls for the same ids don't wait behind the prefetch queue:
+    they download files that haven't been reached yet themselves, share downloads
+    that are in progress and read finished ones straight from the cache.
+    Note: users should only use 1 parameter per function call
+
+    Parameters:
+        file_list (list): a list of UUIDS to retrieve
+        query_id (str): string value of queryID from Advanced Search
+        query_dict (dict): dictionary that allows users to submit a query.
+            Note: for each key:value pair, the value must be of type list
+        refresh (bool): if the query cache is enabled, ignore any cached query_id or
+            query_dict expansion
+    Returns:
+        a PrefetchJob. job.wait() blocks until it's done, job.cancel() drops queued files
+        and job.errors() lists what failed
+
+    Example:
+        job = hp.prefetch_files(query_id=['d9bfd8ea-1d0a-4e06-9a0f-4e8ec4f5ac3b'])
+        first = hp.read_files(file_list=[first_id])
+    """
+    _check_query_args(file_list, query_id, query_dict)
+
+    def _expand():
+        _prefetch_batches(
+            job, _expand_file_ids(file_list, query_id, query_dict, refresh),
+            lambda obj: [_read_cache_task(f) for f in obj if "error" not in f])
+
+    job = dl.PrefetchJob()
+    job.add(dl.get_prefetcher().submit(_expand))
+    return job
+
+
+def _prefetch_batches(job, file_ids: list, to_tasks):
+    """
+    Queues a hydration task per batch of file ids. Each one queues a download for every
+    cache_tracked_file argument dict to_tasks makes out of the hydrated files
+    """
+    prefetcher = dl.get_prefetcher()
+
+    def _hydrate(batch):
+        for task in to_tasks(post_query(file_list=batch)):
+            job.add(prefetcher.submit(lambda t=task: cache_tracked_file(**t)))
+
+    for batch in _file_id_batches(file_ids):
+        # hydration urls expire, so only hydrate a batch once the downloads
+        # queued ahead of it have started
+        job.add(
+            prefetcher.submit(lambda b=batch: _hydrate(b),
+                              priority=dl.prefetch_priority + 1))
+
+
+def _failed_hise_file(file_data: dict, error: Exception):
+    """ Creates an unloaded hise_file for a hydration entry that failed to download """
+    try:
+        this_file_id = cu.parse_file_descriptor_from_hise_file(file_data)[0]
+        fobj = hise_file(this_file_id)
+    except Exception:
+        fobj = hise_file(uuid.UUID(int=0))
+    fobj.message = str(error)
+    return fobj
+
+
+def _report_failed_downloads(results: list, file_ids: list):
+    """ Prints the file ids whose download failed. Returns True if there were none """
+    failed = [(file_ids[r.index], r.error) for r in results if not r.ok]
+    for this_file_id, e in failed:
+        print(
+            colored("failed to download fileID {}: {}".format(this_file_id, e),
+                    "red"))
+    return len(failed) == 0
+
+
 def download_files(file_dict: dict):
     """
     Read the contents of a dictionary of non-result file ids into hise_file objects
@@ -364,8 +683,7 @@ def download_files(file_dict: dict):
     #use a dummy batch id for these files
     download_cache = "%s/%s" % (CONFIG['IDE']['CACHE_DIR'], "downloadable")
     for f_id in file_dict:
-        endpoint = "https://%s/%s/%s" % (get_from_metadata_server(
-            server_id_path), CONFIG['HYDRATION']['DOWNLOAD_PATH'], f_id)
+        endpoint = hise_url('hydration', 'download_path', f_id)
         hf = hise_file(f_id)
         try:
             cache_file(endpoint, file_dict[f_id], download_cache)
@@ -381,7 +699,24 @@ def download_files(file_dict: dict):
 
 
 def cache_and_convert_file_data(file_data: dict):
-    """ Helper function to convert files into a hise_file object """
+    """ 
+    Helper function to convert files into a hise_file object. The file's contents 
+    are only read once hise_file.data_values is accessed.
+    """
+    task = _read_cache_task(file_data)
+    # any valid cached copy will do, wherever it was downloaded to
+    f_path = cache_tracked_file(**task)
+    return hise_file(file_id=task["file_id"],
+                     file_path=f_path,
+                     descriptors=file_data["descriptors"],
+                     file_type=cu.get_filetype(task["file_name"]))
+
+
+def _read_cache_task(file_data: dict):
+    """
+    Returns the cache_tracked_file arguments that save a hydrated file under
+    ~/cache/<batchID>/, the layout read_files, iter_files and prefetch_files share
+    """
     if type(file_data) is not dict:
         raise Exception("Item in response is not a dict, it is a %s." %
                         (type(file_data)))
@@ -398,20 +733,29 @@ def cache_and_convert_file_data(file_data: dict):
     batch_id = "unknown"
     if "batchID" in f_desc and f_desc["batchID"] != "":
         batch_id = f_desc["batchID"]
-    file_dir = "%s/%s" % (CONFIG['IDE']['CACHE_DIR'], batch_id)
-    file_name = f_desc["name"].split("/")[-1]
-    this_filetype = cu.get_filetype(file_name)
-    cache_file(file_data["url"], file_name, file_dir)
-    this_file_values = hf.convert_data_values(
-        '{}/{}'.format(file_dir, file_name), this_filetype)
-    return hise_file(file_id=f_desc["id"],
-                     file_path="%s/%s" % (file_dir, file_name),
-                     descriptors=file_data["descriptors"],
-                     file_type=this_filetype,
-                     data_values=this_file_values)
+    return {
+        'file_id': f_desc["id"],
+        'url': file_data["url"],
+        'file_name': f_desc["name"].split("/")[-1],
+        'file_dir': "%s/%s" % (CONFIG['IDE']['CACHE_DIR'], batch_id),
+        'descriptors': file_data["descriptors"],
+        'any_path': True
+    }
 
 
-def cache_files(file_ids: list = None, query_id: list = None):
+def cache_files(file_ids: list = None,
+                query_id: list = None,
+                max_workers: int = None,
+                refresh: bool = False):
+    """
+    Downloads files into ~/cache/<fileID>/ without reading them into memory.
+
+    Parameters:
+        file_ids (list): a list of UUIDS to download
+        query_id (list): a single queryID from Advanced Search, in a list
+        max_workers (int): max number of files downloaded at once. Defaults to [DOWNLOAD] MAX_WORKERS
+        refresh (bool): if the query cache is enabled, ignore any cached query_id expansion
+    """
 
     # verify input parameters are sane
     if file_ids is not None and type(file_ids) is not list:
@@ -427,48 +771,130 @@ def cache_files(file_ids: list = None, query_id: list = None):
     # check if user submitted a query_id vs file_id
     if query_id is not None:
         # expand file_ids from query_id, if needed
-        resp_obj = post_query(query_id=query_id[0])
+        resp_obj = post_query(query_id=query_id,
+                              max_workers=max_workers,
+                              refresh=refresh)
     else:
-        resp_obj = post_query(file_list=file_ids)
+        resp_obj = post_query(file_list=file_ids, max_workers=max_workers)
 
     # make request to hydration to download every file
-    idx = 0
+    tasks = []
+    task_file_ids = []
     for f in resp_obj:
-
         this_file_id, this_file_name, this_desc = cu.parse_file_descriptor_from_hise_file(
             f)
         download_dir = '{h}/{c}/{id}'.format(h=CONFIG['IDE']['HOME_DIR'],
                                              c=CONFIG['IDE']['CACHE_DIR'],
                                              id=this_file_id)
         f_name = os.path.basename(this_file_name)
-        print("downloading fileID: {}".format(this_file_id))
-        cache_file(url=f['url'], file_name=f_name, file_dir=download_dir)
-        cu.log_downloaded_files(f)
-
-        # if the user passes in a file_list, make sure they didn't get redirected because they
-        # downloaded from a guest account
-        if file_ids is not None:
-            this_file_id = file_ids[idx]
-            cu.log_replica_file_download(f, this_file_id)
+        tasks.append({
+            'file_id': this_file_id,
+            'url': f['url'],
+            'file_name': f_name,
+            'file_dir': download_dir,
+            'descriptors': f['descriptors']
+        })
+        task_file_ids.append(this_file_id)
+    print("downloading {} files".format(len(tasks)))
+    results = dl.run_parallel(lambda t: cache_tracked_file(**t),
+                              tasks,
+                              max_workers=max_workers)
+
+    for f, result, requested_id in zip(resp_obj, results,
+                                       _requested_file_ids(file_ids,
+                                                           resp_obj)):
+        if result.ok:
+            cu.log_downloaded_files(f)
 
-        idx += 1
-    print("Files have been successfully downloaded!")
+            # if the user passes in a file_list, make sure they didn't get redirected because they
+            # downloaded from a guest account
+            if requested_id is not None:
+                cu.log_replica_file_download(f, requested_id)
+    if _report_failed_downloads(results, task_file_ids):
+        print("Files have been successfully downloaded!")
     return
 
 
 def cache_file(url: str, file_name: str, file_dir: str):
+    """ 
+    Streams a file into file_dir/file_name. Interrupted downloads are resumed 
+    from the partially written file the next time this is called.
+    """
+    _download_to_dir(url, file_name, file_dir)
+    return "%s/%s" % (file_dir, file_name)
+
+
+def _download_to_dir(url: str, file_name: str, file_dir: str):
+    """ Downloads a file into file_dir/file_name and returns its digests. See download_file() """
     if not os.path.exists(file_dir):
         pathlib.Path(file_dir).mkdir(parents=True, exist_ok=True)
 
     f_path = "%s/%s" % (file_dir, file_name)
-    resp = requests.request("GET", url, headers=get_bearer_token_header())
-    if resp.status_code != 200:
-        raise SystemError("Request to get file %s failed with status %d. %s" %
-                          (file_name, resp.status_code, resp.text))
-    open(f_path, 'wb').write(resp.content)
+    try:
+        return dl.download_file(url, f_path)
+    except SystemError as e:
+        raise SystemError("Request to get file %s failed. %s" % (file_name, e))
+
+
+def cache_tracked_file(file_id,
+                       url: str,
+                       file_name: str,
+                       file_dir: str,
+                       descriptors=None,
+                       any_path: bool = False,
+                       version: str = None):
+    """
+    Downloads a file unless the cache manifest already has a valid copy of it,
+    and records new downloads in the manifest.
 
+    Parameters:
+        file_id (str): UUID of the file
+        url (str): hydration url of the file
+        file_name (str): name to save the file as
+        file_dir (str): directory to save the file in
+        descriptors: descriptors returned by hydration for the file
+        any_path (bool): accept a cached copy saved somewhere other than file_dir/file_name
+        version (str): server side version of the file. A cached copy of another version is replaced
+    Returns:
+        path of the cached file
+    """
+    f_path = "%s/%s" % (file_dir, file_name)
 
-def read_samples(sample_ids=None, query_dict=None, to_df=True):
+    def _lookup(manifest):
+        entry = manifest.lookup(file_id,
+                                path=None if any_path else f_path,
+                                version=version)
+        return None if entry is None else entry['path']
+
+    def _fetch():
+        manifest = hc.get_manifest()
+        cached_path = _lookup(manifest)
+        if cached_path is not None:
+            return cached_path
+        with hc.file_lock(f_path):
+            # another kernel may have downloaded it while we waited for the lock
+            cached_path = _lookup(manifest)
+            if cached_path is not None:
+                return cached_path
+            digests = _download_to_dir(url, file_name, file_dir)
+            manifest.record(file_id,
+                            f_path,
+                            descriptors=descriptors,
+                            checksum=digests.get('md5'),
+                            version=version,
+                            verified=len(digests['verified']) > 0)
+        return f_path
+
+    # threads asking for the same file share one download
+    return hc.single_flight(os.path.abspath(f_path), _fetch)
+
+
+def read_samples(sample_ids=None,
+                 query_dict=None,
+                 to_df=True,
+                 refresh=False,
+                 compact=None,
+                 backend='pandas'):
     """
     Read or search the SampleStatus materialized view. User should specify one 
     or the other of sample_ids or query.
@@ -478,6 +904,11 @@ def read_samples(sample_ids=None, query_dict=None, to_df=True):
         query_dict (dict): a dictionary object containing search 
             parameters using mongo query language.
         to_df (bool) : If true, returns a data.frame object
+        refresh (bool) : if the query cache is enabled, ignore any cached result
+        compact (bool) : with to_df, store repetitive string columns as categoricals.
+            None does so for results of [FORMAT] COMPACT_MIN_ROWS rows or more. pandas only
+        backend (str) : with to_df, 'pandas', or 'arrow'/'polars' for pyarrow/polars tables
+            built straight from the payload
 
     Returns:
         response payload either in JSON or data.frame
@@ -486,6 +917,7 @@ def read_samples(sample_ids=None, query_dict=None, to_df=True):
         hp.read_samples(sample_ids=['e82714e3-d0c9-46a1-9ea6-62a34cba3265'])
 
     """
+    hf.check_backend(backend)
     # check only 1 optional parameter is being assigned
     if sum(p is not None for p in [sample_ids, query_dict]) != 1:
         raise ValueError(
@@ -516,31 +948,24 @@ def read_samples(sample_ids=None, query_dict=None, to_df=True):
     if query is None:
         raise TypeError(
             "You must specify either a list of sample_ids or a query")
-    endpoint = "https://%s/%s" % (get_from_metadata_server(server_id_path),
-                                  CONFIG['LEDGER']['SAMPLE_SEARCH_PATH'])
-    resp = requests.post(endpoint,
-                         data=json.dumps({"filter": query}),
-                         headers=get_bearer_token_header())
-    if resp.status_code != 200:
-        raise SystemError("Request to %s failed with status %d. %s" %
-                          (endpoint, resp.status_code, resp.text))
-    obj = json.loads(resp.text)
-    if obj['payload'] is None:
-        raise ValueError("User's query resulted in 0 results")
-    if type(obj) is not dict:
-        raise TypeError("Response %s is not a list, it is a %s." %
-                        (resp.text, type(obj)))
-    elif "payload" not in obj:
-        raise TypeError("Response %s contained an empty payload!" % resp.text)
+    endpoint = hise_url('ledger', 'sample_search_path')
+    payload = hqc.cached_query(endpoint, {"filter": query},
+                               lambda: _post_ledger_search(endpoint, query),
+                               refresh)
     if to_df:
-        return hf.sample_to_df(obj["payload"])
+        if backend != 'pandas':
+            return hf.sample_to_df(payload, backend=backend)
+        return hf.compact_frames(hf.sample_to_df(payload), compact)
     else:
-        return obj['payload']
+        return payload
 
 
 def read_subjects(subject_ids: str = None,
                   query_dict: dict = None,
-                  to_df: bool = True):
+                  to_df: bool = True,
+                  refresh: bool = False,
+                  compact: bool = None,
+                  backend: str = 'pandas'):
     """
     Read or search the Subject materialized view.User should specify one or the 
     other of subject_ids or query
@@ -550,11 +975,17 @@ def read_subjects(subject_ids: str = None,
         query_dict (dict): a dictionary object containing search parameters 
             using mongo query language
         to_df (bool): If true, returns a data.frame 
+        refresh (bool): if the query cache is enabled, ignore any cached result
+        compact (bool): with to_df, store repetitive string columns as categoricals.
+            None does so for results of [FORMAT] COMPACT_MIN_ROWS rows or more. pandas only
+        backend (str): with to_df, 'pandas', or 'arrow'/'polars' for a pyarrow/polars table
+            built straight from the payload
 
     Returns:
         response payload as a data.frame or JSON 
 
     """
+    hf.check_backend(backend)
     if sum(p is not None for p in [subject_ids, query_dict]) != 1:
         raise ValueError(
             "You must specify either subject_ids or query_dict, but not both.")
@@ -579,73 +1010,34 @@ def read_subjects(subject_ids: str = None,
         raise TypeError(
             "You must specify either a list of subject_ids or a query")
 
-    endpoint = "https://%s/%s" % (get_from_metadata_server(server_id_path),
-                                  CONFIG['LEDGER']['SUBJECT_SEARCH_PATH'])
-    resp = requests.post(endpoint,
-                         data=json.dumps({"filter": query}),
-                         headers=get_bearer_token_header())
+    endpoint = hise_url('ledger', 'subject_search_path')
+    payload = hqc.cached_query(endpoint, {"filter": query},
+                               lambda: _post_ledger_search(endpoint, query),
+                               refresh)
+    if to_df:
+        if backend != 'pandas':
+            return hf.subject_to_df(payload, backend=backend)
+        return hf.compact_frames(hf.subject_to_df(payload), compact)
+    else:
+        return payload
+
 
+def _post_ledger_search(endpoint: str, query: dict):
+    """ POSTs a mongo filter to a ledger search endpoint and returns the payload """
+    resp = get_session().post(endpoint, data=json.dumps({"filter": query}))
     if resp.status_code != 200:
         raise SystemError("Request to %s failed with status %d. %s" %
                           (endpoint, resp.status_code, resp.text))
 
     obj = json.loads(resp.text)
-    if obj['payload'] is None:
-        raise ValueError("User's query resulted in 0 results")
     if type(obj) is not dict:
         raise TypeError("Response %s is not a list, it is a %s." %
                         (resp.text, type(obj)))
     elif "payload" not in obj:
-        raise TypeError("Response %s contained an empty payload!" % resp.test)
-    if to_df:
-        return hf.subject_to_df(obj["payload"])
-    else:
-        return obj["payload"]
-
-
-def get_server(service):
-    test_hydration_server = os.getenv("TEST_HYDRATION_SERVER")
-    test_toolchain_server = os.getenv("TEST_TOOLCHAIN_SERVER")
-    test_tracer_server = os.getenv("TEST_TRACER_SERVER")
-    test_ledger_server = os.getenv("TEST_LEDGER_SERVER")
-    if service == "hydration" and test_hydration_server is not None:
-        return test_hydration_server
-    elif service == "toolchain" and test_toolchain_server is not None:
-        return test_toolchain_server
-    elif service == "tracer" and test_tracer_server is not None:
-        return test_tracer_server
-    elif service == "ledger" and test_ledger_server is not None:
-        return test_ledger_server
-    else:
-        return get_from_metadata_server(server_id_path)
-
-
-def hise_url(service: str,
-             config_path: str,
-             resource: str = None,
-             args: dict = None):
-    if service.upper() not in CONFIG:
-        raise ValueError("%s is not a known HISE service" % service)
-    if config_path.upper() not in CONFIG[service.upper()]:
-        raise ValueError("%s is not a known path in %s service" %
-                         (config_path, service))
-
-    server = get_server(service)
-    protocol = "http" if "localhost" in server else "https"
-    url = "%s://%s/%s" % (protocol, server,
-                          CONFIG[service.upper()][config_path.upper()])
-    if resource is not None:
-        if type(resource) is not str:
-            raise ValueError("resource argument was a %s, not a string" %
-                             (type(resource)))
-        url += "/%s" % resource
-
-    if args is not None:
-        if type(args) is not dict:
-            raise ValueError("query string argument was a %s, not a dict" %
-                             (type(args)))
-        url += "?%s" % (urllib.parse.urlencode(args, doseq=True))
-    return url
+        raise TypeError("Response %s contained an empty payload!" % resp.text)
+    if obj['payload'] is None:
+        raise ValueError("User's query resulted in 0 results")
+    return obj["payload"]
 
 
 def parse_hise_response(resp):
@@ -680,10 +1072,8 @@ def list_filesets(study_space_id):
     """
     # get me all the filesets
     query_dict = {'studySpaceId': study_space_id}
-    obj = parse_hise_response(
-        requests.get(hise_url('tracer', 'file_set'),
-                     params=query_dict,
-                     headers=get_bearer_token_header()))
+    obj = parse_hise_response(get_session().get(
+        hise_url('tracer', 'file_set'), params=query_dict))
 
     # transform to a data.frame
     obj_df = pd.DataFrame(obj)
@@ -697,48 +1087,178 @@ def list_filesets(study_space_id):
     ]].reset_index(drop=True)
 
 
-def cache_filesets(fileset_id, study_space_id):
+def cache_filesets(fileset_id,
+                   study_space_id,
+                   max_workers: int = None,
+                   sync: bool = False,
+                   prune: bool = False):
     """ 
     Downloads all files pertaining to a fileset to a user's workspace.
 
     Parameters: 
         fileset_id (str) : unique identifier for a fileset in a study
         study_space_id (str) : unique identifier for a study in the collaboration space
+        max_workers (int) : max number of files downloaded at once. Defaults to [DOWNLOAD] MAX_WORKERS
+        sync (bool) : only hydrate and download files that are new to the fileset or whose
+            fileset entry changed since they were cached. Everything else is left as is
+        prune (bool) : with sync, also delete cached files that are no longer in the fileset
 
     Example:
         hp.cache_filesets(fileset_title='Reports on why this study is worth it', 
                             study_space_id='a9ddcfa9-e36d-451e-9e00-0f582e09e696')
+        # later, pick up additions and removals
+        hp.cache_filesets(fileset_id, study_space_id, sync=True, prune=True)
     """
     assert fileset_id is not None, "You must specify a fileset_id"
     assert study_space_id is not None, "You must specify a study_space_id"
     assert type(fileset_id) is str, "fileset_id must be of type string"
     assert type(study_space_id) is str, "study_space_id must be of type string"
+    assert not prune or sync, "prune can only be used with sync=True"
+
+    these_file_ids, fileset_files, cache_dir, versions = _fileset_plan(
+        fileset_id, study_space_id)
+
+    if sync:
+        up_to_date = _fileset_up_to_date(these_file_ids, cache_dir, versions)
+        these_file_ids = [f for f in these_file_ids if f not in up_to_date]
+        pruned = _prune_fileset_cache(cache_dir,
+                                      fileset_files) if prune else []
+        print("{} files up to date, {} new or changed, {} removed".format(
+            len(up_to_date), len(these_file_ids), len(pruned)))
+        if len(these_file_ids) == 0:
+            return
+
+    # make requests to hydration
+    obj = post_query(file_list=these_file_ids, max_workers=max_workers)
+
+    tasks = _fileset_tasks(obj, cache_dir, versions)
+    results = dl.run_parallel(lambda t: cache_tracked_file(**t),
+                              tasks,
+                              max_workers=max_workers)
+    _report_failed_downloads(results, [t['file_id'] for t in tasks])
 
+    return
+
+
+def _fileset_plan(fileset_id: str, study_space_id: str):
+    """
+    Looks a fileset up and returns its file ids, its fileIds entries, the directory
+    its files are cached in and the version string of each file
+    """
     # get all the fileIds to download
     fileset_df = list_filesets(study_space_id)
-    if fileset_id is not None:
-        fileset_df_sub = fileset_df.loc[fileset_df['id'].eq(fileset_id), ]
-        these_file_ids = list(fileset_df_sub['fileIds'].item().keys())
-        fileset_title = str(fileset_df_sub['title'].item())
+    fileset_df_sub = fileset_df.loc[
+        fileset_df['id'].eq(fileset_id),
+    ]
 
     # make sure we only have a single fileSet entry we're downloading from
     if len(fileset_df_sub) == 0:
         raise ValueError(
             "There is no fileset entry with the title and study specified")
-
-    # make requests to hydration
-    obj = post_query(file_list=these_file_ids)
+    fileset_files = fileset_df_sub['fileIds'].item()
+    these_file_ids = list(fileset_files.keys())
+    fileset_title = str(fileset_df_sub['title'].item())
 
     # save all files in ~/cache/<filesetName>/...
     cache_dir = "%s/%s" % (CONFIG['IDE']['CACHE_DIR'], fileset_title)
+    # the fileset's entry for a file stands in for its server side version
+    versions = {
+        f_id: json.dumps(fileset_files[f_id], sort_keys=True, default=str)
+        for f_id in these_file_ids
+    }
+    return these_file_ids, fileset_files, cache_dir, versions
+
+
+def _fileset_up_to_date(file_ids: list, cache_dir: str, versions: dict):
+    """ Returns the file ids already cached in ~/cache/<filesetName>/<fileID> at their current version """
+    manifest = hc.get_manifest()
+    up_to_date = []
+    for f_id in file_ids:
+        entry = manifest.lookup(f_id,
+                                version=versions[f_id],
+                                file_dir="%s/%s" % (cache_dir, f_id))
+        if entry is not None:
+            up_to_date.append(f_id)
+    return up_to_date
+
+
+def _fileset_tasks(obj: list, cache_dir: str, versions: dict):
+    """ Returns the cache_tracked_file arguments for each hydrated file of a fileset """
+    tasks = []
     for this_obj in obj:
         # split filepath string into path and filename.
         split_filename = os.path.split(this_obj['descriptors']['file']['name'])
         this_file_id = this_obj['descriptors']['file']['id']
         this_filename = split_filename[1]
-        cache_file(
-            url=this_obj['url'],
-            file_name=this_filename,  # just grab the filename (could be a path)
-            file_dir="%s/%s" % (cache_dir, this_file_id))
+        tasks.append({
+            'file_id': this_file_id,
+            'url': this_obj['url'],
+            'file_name':
+            this_filename,  # just grab the filename (could be a path)
+            'file_dir': "%s/%s" % (cache_dir, this_file_id),
+            'descriptors': this_obj['descriptors'],
+            'version': versions.get(this_file_id)
+        })
+    return tasks
+
+
+def prefetch_fileset(fileset_id, study_space_id):
+    """
+    Starts downloading a fileset into ~/cache/<filesetName>/ in the background and
+    returns right away. Files already cached at their current version are skipped.
+    A later cache_filesets(..., sync=True) only fetches what the prefetch hasn't.
 
-    return
+    Parameters:
+        fileset_id (str) : unique identifier for a fileset in a study
+        study_space_id (str) : unique identifier for a study in the collaboration space
+    Returns:
+        a PrefetchJob. job.wait() blocks until it's done, job.cancel() drops queued files
+
+    Example:
+        job = hp.prefetch_fileset(fileset_id, study_space_id)
+    """
+    assert fileset_id is not None, "You must specify a fileset_id"
+    assert study_space_id is not None, "You must specify a study_space_id"
+    assert type(fileset_id) is str, "fileset_id must be of type string"
+    assert type(study_space_id) is str, "study_space_id must be of type string"
+
+    def _plan():
+        these_file_ids, _, cache_dir, versions = _fileset_plan(
+            fileset_id, study_space_id)
+        up_to_date = _fileset_up_to_date(these_file_ids, cache_dir, versions)
+        _prefetch_batches(job,
+                          [f for f in these_file_ids if f not in up_to_date],
+                          lambda obj: _fileset_tasks(obj, cache_dir, versions))
+
+    job = dl.PrefetchJob()
+    job.add(dl.get_prefetcher().submit(_plan))
+    return job
+
+
+def _cached_in_dir(entry: dict, file_dir: str):
+    """ True if a manifest entry's file was saved directly in file_dir """
+    return entry is not None and os.path.dirname(
+        entry['path']) == os.path.abspath(file_dir)
+
+
+def _prune_fileset_cache(cache_dir: str, fileset_files: dict):
+    """
+    Deletes the files cached in ~/cache/<filesetName>/<fileID> for files no longer
+    in the fileset. Only copies the manifest recorded there are touched, anything
+    else the user saved under the fileset's directory is left alone.
+    """
+    manifest = hc.get_manifest()
+    pruned = []
+    for f_id, entries in manifest.entries.items():
+        if f_id in fileset_files:
+            continue
+        file_dir = "%s/%s" % (cache_dir, f_id)
+        for entry in entries:
+            if not _cached_in_dir(entry, file_dir):
+                continue
+            manifest.remove(f_id, path=entry['path'], delete_file=True)
+            if f_id not in pruned:
+                pruned.append(f_id)
+            if len(os.listdir(file_dir)) == 0:
+                os.rmdir(file_dir)
+    return pruned
@@ -3,12 +3,12 @@ import os
 import random
 
 import pandas
-import requests
 import time
 
 import fake_hisepy.utils.utils as cu
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, server_id_path, instance_name_path
+from fake_hisepy.auth.auth import get_from_metadata_server, instance_name_path
 from fake_hisepy.read.read import download_files
+from fake_hisepy.session.session import get_session, hise_url
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -75,10 +75,8 @@ def schedule_notebook(output_files=None,
             return None
 
     print("Scheduling...")
-    headers = get_bearer_token_header()
-    endpoint = "https://%s/%s" % (get_from_metadata_server(server_id_path),
-                                  CONFIG['TOOLCHAIN']['SCHEDULER_PATH'])
-    resp = requests.post(endpoint, json=payload, headers=headers)
+    endpoint = hise_url('toolchain', 'scheduler_path')
+    resp = get_session().post(endpoint, json=payload)
     if resp.status_code != 200:
         raise Exception("Request to %s failed with status %d. %s" %
                         (endpoint, resp.status_code, resp.text))
@@ -309,10 +307,8 @@ class notebook_job:
             print("job id is empty, not reloading")
             return
 
-        headers = get_bearer_token_header()
-        endpoint = "https://%s/%s/%s" % (get_from_metadata_server(
-            server_id_path), CONFIG['TOOLCHAIN']['SCHEDULER_PATH'], self.id)
-        resp = requests.request("GET", endpoint, headers=headers)
+        endpoint = hise_url('toolchain', 'scheduler_path', self.id)
+        resp = get_session().get(endpoint)
         if resp.status_code != 200:
             raise Exception("Request to %s failed with status %d. %s" %
                             (endpoint, resp.status_code, resp.text))
@@ -359,10 +355,8 @@ class trace:
             print("Trace Id is empty, not reloading")
             return
 
-        headers = get_bearer_token_header()
-        endpoint = "https://%s/%s/%s" % (
-            get_from_metadata_server(server_id_path), trace_path, self.id)
-        resp = requests.request("GET", endpoint, headers=headers)
+        endpoint = hise_url('tracer', 'trace_path', self.id)
+        resp = get_session().get(endpoint)
         if resp.status_code != 200:
             raise Exception("Request to %s failed with status %d. %s" %
                             (endpoint, resp.status_code, resp.text))
@@ -0,0 +1,249 @@
+""" session.py
+
+Description: pooled, authenticated http session that every HISE request goes through.
+    Connections are kept alive and reused, requests get default timeouts, and 429/5xx
+    responses are retried with jittered exponential backoff.
+"""
+
+import os
+import random
+import threading
+import time
+import urllib
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, invalidate_bearer_token, server_id_path
+
+from fake_hisepy.config.config import config as CONFIG
+
+# methods that are safe to send twice after a 5xx or a dropped connection.
+# everything may be retried after a 429, since the server didn't process it
+idempotent_methods = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_server(service):
+    test_hydration_server = os.getenv("TEST_HYDRATION_SERVER")
+    test_toolchain_server = os.getenv("TEST_TOOLCHAIN_SERVER")
+    test_tracer_server = os.getenv("TEST_TRACER_SERVER")
+    test_ledger_server = os.getenv("TEST_LEDGER_SERVER")
+    if service == "hydration" and test_hydration_server is not None:
+        return test_hydration_server
+    elif service == "toolchain" and test_toolchain_server is not None:
+        return test_toolchain_server
+    elif service == "tracer" and test_tracer_server is not None:
+        return test_tracer_server
+    elif service == "ledger" and test_ledger_server is not None:
+        return test_ledger_server
+    else:
+        return get_from_metadata_server(server_id_path)
+
+
+def hise_url(service: str,
+             config_path: str,
+             resource: str = None,
+             args: dict = None):
+    if service.upper() not in CONFIG:
+        raise ValueError("%s is not a known HISE service" % service)
+    if config_path.upper() not in CONFIG[service.upper()]:
+        raise ValueError("%s is not a known path in %s service" %
+                         (config_path, service))
+
+    server = get_server(service)
+    protocol = "http" if "localhost" in server else "https"
+    url = "%s://%s/%s" % (protocol, server,
+                          CONFIG[service.upper()][config_path.upper()])
+    if resource is not None:
+        if type(resource) is not str:
+            raise ValueError("resource argument was a %s, not a string" %
+                             (type(resource)))
+        url += "/%s" % resource
+
+    if args is not None:
+        if type(args) is not dict:
+            raise ValueError("query string argument was a %s, not a dict" %
+                             (type(args)))
+        url += "?%s" % (urllib.parse.urlencode(args, doseq=True))
+    return url
+
+
+def _can_resend(kwargs):
+    """ Request bodies that stream from a file can only be sent once """
+    if kwargs.get("files") is not None:
+        return False
+    return not hasattr(kwargs.get("data"), "read")
+
+
+class HiseSession:
+    """ A class representing a pooled, authenticated connection to HISE.
+
+    Attributes:
+        pool_size (int): max number of keep-alive connections kept per host.
+        max_retries (int): number of retries after a 429/5xx response or a dropped connection.
+        backoff_factor (float): base delay, in seconds, of the exponential backoff.
+        timeout (tuple): default (connect, read) timeout, in seconds.
+    """
+
+    def __init__(self,
+                 pool_size: int = None,
+                 max_retries: int = None,
+                 backoff_factor: float = None,
+                 timeout: tuple = None):
+        """ Inits HiseSession object """
+        self.pool_size = pool_size if pool_size is not None else CONFIG[
+            'SESSION']['POOL_MAXSIZE']
+        self.max_retries = max_retries if max_retries is not None else CONFIG[
+            'SESSION']['MAX_RETRIES']
+        self.backoff_factor = backoff_factor if backoff_factor is not None else CONFIG[
+            'SESSION']['BACKOFF_FACTOR']
+        self.backoff_max = CONFIG['SESSION']['BACKOFF_MAX']
+        self.retry_statuses = set(CONFIG['SESSION']['RETRY_STATUSES'])
+        self.timeout = timeout if timeout is not None else (
+            CONFIG['SESSION']['CONNECT_TIMEOUT'],
+            CONFIG['SESSION']['READ_TIMEOUT'])
+
+        # retries are handled in request() so they can be jittered and re-authenticated
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=CONFIG['SESSION']['POOL_CONNECTIONS'],
+            pool_maxsize=self.pool_size,
+            max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def server(self, service: str):
+        """ Returns the host serving a given HISE service """
+        return get_server(service)
+
+    def url(self,
+            service: str,
+            config_path: str,
+            resource: str = None,
+            args: dict = None):
+        """ Returns the url of a HISE endpoint. See hise_url() """
+        return hise_url(service, config_path, resource, args)
+
+    def _backoff(self, attempt, resp=None):
+        """ Seconds to wait before a retry, honoring the server's Retry-After """
+        if resp is not None and resp.headers.get("Retry-After") is not None:
+            try:
+                return min(float(resp.headers["Retry-After"]),
+                           self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_factor * (2**attempt)))
+
+    def request(self, method: str, url: str, auth: bool = True, **kwargs):
+        """
+        Sends a request through the connection pool.
+
+        Parameters:
+            method (str): http method
+            url (str): full url of the request
+            auth (bool): whether to attach the HISE bearer token headers
+            **kwargs: passed through to requests.Session.request
+        Returns:
+            requests.Response object
+        """
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        extra_headers = kwargs.pop("headers", None) or {}
+        resendable = _can_resend(kwargs)
+        attempt = 0
+        reauthenticated = False
+        while True:
+            headers = get_bearer_token_header() if auth else {}
+            headers.update(extra_headers)
+            try:
+                resp = self.session.request(method,
+                                            url,
+                                            headers=headers,
+                                            **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if (resendable and method in idempotent_methods
+                        and attempt < self.max_retries):
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                raise
+
+            # token may have been revoked or expired early. mint a new one, once
+            if resp.status_code == 401 and auth and resendable and not reauthenticated:
+                resp.close()
+                invalidate_bearer_token()
+                reauthenticated = True
+                continue
+
+            if (resp.status_code in self.retry_statuses and resendable
+                    and attempt < self.max_retries and
+                (method in idempotent_methods or resp.status_code == 429)):
+                delay = self._backoff(attempt, resp)
+                resp.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return resp
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def get_session():
+    """ Returns the process-wide HiseSession, creating it on first use """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = HiseSession()
+    return _session
+
+
+def configure_session(pool_size: int = None,
+                      max_retries: int = None,
+                      backoff_factor: float = None,
+                      timeout: tuple = None):
+    """
+    Replaces the process-wide HiseSession with one using the given settings.
+    Unspecified settings fall back on the [SESSION] section of config.toml.
+
+    Parameters:
+        pool_size (int): max number of keep-alive connections kept per host
+        max_retries (int): number of retries after a 429/5xx response or a dropped connection
+        backoff_factor (float): base delay, in seconds, of the exponential backoff
+        timeout (tuple): default (connect, read) timeout, in seconds
+    Returns:
+        the new HiseSession
+    Example:
+        configure_session(pool_size=64, timeout=(10, 600))
+    """
+    global _session
+    with _session_lock:
+        old_session = _session
+        _session = HiseSession(pool_size=pool_size,
+                               max_retries=max_retries,
+                               backoff_factor=backoff_factor,
+                               timeout=timeout)
+    if old_session is not None:
+        old_session.close()
+    return _session
@@ -2,11 +2,9 @@ import json
 import os
 
 import pandas as pd
-import requests
 
 import fake_hisepy.utils.utils as cu
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, server_id_path
-from fake_hisepy.read.read import hise_url
+from fake_hisepy.session.session import get_session, hise_url
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -30,16 +28,14 @@ def upload_file_to_private_folder(folder_name: str, file_path: str):
     url = hise_url('hydration',
                    'user_folder_path',
                    resource='%s/files' % (folder_name))
-    resp = cu.parse_hise_response(
-        requests.post(url, files=this_file, headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().post(url, files=this_file))
     return resp
 
 
 def list_files_in_all_private_folders():
     ''' Returns a data.frame of all private folders and files that are within each '''
     url = hise_url('hydration', 'user_folder_path')
-    resp = cu.parse_hise_response(
-        requests.get(url, headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().get(url))
     return pd.DataFrame(resp)
 
 
@@ -55,8 +51,7 @@ def list_files_in_private_folder(folder_name=None):
     url = hise_url('hydration',
                    'user_folder_path',
                    resource='%s/files' % (folder_name))
-    resp = cu.parse_hise_response(
-        requests.get(url, headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().get(url))
     return pd.DataFrame(resp['result'])
 
 
@@ -90,10 +85,8 @@ def create_private_folder(folder_name: str, file_expiration: int = None):
         'fileExpiration': file_expiration
     }
     url = hise_url('hydration', 'user_folder_path')
-    resp = cu.parse_hise_response(
-        requests.post(url,
-                      data=json.dumps(folder_info),
-                      headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().post(
+        url, data=json.dumps(folder_info)))
 
     return resp
 
@@ -119,10 +112,8 @@ def move_file_in_private_folder(file_name: str, source_folder: str,
                    resource='%s/files/%s' % (source_folder, file_name))
     file_info = {'newFolder': destination_folder}
 
-    resp = cu.parse_hise_response(
-        requests.put(url,
-                     data=json.dumps(file_info),
-                     headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().put(
+        url, data=json.dumps(file_info)))
     return resp
 
 
@@ -140,8 +131,7 @@ def delete_file_in_private_folder(folder_name: str, file_name: str):
     url = hise_url('hydration',
                    'user_folder_path',
                    resource='%s/files/%s' % (folder_name, file_name))
-    resp = cu.parse_hise_response(
-        requests.delete(url, headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().delete(url))
     return resp
 
 
@@ -162,7 +152,7 @@ def download_from_private_folder(folder_name: str, file_name: str):
     url = hise_url('hydration',
                    'user_folder_path',
                    resource='%s/files/%s' % (folder_name, file_name))
-    resp = requests.get(url, headers=get_bearer_token_header(), stream=True)
+    resp = get_session().get(url, stream=True)
 
     # assign download path
     dest_path = '{}/{}/{}'.format(os.getcwd(), folder_name, file_name)
@@ -191,10 +181,8 @@ def rename_file_in_private_folder(folder_name: str, old_file_name: str,
     url = hise_url('hydration',
                    'user_folder_path',
                    resource='%s/files/%s' % (folder_name, old_file_name))
-    resp = cu.parse_hise_response(
-        requests.put(url,
-                     data=json.dumps(file_info),
-                     headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().put(
+        url, data=json.dumps(file_info)))
     return resp
 
 
@@ -211,6 +199,5 @@ def delete_private_folder(folder_name):
     url = hise_url('hydration',
                    'user_folder_path',
                    resource='%s' % (folder_name))
-    resp = cu.parse_hise_response(
-        requests.delete(url, headers=get_bearer_token_header()))
+    resp = cu.parse_hise_response(get_session().delete(url))
     return resp
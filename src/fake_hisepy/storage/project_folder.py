@@ -7,14 +7,14 @@ import json
 import os
 
 import pandas as pd
-import requests
 import pyreadr
 import datetime
 from google.cloud import storage
 
 import fake_hisepy.utils.utils as cu
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, server_id_path
+from fake_hisepy.auth.auth import get_from_metadata_server, server_id_path
 from fake_hisepy.read.read import hise_file
+from fake_hisepy.session.session import get_session
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -29,7 +29,7 @@ def list_project_folders():
         ser=get_from_metadata_server(server_id_path),
         hy=CONFIG['HYDRATION']['HYDRATION_NAME'],
         pfe=CONFIG['PROJECT_FOLDER']['PROJECT_FOLDER_ENDPOINT'])
-    resp = requests.request("GET", url, headers=get_bearer_token_header())
+    resp = get_session().get(url)
     if resp.status_code != 200:
         raise SystemError("Request to {} failed with status {}".format(
             url, resp.status_code))
@@ -56,9 +56,7 @@ def list_files_in_project_folder(folder_name):
         hy=CONFIG['HYDRATION']['HYDRATION_NAME'],
         pfe=CONFIG['PROJECT_FOLDER']['PROJECT_FOLDER_ENDPOINT'],
         f='files')
-    resp = requests.post(url,
-                         data=json.dumps(folder),
-                         headers=get_bearer_token_header())
+    resp = get_session().post(url, data=json.dumps(folder))
     if resp.status_code != 200:
         raise SystemError("Request to {} failed with status {}".format(
             url, resp.status_code))
@@ -127,10 +125,7 @@ def download_from_project_folder(folder_name, file_name='', subdir=''):
             truncate_file_name = filen
         else:
             truncate_file_name = filen.split('/', maxsplit=1)[1]
-        resp = requests.request("GET",
-                                url,
-                                headers=get_bearer_token_header(),
-                                stream=True)
+        resp = get_session().get(url, stream=True)
         if resp.status_code != 200:
             raise SystemError("Request to {} failed with status {}".format(
                 url, resp.status_code))
@@ -9,10 +9,10 @@ import json
 import os
 
 import pandas as pd
-import requests
 
 import fake_hisepy.utils.utils as cu
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, server_id_path
+from fake_hisepy.auth.auth import get_from_metadata_server, server_id_path
+from fake_hisepy.session.session import get_session
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -28,7 +28,7 @@ def list_project_stores():
         ser=get_from_metadata_server(server_id_path),
         hy=CONFIG['HYDRATION']['HYDRATION_NAME'],
         pfe=CONFIG['PROJECT_STORE']['PROJECT_STORE_ENDPOINT'])
-    resp = requests.request("GET", url, headers=get_bearer_token_header())
+    resp = get_session().get(url)
     if resp.status_code != 200:
         raise SystemError("Request to {} failed with status {}".format(
             url, resp.status_code))
@@ -56,9 +56,7 @@ def list_files_in_project_store(store_name):
         hy=CONFIG['HYDRATION']['HYDRATION_NAME'],
         pfe=CONFIG['PROJECT_STORE']['PROJECT_STORE_ENDPOINT'],
         f='files')
-    resp = requests.post(url,
-                         data=json.dumps(store),
-                         headers=get_bearer_token_header())
+    resp = get_session().post(url, data=json.dumps(store))
     if resp.status_code != 200:
         raise SystemError("Request to {} failed with status {}".format(
             url, resp.status_code))
@@ -92,10 +90,7 @@ def download_from_project_store(store_name, file_name='', subdir=''):
             truncate_file_name = filen
         else:
             truncate_file_name = filen.split('/', maxsplit=1)[1]
-        resp = requests.request("GET",
-                                url,
-                                headers=get_bearer_token_header(),
-                                stream=True)
+        resp = get_session().get(url, stream=True)
         if resp.status_code != 200:
             raise SystemError("Request to {} failed with status {}".format(
                 url, resp.status_code))
@@ -225,10 +220,7 @@ def project_store_file_action(store_name, file_name, action):
         fol=store_name,
         fil='files',
         fn=file_name)
-    resp = requests.request("PUT",
-                            url,
-                            data=json.dumps(json_tag),
-                            headers=get_bearer_token_header())
+    resp = get_session().put(url, data=json.dumps(json_tag))
     if resp.status_code != 200:
         message = 'Request to {} failed with status {}'.format(
             url, resp.status_code)
@@ -7,13 +7,13 @@ import tempfile
 import uuid
 
 import plotly.graph_objects as go
-import requests
 
 import fake_hisepy.utils.utils as cu
 import fake_hisepy.auth.auth as auth
-from fake_hisepy.auth.auth import get_from_metadata_server, get_bearer_token_header, instance_name_path
+from fake_hisepy.auth.auth import get_from_metadata_server, instance_name_path
 from fake_hisepy.read.read import parse_hise_response, hise_url
 from fake_hisepy.schedule.schedule import current_notebook
+from fake_hisepy.session.session import get_session
 
 from fake_hisepy.config.config import config as CONFIG
 
@@ -30,26 +30,21 @@ UPLOAD_HARVEST_LOWER_BOUND = CONFIG['TOOLCHAIN'][
 
 def get_study_spaces():
     """ Returns list of studies a user has access to """
-    return parse_hise_response(
-        requests.request("GET",
-                         hise_url("tracer", "study_space_path"),
-                         headers=get_bearer_token_header()))
+    return parse_hise_response(get_session().get(
+        hise_url("tracer", "study_space_path")))
 
 
 def get_files_for_query(query_id):
     """ Returns a list of file_ids pertaining to a HISE query_id """
-    resp = parse_hise_response(
-        requests.post(hise_url("hydration", "query_search_path", query_id),
-                      headers=get_bearer_token_header()))
+    resp = parse_hise_response(get_session().post(
+        hise_url("hydration", "query_search_path", query_id)))
     return list(map(lambda x: x['file']['id'], resp))
 
 
 def get_trace(trace_id):
     """ Returns trace object """
-    trace = parse_hise_response(
-        requests.request("GET",
-                         hise_url("tracer", "trace_path", trace_id),
-                         headers=get_bearer_token_header()))
+    trace = parse_hise_response(get_session().get(
+        hise_url("tracer", "trace_path", trace_id)))
     if len(trace) == 0:
         raise Exception("Trace id %s is invalid" % trace_id)
     return trace[0]
@@ -195,10 +190,10 @@ def upload_files(files: list,
                 file_types[i] if len(file_types) > i else cu.get_filetype(f))
 
     url = hise_url("toolchain", "upload_file_path", args=qargs)
-    headers = get_bearer_token_header()
     if not do_prompt or _user_prompt_upload(prompt_files=files):
-        df_data = parse_hise_response(
-            requests.post(url, headers=headers, json=body, files=uploads))
+        df_data = parse_hise_response(get_session().post(url,
+                                                         json=body,
+                                                         files=uploads))
         return {"trace_id": df_data["TraceId"], "files": files}
     else:
         print('Uploading canceled.')
@@ -289,8 +284,7 @@ def save_visualization(
                                        })
     }
     url = hise_url("toolchain", "visualization_path", "json", args=args)
-    parse_hise_response(
-        requests.post(url, headers=get_bearer_token_header(), files=vis_dict))
+    parse_hise_response(get_session().post(url, files=vis_dict))
     os.remove(tmp_data_file)
     os.remove(tmp_plotly_file)
     return up_res
@@ -388,11 +382,9 @@ class DashAppImg:
             "traceId": upload_resp['trace_id']
         }
         save_url = hise_url("toolchain", "save_dash_app_path", args=save_args)
-        headers = get_bearer_token_header()
         # We don't technically need the save response because it's the same Trace ID,
         # but we'll go through it to help with debugging if save returns something crazy
-        save_resp = parse_hise_response(
-            requests.post(save_url, headers=headers))
+        save_resp = parse_hise_response(get_session().post(save_url))
 
         print("POST toolchain/visualization/dash to save dash app:")
         print(save_resp)
@@ -400,8 +392,7 @@ class DashAppImg:
         deploy_url = hise_url("toolchain",
                               "deploy_dash_app_path",
                               resource=save_resp['TraceId'])
-        deploy_resp = parse_hise_response(
-            requests.post(deploy_url, headers=headers))
+        deploy_resp = parse_hise_response(get_session().post(deploy_url))
 
         print("POST toolchain/deploy/visualization to deploy dash app:")
         print(deploy_resp)
@@ -545,10 +536,10 @@ def save_static_image(image, title, study_space_id=None):
     }
     validate_upload_data(study_space_id, None, title, ["not a file"])
     args = {"studySpaceId": study_space_id, "title": title}
-    return parse_hise_response(
-        requests.post(hise_url("hydration", "upload_path", args=args),
-                      headers=get_bearer_token_header(),
-                      files=img_dict))
+    return parse_hise_response(get_session().post(hise_url("hydration",
+                                                           "upload_path",
+                                                           args=args),
+                                                  files=img_dict))
 
 
 def validate_upload_data(study_space_id, project, title, input_file_ids):
@@ -579,21 +570,16 @@ def load_visualization(trace_id):
         try:
             datauuid = uuid.UUID(ref)
             if datauuid != uuid.UUID(int=0):
-                data = parse_hise_response(
-                    requests.request("GET",
-                                     hise_url("hydration", "download_path",
-                                              format(datauuid)),
-                                     headers=get_bearer_token_header()))
+                data = parse_hise_response(get_session().get(
+                    hise_url("hydration", "download_path", format(datauuid))))
             else:
                 # dataReference was empty UUID. Ignore
                 pass
         except Exception as e:
             print("Failed to load data reference %s: %s" % (ref, format(e)))
 
-    obj = parse_hise_response(
-        requests.request("GET",
-                         hise_url("toolchain", "visualization_path", trace_id),
-                         headers=get_bearer_token_header()))
+    obj = parse_hise_response(get_session().get(
+        hise_url("toolchain", "visualization_path", trace_id)))
     if data is not None:
         obj["data"] = data
     return go.Figure(obj, skip_invalid=True)
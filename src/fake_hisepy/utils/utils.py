@@ -18,6 +18,7 @@ import json
 import pathlib
 import copy
 from fake_hisepy.auth.auth import debug
+import fake_hisepy.download.download as dl
 
 # directory of hisepy package
 _here = os.path.abspath(os.path.dirname(__file__))
@@ -252,9 +253,8 @@ def download_response_content(resp, dest):
     if not os.path.isdir(this_path):
         raise SystemError("unable to create path, %s" % (this_path))
 
-    with open(dest, 'wb') as f:
-        for chunk in resp.iter_content(CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE']):
-            f.write(chunk)
+    # hashed while it's written, and checked against the server's hash
+    dl.write_response(resp, dest, CONFIG['IDE']['DOWNLOAD_CHUNK_SIZE'])
     print('file successfully downloaded: {}'.format(dest))
     return
 
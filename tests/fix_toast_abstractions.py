@@ -73,7 +73,7 @@ class TestAbstractionAppImg:
 
     def test_post_request(self, create_url, create_file_arg, mocker):
 
-        mock_post = mocker.patch('requests.post')
+        mock_post = mocker.patch('fake_hisepy.session.session.HiseSession.post')
         mock_response = mock_post.return_value
         mock_response.status_code = 200
         mock_response.json.return_value = {"status": "success"}
@@ -93,7 +93,7 @@ class TestAbstractionAppImg:
         return
 
     def test_post_static_image(self, mocker, init_test):
-        mock_post = mocker.patch('requests.post')
+        mock_post = mocker.patch('fake_hisepy.session.session.HiseSession.post')
         mock_response = mock_post.return_value
         mock_response.status_code = 200
         mock_response.json.return_value = {"status": "success"}
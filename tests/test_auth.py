@@ -0,0 +1,93 @@
+import base64
+import json
+import time
+
+import pytest
+import requests
+
+import fake_hisepy.auth.auth as auth
+
+
+@pytest.fixture(autouse=True)
+def clear_metadata_cache():
+    auth.invalidate_metadata_cache()
+    yield
+    auth.invalidate_metadata_cache()
+
+
+def test_immutable_metadata_is_resolved_once(mocker):
+    mock_request = mocker.patch('requests.request')
+    mock_request.return_value.status_code = 200
+    mock_request.return_value.text = 'prod.allenimmunology.org'
+
+    for _ in range(5):
+        assert auth.get_from_metadata_server(
+            auth.server_id_path) == 'prod.allenimmunology.org'
+    assert mock_request.call_count == 1
+
+
+def test_unreachable_metadata_server_is_negatively_cached(mocker):
+    mock_request = mocker.patch(
+        'requests.request', side_effect=requests.exceptions.ConnectionError)
+
+    assert auth.get_from_metadata_server(
+        auth.client_id_path) == auth.default_metadata[auth.client_id_path]
+    with pytest.raises(SystemError):
+        auth.get_from_metadata_server(auth.account_guid_path)
+    # second lookup shouldn't have tried the network again
+    assert mock_request.call_count == 1
+
+
+def test_invalidate_metadata_cache(mocker):
+    mock_request = mocker.patch('requests.request')
+    mock_request.return_value.status_code = 200
+    mock_request.return_value.text = 'an-instance'
+
+    auth.get_from_metadata_server(auth.instance_name_path)
+    auth.invalidate_metadata_cache(auth.instance_name_path)
+    auth.get_from_metadata_server(auth.instance_name_path)
+    assert mock_request.call_count == 2
+
+
+def _make_jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({
+        'exp': exp
+    }).encode()).decode().rstrip('=')
+    return 'header.%s.signature' % payload
+
+
+def test_bearer_token_is_reused_until_expiry(mocker):
+    auth.invalidate_bearer_token()
+    mock_mint = mocker.patch('fake_hisepy.auth.auth._mint_bearer_token_header')
+    token = _make_jwt(time.time() + 3600)
+    mock_mint.return_value = ({'Authorization': 'Bearer %s' % token}, token)
+
+    for _ in range(5):
+        assert auth.get_bearer_token_header() == {
+            'Authorization': 'Bearer %s' % token
+        }
+    assert mock_mint.call_count == 1
+    auth.invalidate_bearer_token()
+
+
+def test_bearer_token_without_expiry_is_minted_once(mocker):
+    auth.invalidate_bearer_token()
+    mock_mint = mocker.patch('fake_hisepy.auth.auth._mint_bearer_token_header')
+    mock_mint.return_value = ({'Authorization': 'Bearer debug'}, 'debug')
+
+    for _ in range(5):
+        auth.get_bearer_token_header()
+    assert mock_mint.call_count == 1
+    auth.invalidate_bearer_token()
+
+
+def test_expired_bearer_token_is_reminted(mocker):
+    auth.invalidate_bearer_token()
+    mock_mint = mocker.patch('fake_hisepy.auth.auth._mint_bearer_token_header')
+    token = _make_jwt(time.time() - 10)
+    mock_mint.return_value = ({'Authorization': 'Bearer %s' % token}, token)
+
+    auth.get_bearer_token_header()
+    auth.get_bearer_token_header()
+    assert mock_mint.call_count == 2
+    auth.invalidate_bearer_token()
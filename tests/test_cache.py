@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+from fake_hisepy.cache.cache import (CacheManifest, SingleFlight, file_checksum,
+                                     file_lock)
+from fake_hisepy.format.format import sidecar_suffix
+
+
+def _write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+def test_record_and_lookup(tmp_path):
+    manifest = CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    f_path = _write(tmp_path / 'a.csv', 10)
+    manifest.record('file-a', f_path, descriptors={'file': {'id': 'file-a'}})
+
+    entry = CacheManifest(str(tmp_path / 'manifest.sqlite')).lookup('file-a')
+    assert entry['path'] == os.path.abspath(f_path)
+    assert entry['size'] == 10
+    assert entry['checksum'] == file_checksum(f_path)
+    assert entry['descriptors'] == {'file': {'id': 'file-a'}}
+
+
+def test_modified_or_missing_file_is_invalid(tmp_path):
+    manifest = CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    f_path = _write(tmp_path / 'a.csv', 10)
+    manifest.record('file-a', f_path)
+
+    assert manifest.lookup('file-a', path=str(tmp_path / 'b.csv')) is None
+    _write(tmp_path / 'a.csv', 12)
+    assert manifest.lookup('file-a') is None
+    assert 'file-a' not in manifest.entries
+
+
+def test_verified_files_are_not_rehashed(tmp_path, mocker):
+    manifest = CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    f_path = _write(tmp_path / 'a.csv', 10)
+    manifest.record('file-a',
+                    f_path,
+                    checksum=file_checksum(f_path),
+                    verified=True)
+    mock_checksum = mocker.patch('fake_hisepy.cache.cache.file_checksum')
+
+    assert manifest.lookup('file-a', verify=True) is not None
+    assert mock_checksum.call_count == 0
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    manifest = CacheManifest(str(tmp_path / 'manifest.sqlite'),
+                             quota_mb=2.5 / 1024)
+    for name in ['a', 'b']:
+        manifest.record(name, _write(tmp_path / name, 1024))
+        time.sleep(0.01)
+    manifest.lookup('a')
+    manifest.record('c', _write(tmp_path / 'c', 1024))
+
+    assert sorted(manifest.entries) == ['a', 'c']
+    assert not os.path.exists(tmp_path / 'b')
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def _download():
+        calls.append(1)
+        release.wait(1)
+        return 'cache/file.h5'
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(flight.do('file.h5', _download)))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == ['cache/file.h5'] * 4
+
+
+def test_file_lock_serializes_holders_and_cleans_up(tmp_path):
+    f_path = str(tmp_path / 'a.csv')
+    holders = []
+    overlaps = []
+
+    def _hold():
+        with file_lock(f_path):
+            holders.append(1)
+            overlaps.append(len(holders))
+            time.sleep(0.01)
+            holders.pop()
+
+    threads = [threading.Thread(target=_hold) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert overlaps == [1] * 4
+    assert os.listdir(tmp_path) == []
+
+
+def test_manifests_sharing_a_database_see_each_others_entries(tmp_path):
+    first = CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    second = CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    first.record('file-a', _write(tmp_path / 'a.csv', 10))
+    second.record('file-b', _write(tmp_path / 'b.csv', 10))
+
+    assert sorted(CacheManifest(str(
+        tmp_path / 'manifest.sqlite')).entries) == ['file-a', 'file-b']
+    assert first.lookup('file-b') is not None
+
+
+def test_copies_of_a_file_at_several_paths_are_all_tracked(tmp_path):
+    manifest = CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    os.makedirs(tmp_path / 'fileset')
+    first = manifest.record('file-a', _write(tmp_path / 'a.csv', 10))
+    second = manifest.record('file-a',
+                             _write(tmp_path / 'fileset' / 'a.csv', 20))
+    _write(second['path'] + sidecar_suffix, 5)
+
+    assert len(manifest.entries['file-a']) == 2
+    assert manifest.total_size() == 35
+    assert manifest.lookup('file-a', path=first['path']) is not None
+    assert manifest.lookup('file-a',
+                           file_dir=str(tmp_path / 'fileset'))['size'] == 20
+
+    manifest.remove('file-a', path=first['path'], delete_file=True)
+    assert [e['path'] for e in manifest.entries['file-a']] == [second['path']]
+    assert not os.path.exists(first['path'])
@@ -0,0 +1,83 @@
+from fake_hisepy.cache.descriptor_index import DescriptorIndex
+
+
+def _descriptor(file_id, cohort, file_type, last_updated):
+    return {
+        'file': {
+            'id': file_id,
+            'fileType': file_type
+        },
+        'subject': {
+            'cohortGuid': cohort
+        },
+        'specimens': [{
+            'specimenType': 'PBMC'
+        }, {
+            'specimenType': 'Plasma'
+        }],
+        'lastUpdated': last_updated,
+        'labLastModified': None
+    }
+
+
+def test_search_matches_every_field(tmp_path):
+    index = DescriptorIndex(str(tmp_path / 'index.sqlite'))
+    index.add([
+        _descriptor('a', 'FH1', 'scRNA-seq', '2024-01-01'),
+        _descriptor('b', 'FH2', 'scRNA-seq', '2024-01-02'),
+        _descriptor('c', 'FH1', 'Olink', '2024-01-03')
+    ])
+
+    found = index.search({'fileType': ['scRNA-seq'], 'cohortGuid': ['FH1']})
+    assert [d['file']['id'] for d in found] == ['a']
+    found = index.search({'subject.cohortGuid': ['FH1', 'FH2']})
+    assert [d['file']['id'] for d in found] == ['a', 'b', 'c']
+    assert len(index.search({'specimenType': ['Plasma']})) == 3
+    assert index.search({'fileType': ['Flow']}) == []
+
+
+def test_plain_fields_are_searched_in_their_own_section(tmp_path):
+    index = DescriptorIndex(str(tmp_path / 'index.sqlite'))
+    in_subject = _descriptor('a', 'FH1', 'scRNA-seq', '2024-01-01')
+    in_cohort = _descriptor('b', 'FH2', 'scRNA-seq', '2024-01-01')
+    in_cohort['cohort'] = {'cohortGuid': 'FH1'}
+    index.add([in_subject, in_cohort])
+
+    assert len(index.search({'cohortGuid': ['FH1']})) == 2
+    index.set_field_paths({'cohortGuid': 'cohort.cohortGuid'})
+    found = index.search({'cohortGuid': ['FH1']})
+    assert [d['file']['id'] for d in found] == ['b']
+
+
+def test_updated_descriptors_replace_old_ones(tmp_path):
+    index = DescriptorIndex(str(tmp_path / 'index.sqlite'))
+    index.add([_descriptor('a', 'FH1', 'scRNA-seq', '2024-01-01')])
+    index.add([_descriptor('a', 'FH2', 'scRNA-seq', '2024-02-01')])
+
+    assert index.count() == 1
+    assert index.search({'cohortGuid': ['FH1']}) == []
+
+
+def test_watermark_only_moves_forward(tmp_path):
+    index = DescriptorIndex(str(tmp_path / 'index.sqlite'))
+    assert index.get_watermark('q') == (None, None)
+    index.set_watermark('q', [
+        _descriptor('a', 'FH1', 'scRNA-seq', '2024-01-03'),
+        _descriptor('b', 'FH1', 'scRNA-seq', '2024-01-01')
+    ])
+    index.set_watermark('q', [])
+    assert index.get_watermark('q') == ('2024-01-03', None)
+
+
+def test_full_sync_drops_files_no_longer_returned(tmp_path):
+    index = DescriptorIndex(str(tmp_path / 'index.sqlite'))
+    a = _descriptor('a', 'FH1', 'scRNA-seq', '2024-01-01')
+    b = _descriptor('b', 'FH1', 'scRNA-seq', '2024-01-01')
+    index.sync('fh1', [a, b], full=True)
+    index.sync('all', [b], full=True)
+
+    # a was deleted in HISE, b is still returned for the other scope
+    assert index.sync('fh1', [], full=True) == ['a']
+    found = index.search({'cohortGuid': ['FH1']})
+    assert [d['file']['id'] for d in found] == ['b']
+    assert index.last_full_sync('fh1') is not None
@@ -0,0 +1,270 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import wait
+
+import pytest
+import requests
+
+import fake_hisepy.download.download as dl
+
+
+def test_run_parallel_keeps_input_order():
+    # later items finish first
+    results = dl.run_parallel(lambda x: time.sleep(0.01 * (5 - x)) or x * 2,
+                              list(range(5)),
+                              max_workers=5)
+    assert [r.value for r in results] == [0, 2, 4, 6, 8]
+    assert [r.index for r in results] == list(range(5))
+
+
+def test_run_parallel_captures_errors_per_item():
+
+    def _task(x):
+        if x == 2:
+            raise SystemError("download failed")
+        return x
+
+    results = dl.run_parallel(_task, [1, 2, 3], max_workers=2)
+    assert [r.ok for r in results] == [True, False, True]
+    assert isinstance(results[1].error, SystemError)
+    assert results[2].value == 3
+
+
+def test_run_parallel_is_bounded():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def _task(x):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    dl.run_parallel(_task, list(range(20)), max_workers=3)
+    assert running[1] <= 3
+
+
+def test_iter_parallel_yields_in_completion_order():
+    results = list(
+        dl.iter_parallel(lambda x: time.sleep(0.02 * (3 - x)) or x,
+                         range(4),
+                         max_workers=4))
+    assert [r.value for r in results] == [3, 2, 1, 0]
+
+
+def test_iter_parallel_waits_for_consumer():
+    started = []
+    results = dl.iter_parallel(lambda x: started.append(x) or x,
+                               range(100),
+                               max_workers=2)
+    next(results)
+    time.sleep(0.05)
+    assert len(started) <= 4
+    results.close()
+
+
+def test_invalid_max_workers():
+    with pytest.raises(ValueError):
+        dl.run_parallel(lambda x: x, [1], max_workers=0)
+
+
+class _FakeResponse:
+
+    def __init__(self, status_code, body=b'', headers=None, fail_after=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.text = ''
+        self.fail_after = fail_after
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise requests.exceptions.ChunkedEncodingError("dropped")
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_download_file_resumes_partial_download(tmp_path, mocker):
+    body = bytes(range(256)) * 40
+    calls = []
+
+    def _get(url, headers=None, stream=False):
+        calls.append(headers)
+        if headers is None:
+            return _FakeResponse(200,
+                                 body, {'Content-Length': str(len(body))},
+                                 fail_after=1000)
+        start = int(headers['Range'][6:-1])
+        return _FakeResponse(
+            206, body[start:], {
+                'Content-Length':
+                str(len(body) - start),
+                'Content-Range':
+                'bytes %d-%d/%d' % (start, len(body) - 1, len(body))
+            })
+
+    mocker.patch('fake_hisepy.download.download.get_session'
+                 ).return_value.get.side_effect = _get
+    dest = str(tmp_path / 'file.h5')
+    dl.download_file(url='https://bucket/file.h5', dest=dest, chunk_size=100)
+
+    assert open(dest, 'rb').read() == body
+    assert not os.path.exists(dest + dl.part_suffix)
+    assert calls[1] == {'Range': 'bytes=1000-'}
+
+
+def test_large_files_are_fetched_in_segments(tmp_path, mocker, monkeypatch):
+    monkeypatch.setitem(dl.CONFIG['DOWNLOAD'], 'SEGMENT_THRESHOLD_MB',
+                        1000 / 1024 / 1024)
+    body = os.urandom(1000)
+    ranges = []
+
+    def _get(url, headers=None, stream=False):
+        if headers is None:
+            return _FakeResponse(200, body, {
+                'Content-Length': str(len(body)),
+                'Accept-Ranges': 'bytes'
+            })
+        first, last = map(int, headers['Range'][6:].split('-'))
+        ranges.append((first, last))
+        return _FakeResponse(
+            206, body[first:last + 1], {
+                'Content-Length': str(last + 1 - first),
+                'Content-Range': 'bytes %d-%d/%d' % (first, last, len(body))
+            })
+
+    mocker.patch('fake_hisepy.download.download.get_session'
+                 ).return_value.get.side_effect = _get
+    dest = str(tmp_path / 'file.h5')
+    dl.download_file(url='https://bucket/file.h5',
+                     dest=dest,
+                     chunk_size=64,
+                     segments=3)
+
+    assert open(dest, 'rb').read() == body
+    assert sorted(ranges) == [(0, 333), (334, 667), (668, 999)]
+
+
+class _Crc32c:
+    """ Bitwise crc32c, standing in for google_crc32c.Checksum """
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, chunk):
+        crc = self._crc ^ 0xFFFFFFFF
+        for byte in chunk:
+            crc ^= byte
+            for _ in range(8):
+                crc = (crc >> 1) ^ (dl.crc32c_poly if crc & 1 else 0)
+        self._crc = crc ^ 0xFFFFFFFF
+
+    def digest(self):
+        return self._crc.to_bytes(4, 'big')
+
+
+def test_crc_combine_matches_a_single_pass():
+    first, second = os.urandom(300), os.urandom(77)
+    assert dl.crc_combine(zlib.crc32(first), zlib.crc32(second), len(second),
+                          0xEDB88320) == zlib.crc32(first + second)
+
+    whole = _Crc32c()
+    whole.update(first + second)
+    parts = [_Crc32c(), _Crc32c()]
+    parts[0].update(first)
+    parts[1].update(second)
+    assert dl.crc_combine(int.from_bytes(parts[0].digest(), 'big'),
+                          int.from_bytes(parts[1].digest(), 'big'),
+                          len(second)) == int.from_bytes(
+                              whole.digest(), 'big')
+
+
+def test_segments_are_verified_without_rereading_the_file(
+        tmp_path, mocker, monkeypatch):
+    monkeypatch.setitem(dl.CONFIG['DOWNLOAD'], 'SEGMENT_THRESHOLD_MB',
+                        1000 / 1024 / 1024)
+    monkeypatch.setattr(dl, 'google_crc32c',
+                        type('crc32c', (), {'Checksum': _Crc32c}))
+    body = os.urandom(1000)
+    crc = _Crc32c()
+    crc.update(body)
+    x_goog_hash = 'crc32c=%s,md5=%s' % (base64.b64encode(
+        crc.digest()).decode(), base64.b64encode(
+            hashlib.md5(body).digest()).decode())
+
+    def _get(url, headers=None, stream=False):
+        if headers is None:
+            return _FakeResponse(
+                200, body, {
+                    'Content-Length': str(len(body)),
+                    'Accept-Ranges': 'bytes',
+                    'x-goog-hash': x_goog_hash
+                })
+        first, last = map(int, headers['Range'][6:].split('-'))
+        return _FakeResponse(
+            206, body[first:last + 1], {
+                'Content-Length': str(last + 1 - first),
+                'Content-Range': 'bytes %d-%d/%d' % (first, last, len(body))
+            })
+
+    mocker.patch('fake_hisepy.download.download.get_session'
+                 ).return_value.get.side_effect = _get
+    reread = mocker.spy(dl.StreamHasher, 'update_from_file')
+    digests = dl.download_file('https://bucket/file.h5',
+                               str(tmp_path / 'file.h5'),
+                               chunk_size=64,
+                               segments=3)
+
+    assert reread.call_count == 0
+    assert digests['verified'] == ['crc32c']
+    assert digests['md5'] == hashlib.md5(body).hexdigest()
+
+
+def test_bad_checksum_is_refetched(tmp_path, mocker):
+    body = os.urandom(500)
+    good_md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+    bodies = [body[:-1] + b'x', body]
+
+    def _get(url, headers=None, stream=False):
+        return _FakeResponse(200, bodies.pop(0), {
+            'Content-Length': '500',
+            'x-goog-hash': 'md5=%s' % good_md5
+        })
+
+    mocker.patch('fake_hisepy.download.download.get_session'
+                 ).return_value.get.side_effect = _get
+    dest = str(tmp_path / 'file.csv')
+    digests = dl.download_file('https://bucket/file.csv', dest, chunk_size=64)
+
+    assert open(dest, 'rb').read() == body
+    assert digests['md5'] == hashlib.md5(body).hexdigest()
+    assert digests['verified'] == ['md5']
+    assert bodies == []
+
+
+def test_prefetcher_runs_urgent_tasks_first():
+    prefetcher = dl.Prefetcher(workers=1)
+    release = threading.Event()
+    order = []
+    prefetcher.submit(release.wait)
+    futures = [
+        prefetcher.submit(lambda: order.append('prefetch-%d' % i))
+        for i in range(2)
+    ]
+    futures.append(
+        prefetcher.submit(lambda: order.append('urgent'),
+                          priority=dl.urgent_priority))
+    futures[0].cancel()
+    release.set()
+    wait(futures, timeout=1)
+
+    assert order == ['urgent', 'prefetch-1']
@@ -0,0 +1,305 @@
+import copy
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import fake_hisepy.format.format as hf
+
+
+def test_csv_sidecar_is_reused_until_csv_changes(tmp_path, mocker):
+    pytest.importorskip('pyarrow')
+    f_path = str(tmp_path / 'olink.csv')
+    pd.DataFrame({
+        'assay': ['IL6', 'TNF'],
+        'npx': [1.5, 2.5]
+    }).to_csv(f_path, index=False)
+    df = hf.convert_data_values(f_path, 'csv')
+    assert os.path.exists(f_path + hf.sidecar_suffix)
+
+    spy = mocker.spy(hf.pd, 'read_csv')
+    pd.testing.assert_frame_equal(hf.convert_data_values(f_path, 'csv'),
+                                  df,
+                                  check_dtype=False)
+    assert spy.call_count == 0
+
+    pd.DataFrame({'assay': ['IL6'], 'npx': [3.5]}).to_csv(f_path, index=False)
+    os.utime(f_path, ns=(0, 0))
+    assert list(hf.convert_data_values(f_path, 'csv')['npx']) == [3.5]
+    assert spy.call_count == 1
+
+
+def _csv_hise_file(path, name, df):
+    df.to_csv(path, index=False)
+    return SimpleNamespace(path=str(path),
+                           filetype='csv',
+                           descriptors={'file': {
+                               'name': name
+                           }})
+
+
+def test_iter_csv_values_chunks_columns_and_rows(tmp_path):
+    files = [
+        _csv_hise_file(
+            tmp_path / 'a.csv', 'a.csv',
+            pd.DataFrame({
+                'assay': ['IL6', 'TNF', 'IL6'],
+                'npx': [1, 2, 3],
+                'qc': ['pass'] * 3
+            })),
+        _csv_hise_file(
+            tmp_path / 'b.csv', 'b.csv',
+            pd.DataFrame({
+                'assay': ['IL6'],
+                'npx': [4],
+                'qc': ['warn']
+            }))
+    ]
+    chunks = list(
+        hf.iter_csv_values(files,
+                           chunksize=2,
+                           usecols=['npx'],
+                           row_filter={'assay': ['IL6']}))
+
+    assert [len(c) for c in chunks] == [1, 1, 1]
+    values = pd.concat(chunks, ignore_index=True)
+    assert list(values.columns) == ['npx', 'filename']
+    assert list(values['npx']) == [1, 3, 4]
+    assert list(values['filename']) == ['a.csv', 'a.csv', 'b.csv']
+
+
+def _descriptor(i, specimens):
+    return {
+        'file': {
+            'id': 'file-%d' % i,
+            'name': '%d.csv' % i
+        },
+        'sample': {
+            'sampleKitGuid': 'KT%d' % i
+        },
+        'emr':
+        None,
+        'lab': {
+            'labResults': {
+                'cmv': 'pos'
+            },
+            'revisionHistory': [{
+                'dataHistory': {
+                    'cmv': 'neg',
+                    'ebv': 'neg'
+                },
+                'revisedBy': 'lab'
+            }]
+        },
+        'specimens': [{
+            'specimenGuid': 'sp%d-%d' % (i, j)
+        } for j in range(specimens)],
+        'lastUpdated':
+        '2023-01-0%d' % (i + 1),
+        'labLastModified':
+        None,
+        'surveyLastModified':
+        None
+    }
+
+
+def test_descriptors_to_df_builds_each_table_once():
+    olink = [_descriptor(1, 0), _descriptor(2, 1)]
+    descs = [_descriptor(0, 2), olink]
+    original = copy.deepcopy(descs)
+    dict_df = hf.descriptors_to_df(descs)
+
+    assert descs == original
+    assert list(
+        dict_df['descriptors']['file.id']) == ['file-0', 'file-1', 'file-2']
+    assert list(dict_df['descriptors'].columns) == [
+        'file.id', 'file.name', 'sample.sampleKitGuid', 'lastUpdated',
+        'labLastModified', 'surveyLastModified'
+    ]
+    assert list(dict_df['labResults'].columns) == [
+        'cmv', 'revisionHistory', 'ebv', 'revisedBy'
+    ]
+    assert list(dict_df['labResults']['cmv']) == ['pos'] * 3
+    assert list(dict_df['specimens']['sampleKitGuid']) == ['KT0', 'KT0', 'KT2']
+    assert dict_df['specimens'].index.equals(pd.RangeIndex(3))
+
+
+def test_sample_to_df_builds_tables_from_records():
+    samples = [{
+        'projectGuid':
+        'P1',
+        'sample': {
+            'sampleKitGuid': 'KT%d' % i
+        },
+        'subject': {
+            'subjectGuid': 'S%d' % i
+        },
+        'specimens': [{
+            'specimenGuid': 'sp%d' % i,
+            'volume': '%d' % i,
+            'created_at': '2020-01-0%dT00:00:00Z' % (i + 1)
+        }],
+        'survey': [{
+            'id': i,
+            'answers': {
+                'q1': 'yes'
+            }
+        }] if i else []
+    } for i in range(2)]
+    dict_df = hf.sample_to_df(samples)
+
+    assert list(dict_df['metadata'].columns) == [
+        0, 'projectGuid', 'sample.sampleKitGuid', 'subject.subjectGuid'
+    ]
+    assert list(dict_df['specimens']['volume']) == [0, 1]
+    assert dict_df['specimens']['created_at'].dtype.kind == 'M'
+    assert list(dict_df['survey'].columns) == [
+        'subjectGuid', 'sampleKitGuid', 'projectGuid', 'id', 'answers.q1'
+    ]
+    assert list(dict_df['labResults'][0]) == ['', '']
+    assert list(dict_df['labResults']['sampleKitGuid']) == ['KT0', 'KT1']
+
+
+def test_sample_to_df_matches_concatenating_one_frame_per_sample():
+    # the first sample has empty specimens and survey, the last has neither
+    samples = [{
+        'projectGuid':
+        'P1',
+        'sample': {
+            'sampleKitGuid': 'KT%d' % i
+        },
+        'subject': {
+            'subjectGuid': 'S%d' % i
+        },
+        'specimens': [{
+            'specimenGuid': 'sp%d' % i,
+            'count': i,
+            'flag': True
+        }] if i else [],
+        'survey': [{
+            'id': i,
+            'answers': {
+                'q1': 'yes'
+            }
+        }] if i else []
+    } for i in range(3)]
+    del samples[2]['specimens'], samples[2]['survey']
+    dict_df = hf.sample_to_df(samples)
+
+    specimens = dict_df['specimens']
+    assert list(specimens.columns) == [
+        'subjectGuid', 'sampleKitGuid', 'projectGuid', 'specimenGuid', 'count',
+        'flag', 0
+    ]
+    assert specimens['count'].dtype == 'float64'
+    assert specimens['flag'].dtype == object
+    assert list(specimens['sampleKitGuid']) == ['KT1', 'KT2']
+    assert list(dict_df['survey'].columns) == [
+        'subjectGuid', 'sampleKitGuid', 'projectGuid', 'id', 'answers.q1', 0
+    ]
+    assert dict_df['survey']['id'].dtype == 'float64'
+
+    # all samples have specimens, so nothing is widened
+    dict_df = hf.sample_to_df(samples[1:2])
+    assert list(dict_df['specimens'].columns) == [
+        'specimenGuid', 'count', 'flag', 'subjectGuid', 'sampleKitGuid',
+        'projectGuid'
+    ]
+    assert dict_df['specimens']['count'].dtype == 'int64'
+    assert dict_df['specimens']['flag'].dtype == bool
+
+
+def test_subject_to_df_builds_one_table():
+    subjects = [{
+        'id': 'S%d' % i,
+        'demographics': {
+            'age': 30 + i
+        },
+        'emr': {
+            'patientData': {
+                'visit': i
+            }
+        }
+    } for i in range(3)]
+    subjects[1]['cohort'] = 'FH1'
+    original = copy.deepcopy(subjects)
+    subject_df = hf.subject_to_df(subjects)
+
+    assert subjects == original
+    assert list(subject_df.columns) == [
+        'id', 'demographics.age', 'emr.patientData', 'cohort'
+    ]
+    assert list(subject_df['demographics.age']) == [30, 31, 32]
+    assert subject_df['emr.patientData'][2] == {'visit': 2}
+    with pytest.raises(ValueError):
+        hf.subject_to_df([{'id': 'S0', 'visits': [1]}])
+
+
+def test_descriptors_to_df_partitions_across_processes():
+    descs = [_descriptor(i, i % 3) for i in range(7)]
+    serial = hf.descriptors_to_df(descs, n_jobs=1)
+    parallel = hf.descriptors_to_df(descs, n_jobs=2, partition_size=2)
+
+    for k in serial:
+        pd.testing.assert_frame_equal(parallel[k], serial[k])
+    with pytest.raises(ValueError):
+        hf.descriptors_to_df(descs, n_jobs=0)
+
+
+def test_compact_frames_uses_categoricals_and_datetimes(monkeypatch):
+    descs = [_descriptor(i % 2, 1) for i in range(6)]
+    dict_df = hf.descriptors_to_df(descs)
+    assert hf.compact_frames(
+        dict_df)['descriptors']['file.id'].dtype != 'category'
+
+    monkeypatch.setitem(hf.CONFIG['FORMAT'], 'COMPACT_MIN_ROWS', 6)
+    dict_df = hf.compact_frames(hf.descriptors_to_df(descs))
+    desc_df = dict_df['descriptors']
+    assert desc_df['file.id'].dtype == 'category'
+    assert list(desc_df['file.id']) == ['file-0', 'file-1'] * 3
+    assert desc_df['lastUpdated'].dtype.kind == 'M'
+    # dicts are left alone
+    assert dict_df['labResults']['revisionHistory'].dtype == object
+
+
+def test_arrow_and_polars_backends_build_tables_directly(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pl = pytest.importorskip('polars')
+    descs = [_descriptor(0, 2), [_descriptor(1, 0), _descriptor(2, 1)]]
+    tables = hf.descriptors_to_df(descs, backend='arrow')
+    assert isinstance(tables['descriptors'], pa.Table)
+    assert tables['descriptors'].column_names == list(
+        hf.descriptors_to_df(descs)['descriptors'].columns)
+    assert tables['specimens']['sampleKitGuid'].to_pylist() == [
+        'KT0', 'KT0', 'KT2'
+    ]
+
+    subjects = hf.subject_to_df([{
+        'id': 'S0',
+        'demographics': {
+            'age': 30
+        }
+    }, {
+        'id': 'S1',
+        'demographics': {
+            'age': 'unknown'
+        }
+    }],
+                                backend='polars')
+    assert isinstance(subjects, pl.DataFrame)
+    # values that don't share a type are kept as json text
+    assert subjects['demographics.age'].to_list() == ['30', 'unknown']
+
+    files = [
+        _csv_hise_file(tmp_path / ('%s.csv' % name), '%s.csv' % name,
+                       pd.DataFrame({'npx': [i, i + 1]}))
+        for i, name in enumerate(['a', 'b'])
+    ]
+    for f in files:
+        f.descriptors = _descriptor(0, 0)
+        f.descriptors['file']['name'] = os.path.basename(f.path)
+    values = hf.hise_file_to_df(files, backend='polars')['values']
+    assert values['filename'].to_list() == ['a.csv'] * 2 + ['b.csv'] * 2
+    with pytest.raises(ValueError):
+        hf.hise_file_to_df(files, backend='duckdb')
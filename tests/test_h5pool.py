@@ -0,0 +1,39 @@
+import h5py
+import numpy as np
+
+from fake_hisepy.h5pool.h5pool import H5Handle, H5HandlePool
+
+
+def _h5_files(tmp_path, n):
+    paths = []
+    for i in range(n):
+        path = str(tmp_path / ('result_%d.h5' % i))
+        with h5py.File(path, 'w') as f:
+            f['X'] = np.arange(10) + i
+        paths.append(path)
+    return paths
+
+
+def test_pool_keeps_at_most_max_open_handles(tmp_path):
+    pool = H5HandlePool(max_open=2)
+    handles = [H5Handle(p, pool) for p in _h5_files(tmp_path, 5)]
+    assert pool.open_count() == 0
+
+    for i, handle in enumerate(handles):
+        assert handle['X'][0] == i
+    assert pool.open_count() == 2
+
+    # reopened after being evicted
+    assert handles[0]['X'][1] == 1
+    pool.close_all()
+    assert pool.open_count() == 0
+
+
+def test_handles_in_use_are_not_closed(tmp_path):
+    pool = H5HandlePool(max_open=1)
+    first, second = [H5Handle(p, pool) for p in _h5_files(tmp_path, 2)]
+    with first as f:
+        second['X'][:]
+        assert f.id.valid
+        assert f['X'][2] == 2
+    assert pool.open_count() == 1
@@ -0,0 +1,50 @@
+import pytest
+
+import fake_hisepy.cache.query_cache as hqc
+
+
+@pytest.fixture
+def query_cache(tmp_path):
+    yield hqc.enable_query_cache(path=str(tmp_path / 'queries.sqlite'))
+    hqc.disable_query_cache()
+
+
+def test_equivalent_queries_share_a_key():
+    assert hqc.query_key('ledger/file/q', {
+        'a': {
+            '$in': ['x', 'y']
+        },
+        'b': 1
+    }) == hqc.query_key('ledger/file/q', {
+        'b': 1,
+        'a': {
+            '$in': ['y', 'x']
+        }
+    })
+    assert hqc.query_key('ledger/file/q',
+                         {'a': 1}) != hqc.query_key('ledger/sample/q',
+                                                    {'a': 1})
+
+
+def test_cached_query_reuses_results(query_cache, mocker):
+    fetch = mocker.Mock(return_value=[{'id': 'abc'}])
+    query = {'filter': {'id': {'$in': ['abc']}}}
+
+    assert hqc.cached_query('ledger/file/q', query, fetch) == [{'id': 'abc'}]
+    assert hqc.cached_query('ledger/file/q', query, fetch) == [{'id': 'abc'}]
+    assert fetch.call_count == 1
+
+    hqc.cached_query('ledger/file/q', query, fetch, refresh=True)
+    assert fetch.call_count == 2
+
+    query_cache.ttl = 0
+    hqc.cached_query('ledger/file/q', query, fetch)
+    assert fetch.call_count == 3
+
+
+def test_disabled_cache_always_fetches(mocker):
+    hqc.disable_query_cache()
+    fetch = mocker.Mock(return_value=[])
+    hqc.cached_query('ledger/file/q', None, fetch)
+    hqc.cached_query('ledger/file/q', None, fetch)
+    assert fetch.call_count == 2
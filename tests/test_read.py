@@ -0,0 +1,226 @@
+import json
+import os
+import urllib
+import uuid
+
+import pandas as pd
+
+import fake_hisepy.read.read as hr
+
+
+def _hydration_response(url):
+    ids = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)['id']
+    resp = type('resp', (), {})()
+    resp.status_code = 200
+    resp.text = json.dumps([{'descriptors': {'file': {'id': i}}} for i in ids])
+    return resp
+
+
+def test_post_query_batches_file_ids(mocker, monkeypatch):
+    monkeypatch.setenv('TEST_HYDRATION_SERVER', 'localhost:8080')
+    monkeypatch.setitem(hr.CONFIG['HYDRATION'], 'FILE_SEARCH_BATCH_SIZE', 3)
+    mock_session = mocker.patch('fake_hisepy.read.read.get_session')
+    mock_session.return_value.get.side_effect = _hydration_response
+
+    file_ids = ['id-%d' % i for i in range(10)] + ['id-0']
+    obj = hr.post_query(file_list=file_ids)
+
+    assert [o['descriptors']['file']['id'] for o in obj] == file_ids[:10]
+    assert mock_session.return_value.get.call_count == 4
+
+
+def test_data_values_are_read_lazily(tmp_path, mocker):
+    f_path = tmp_path / 'values.csv'
+    f_path.write_text('a,b\n1,2\n')
+    fobj = hr.hise_file('6cb2f536-2d20-4e66-b04d-327dce6870f4',
+                        file_path=str(f_path),
+                        descriptors={'file': {
+                            'name': 'values.csv'
+                        }})
+    spy = mocker.spy(hr.hf, 'convert_data_values')
+    assert spy.call_count == 0
+
+    assert list(fobj.data_values.columns) == ['a', 'b']
+    fobj.data_values
+    assert spy.call_count == 1
+
+    fobj.release()
+    fobj.data_values
+    assert spy.call_count == 2
+
+
+def test_cache_filesets_sync_only_fetches_the_delta(tmp_path, mocker,
+                                                    monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = hr.hc.CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    mocker.patch('fake_hisepy.read.read.hc.get_manifest',
+                 return_value=manifest)
+    fileset = {'a': {'version': 1}, 'b': {'version': 1}}
+    mocker.patch('fake_hisepy.read.read.list_filesets',
+                 side_effect=lambda _: pd.DataFrame({
+                     'id': ['fs'],
+                     'title': ['my fileset'],
+                     'fileIds': [dict(fileset)]
+                 }))
+    mock_post_query = mocker.patch('fake_hisepy.read.read.post_query',
+                                   side_effect=lambda file_list, max_workers:
+                                   [{
+                                       'url': 'https://example.org/%s' % f,
+                                       'descriptors': {
+                                           'file': {
+                                               'id': f,
+                                               'name': 'dir/%s.csv' % f
+                                           }
+                                       }
+                                   } for f in file_list])
+
+    def _download_file(url, dest):
+        with open(dest, 'w') as f:
+            f.write(url)
+        return {'md5': hr.hc.file_checksum(dest), 'verified': []}
+
+    mocker.patch('fake_hisepy.read.read.dl.download_file',
+                 side_effect=_download_file)
+
+    hr.cache_filesets('fs', 'study', sync=True)
+    assert mock_post_query.call_args.kwargs['file_list'] == ['a', 'b']
+
+    # b changed, c was added and a was removed
+    fileset.pop('a')
+    fileset.update({'b': {'version': 2}, 'c': {'version': 1}})
+    os.makedirs('cache/my fileset/notes')
+    hr.cache_filesets('fs', 'study', sync=True, prune=True)
+    assert mock_post_query.call_args.kwargs['file_list'] == ['b', 'c']
+    assert not os.path.exists('cache/my fileset/a')
+    assert os.path.isdir('cache/my fileset/notes')
+    assert sorted(manifest.entries) == ['b', 'c']
+
+
+def test_prefetched_files_are_read_from_cache(tmp_path, mocker, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = hr.hc.CacheManifest(str(tmp_path / 'manifest.sqlite'))
+    mocker.patch('fake_hisepy.read.read.hc.get_manifest',
+                 return_value=manifest)
+    mocker.patch('fake_hisepy.read.read.dl.get_prefetcher',
+                 return_value=hr.dl.Prefetcher(workers=2))
+    mocker.patch('fake_hisepy.read.read.post_query',
+                 side_effect=lambda file_list, *args, **kwargs: [{
+                     'url':
+                     'https://example.org/%s' % f,
+                     'descriptors': {
+                         'file': {
+                             'id': f,
+                             'name': 'dir/%s.csv' % f,
+                             'batchID': 'b1'
+                         }
+                     }
+                 } for f in file_list])
+    downloaded = []
+
+    def _download_file(url, dest):
+        downloaded.append(url)
+        with open(dest, 'w') as f:
+            f.write('a\n1\n')
+        return {'md5': hr.hc.file_checksum(dest), 'verified': []}
+
+    mocker.patch('fake_hisepy.read.read.dl.download_file',
+                 side_effect=_download_file)
+
+    file_ids = [str(uuid.UUID(int=i)) for i in range(3)]
+    job = hr.prefetch_files(file_list=file_ids)
+    assert job.wait(timeout=5)
+    assert job.errors() == []
+    fobj = hr.hise_file(file_ids[1])
+    fobj.load()
+
+    assert sorted(downloaded) == [
+        'https://example.org/%s' % f for f in file_ids
+    ]
+    assert fobj.path == os.path.abspath('cache/b1/%s.csv' % file_ids[1])
+
+
+def test_iter_files_logs_replicas_against_the_requested_id(mocker):
+    a, b = str(uuid.UUID(int=1)), str(uuid.UUID(int=2))
+    mocker.patch('fake_hisepy.read.read.post_query',
+                 return_value=[{
+                     'error': {
+                         'File': a,
+                         'Message': 'not found'
+                     }
+                 }, {
+                     'url': 'https://example.org/b',
+                     'descriptors': {
+                         'file': {
+                             'id': 'replica-of-b'
+                         }
+                     }
+                 }])
+    mocker.patch('fake_hisepy.read.read.cache_and_convert_file_data',
+                 side_effect=lambda f: f['descriptors']['file']['id'])
+    mocker.patch('fake_hisepy.read.read.cu.log_downloaded_files')
+    mock_log_replica = mocker.patch(
+        'fake_hisepy.read.read.cu.log_replica_file_download')
+
+    files = list(hr.iter_files(file_list=[a, b, a]))
+
+    assert files[1] == 'replica-of-b'
+    assert mock_log_replica.call_args.args[1] == b
+
+
+def test_sync_descriptor_index_drops_descriptors_gone_from_hise(
+        tmp_path, mocker, monkeypatch):
+    index = hr.hdi.DescriptorIndex(str(tmp_path / 'index.sqlite'))
+    mocker.patch('fake_hisepy.read.read.hdi.get_descriptor_index',
+                 return_value=index)
+    mocker.patch('fake_hisepy.read.read.validate_user_query_fields')
+    mocker.patch('fake_hisepy.read.read._query_field_paths', return_value={})
+    mocker.patch('fake_hisepy.read.read._file_search_filter',
+                 side_effect=lambda q: {'file.fileType': {
+                     '$in': ['x']
+                 }})
+    mocker.patch('fake_hisepy.read.read.hise_url', return_value='ledger')
+    filters = []
+    payloads = [[{
+        'file': {
+            'id': f_id,
+            'fileType': 'x'
+        },
+        'lastUpdated': '2024-01-01'
+    } for f_id in ids] for ids in [['a', 'b'], ['b'], ['b']]]
+
+    def _post(endpoint, data):
+        filters.append(json.loads(data)['filter'])
+        return {'payload': payloads[len(filters) - 1]}
+
+    mocker.patch('fake_hisepy.read.read.get_session'
+                 ).return_value.post.side_effect = _post
+    mocker.patch('fake_hisepy.read.read.parse_hise_response',
+                 side_effect=lambda resp: resp)
+
+    hr.sync_descriptor_index({'fileType': ['x']})
+    # a was deleted in HISE. an incremental sync can't tell
+    hr.sync_descriptor_index({'fileType': ['x']})
+    assert filters[1]['$or'] == [{'lastUpdated': {'$gte': '2024-01-01'}}]
+    assert len(index.search({'fileType': ['x']})) == 2
+
+    monkeypatch.setitem(hr.CONFIG['DESCRIPTOR_INDEX'], 'FULL_SYNC_SECONDS', 0)
+    hr.sync_descriptor_index({'fileType': ['x']})
+    assert '$or' not in filters[2]
+    found = index.search({'fileType': ['x']})
+    assert [d['file']['id'] for d in found] == ['b']
+
+
+def test_refresh_reaches_query_expansion(mocker):
+    mock_post_query = mocker.patch('fake_hisepy.read.read.post_query',
+                                   return_value=[])
+    mock_query_files = mocker.patch('fake_hisepy.read.read.query_files',
+                                    return_value=[])
+    mocker.patch('fake_hisepy.read.read.validate_user_query_fields')
+
+    list(hr.iter_files(query_id=['q'], refresh=True))
+    hr.cache_files(query_id=['q'], refresh=True)
+    hr.get_file_descriptors({'fileType': ['x']}, refresh=True)
+
+    assert [c.kwargs['refresh']
+            for c in mock_post_query.call_args_list] == [True, True]
+    assert mock_query_files.call_args.kwargs['refresh'] is True
@@ -0,0 +1,72 @@
+import pytest
+from unittest import mock
+
+import fake_hisepy.session.session as hs
+
+
+def _response(status_code, headers=None):
+    resp = mock.Mock()
+    resp.status_code = status_code
+    resp.headers = headers or {}
+    return resp
+
+
+@pytest.fixture
+def session(mocker):
+    mocker.patch('fake_hisepy.session.session.get_bearer_token_header',
+                 side_effect=lambda: {'Authorization': 'Bearer token'})
+    mocker.patch('fake_hisepy.session.session.time.sleep')
+    return hs.HiseSession(pool_size=4, max_retries=2, backoff_factor=0.01)
+
+
+def test_retries_idempotent_request_on_5xx(session, mocker):
+    mock_request = mocker.patch.object(
+        session.session,
+        'request',
+        side_effect=[_response(503),
+                     _response(502),
+                     _response(200)])
+    assert session.get('https://hise/endpoint').status_code == 200
+    assert mock_request.call_count == 3
+
+
+def test_does_not_retry_post_on_5xx(session, mocker):
+    mock_request = mocker.patch.object(session.session,
+                                       'request',
+                                       return_value=_response(500))
+    assert session.post('https://hise/endpoint').status_code == 500
+    assert mock_request.call_count == 1
+
+
+def test_retries_post_on_429(session, mocker):
+    mock_request = mocker.patch.object(
+        session.session,
+        'request',
+        side_effect=[_response(429, {'Retry-After': '1'}),
+                     _response(200)])
+    assert session.post('https://hise/endpoint').status_code == 200
+    assert mock_request.call_count == 2
+
+
+def test_reauthenticates_once_on_401(session, mocker):
+    mock_invalidate = mocker.patch(
+        'fake_hisepy.session.session.invalidate_bearer_token')
+    mocker.patch.object(session.session,
+                        'request',
+                        side_effect=[_response(401),
+                                     _response(401)])
+    assert session.get('https://hise/endpoint').status_code == 401
+    assert mock_invalidate.call_count == 1
+
+
+def test_auth_headers_and_default_timeout(session, mocker):
+    mock_request = mocker.patch.object(session.session,
+                                       'request',
+                                       return_value=_response(200))
+    session.get('https://hise/endpoint', headers={'Range': 'bytes=0-'})
+    kwargs = mock_request.call_args.kwargs
+    assert kwargs['headers'] == {
+        'Authorization': 'Bearer token',
+        'Range': 'bytes=0-'
+    }
+    assert kwargs['timeout'] == session.timeout